@@ -5,13 +5,39 @@ from .basis import (
     ANOISpace,
     ANOIInMemorySpace,
     ANOIRedis32Space,
+    str_to_array,
     str_to_vec,
+    vec_to_array,
     vec_to_str,
     ANOITrie,
+    ANOIAutomaton,
+    ANOIAutomatonStack,
+    ANOIDecompressor,
+    ANOILexicon,
+    compile_trie,
     root_trie,
+    evict,
+    evict_all,
     ANOITrieProxy,
     ANOINamespace
 )
+from .cached import (
+    ANOICachedSpace,
+)
+from .compact import (
+    ANOICompactSpace,
+)
+from .indexed import (
+    ANOIContentIndex,
+    ANOIIndexedSpace,
+)
+from .mapped import (
+    ANOIMappedSpace,
+    dump_space,
+)
+from .redis64 import (
+    ANOIRedis64Space,
+)
 from .anoitypes import (
     anoi_types,
 )
\ No newline at end of file
@@ -0,0 +1,651 @@
+'''Asynchronous ANOI spaces and tries, for use from asyncio code such as an
+ASGI front end.
+
+AsyncANOISpace mirrors ANOISpace with coroutine methods, and
+AsyncANOIRedis32Space is a redis.asyncio client for the same Redis layout
+as ANOIRedis32Space, so synchronous and asynchronous clients can share a
+namespace.
+'''
+
+import abc
+import collections
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+import redis.asyncio
+
+from . import atf8
+from .basis import (
+    ANOIRedis32Space,
+    ANOIReserved,
+    ANOISpace,
+    ANOITrie,
+    compile_trie,
+    str_to_vec,
+    _REDIS_TRIE_COMPRESS_LUA,
+    _REDIS_TRIE_GET_LUA,
+    _REDIS_TRIE_SET_LUA,
+)
+
+
+NIL = ANOIReserved.NIL.value
+
+
+class AsyncANOISpace(abc.ABC):
+    '''Asynchronous counterpart of ANOISpace.'''
+    # See ANOISpace.server_side_tries.
+    server_side_tries: bool = False
+
+    async def check(self, uid: int) -> None:
+        '''Utility to check that given UID is valid.'''
+        if not await self.is_valid(uid):
+            raise ValueError(f'UID {uid} is not valid.')
+
+    async def close(self) -> None:
+        '''Release resources held by the space.'''
+
+    async def cross(self, uid0: int, uid1: int) -> int:
+        '''Returns uid0 x uid1.'''
+        raise NotImplementedError()
+
+    async def cross_equals(self, uid0: int, uid1: int, uid2: int) -> None:
+        '''Sets uid0 x uid1 = uid2.'''
+        raise NotImplementedError()
+
+    async def free_uid(self, uid: int) -> None:
+        '''Marks UID argument as no longer in use.'''
+        raise NotImplementedError()
+
+    async def get_content(self, uid: int) -> Tuple[int]:
+        '''Returns the content vector for the given UID.'''
+        raise NotImplementedError()
+
+    async def get_keys(self, uid: int) -> Tuple[int]:
+        '''Returns all UIDs for which uid x key is defined.'''
+        raise NotImplementedError()
+
+    async def get_uid(self) -> int:
+        '''Returns a free UID.'''
+        raise NotImplementedError()
+
+    async def get_uids(self, count: int) -> Tuple[int]:
+        '''Returns the given number of free UIDs.'''
+        return tuple([await self.get_uid() for _ in range(count)])
+
+    async def get_version(self) -> int:
+        '''Returns the space's modification counter (see
+        ANOISpace.get_version()).'''
+        raise NotImplementedError()
+
+    async def is_valid(self, uid: int) -> bool:
+        '''Returns True if the UID is valid in this space.'''
+        raise NotImplementedError()
+
+    async def set_content(self, uid: int, content: Tuple[int]) -> None:
+        '''Sets the content vector for the given UID.'''
+        raise NotImplementedError()
+
+    async def validate(self, uid: int) -> bool:
+        '''Ensure the given UID is valid, returning True if it already was.'''
+        raise NotImplementedError()
+
+    async def trie_get_vector(self, root: int, vec: Tuple[int]) -> int:
+        '''See ANOISpace.trie_get_vector().'''
+        raise NotImplementedError()
+
+    async def trie_set_vector(
+        self,
+        root: int,
+        vec: Tuple[int],
+        uid: int
+    ) -> int:
+        '''See ANOISpace.trie_set_vector().'''
+        raise NotImplementedError()
+
+    async def trie_compress(self, root: int, vec: Tuple[int]) -> Tuple[int]:
+        '''See ANOISpace.trie_compress().'''
+        raise NotImplementedError()
+
+    # Batch operations.  These default to awaiting the single atom methods
+    # in turn; backends override them to save round trips.
+
+    async def cross_many(
+        self,
+        pairs: Iterable[Tuple[int, int]]
+    ) -> Tuple[int]:
+        return tuple([await self.cross(uid0, uid1) for uid0, uid1 in pairs])
+
+    async def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        for uid0, uid1, uid2 in triples:
+            await self.cross_equals(uid0, uid1, uid2)
+
+    async def get_content_many(
+        self,
+        uids: Iterable[int]
+    ) -> Tuple[Tuple[int]]:
+        return tuple([await self.get_content(uid) for uid in uids])
+
+    async def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        return tuple([await self.get_keys(uid) for uid in uids])
+
+    async def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        return tuple([await self.is_valid(uid) for uid in uids])
+
+    async def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        for uid, content in items:
+            await self.set_content(uid, content)
+
+
+class AsyncANOISpaceAdapter(AsyncANOISpace):
+    '''Exposes a synchronous space, such as an in-memory or mapped one,
+    through the asynchronous API.  Calls run directly on the event loop, so
+    only wrap spaces that do not block.'''
+    def __init__(self, space: ANOISpace):
+        self.space = space
+
+    async def close(self) -> None:
+        self.space.close()
+
+    async def cross(self, uid0: int, uid1: int) -> int:
+        return self.space.cross(uid0, uid1)
+
+    async def cross_equals(self, uid0: int, uid1: int, uid2: int) -> None:
+        self.space.cross_equals(uid0, uid1, uid2)
+
+    async def free_uid(self, uid: int) -> None:
+        self.space.free_uid(uid)
+
+    async def get_content(self, uid: int) -> Tuple[int]:
+        return self.space.get_content(uid)
+
+    async def get_keys(self, uid: int) -> Tuple[int]:
+        return self.space.get_keys(uid)
+
+    async def get_uid(self) -> int:
+        return self.space.get_uid()
+
+    async def get_uids(self, count: int) -> Tuple[int]:
+        return self.space.get_uids(count)
+
+    async def get_version(self) -> int:
+        return self.space.get_version()
+
+    async def is_valid(self, uid: int) -> bool:
+        return self.space.is_valid(uid)
+
+    async def set_content(self, uid: int, content: Tuple[int]) -> None:
+        self.space.set_content(uid, content)
+
+    async def validate(self, uid: int) -> bool:
+        return self.space.validate(uid)
+
+    async def cross_many(
+        self,
+        pairs: Iterable[Tuple[int, int]]
+    ) -> Tuple[int]:
+        return self.space.cross_many(pairs)
+
+    async def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        self.space.cross_equals_many(triples)
+
+    async def get_content_many(
+        self,
+        uids: Iterable[int]
+    ) -> Tuple[Tuple[int]]:
+        return self.space.get_content_many(uids)
+
+    async def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        return self.space.get_keys_many(uids)
+
+    async def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        return self.space.is_valid_many(uids)
+
+    async def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        self.space.set_content_many(items)
+
+
+class AsyncANOIRedisUIDBlocks:
+    '''Asynchronous counterpart of ANOIRedisUIDBlocks, sharing its counter
+    and free list.'''
+    def __init__(
+        self,
+        db: redis.asyncio.Redis,
+        crnt_key: bytes,
+        free_key: bytes,
+        block_size: int = 1024,
+        version_key: Optional[bytes] = None
+    ):
+        self.db = db
+        self.crnt_key = crnt_key
+        self.free_key = free_key
+        self.block_size = block_size
+        self.version_key = version_key
+        self.pending: collections.deque = collections.deque()
+
+    async def lease(self, count: int) -> None:
+        '''Reserve at least count more candidate UIDs.'''
+        count = max(count, self.block_size)
+        async with self.db.pipeline(transaction=False) as pipe:
+            pipe.lpop(self.free_key, count)
+            pipe.set(
+                self.crnt_key, ANOIReserved.MIN_UNRESERVED.value - 1, nx=True)
+            pipe.incrby(self.crnt_key, count)
+            freed, _, end = await pipe.execute()
+        self.pending.extend(int(uid) for uid in freed or ())
+        self.pending.extend(range(end - count + 1, end + 1))
+
+    async def claim(
+        self,
+        count: int,
+        claim_one: Callable[[Any, int], None]
+    ) -> Tuple[int]:
+        '''See ANOIRedisUIDBlocks.claim().'''
+        result = []
+        pending = self.pending
+        while len(result) < count:
+            needed = count - len(result)
+            if len(pending) < needed:
+                await self.lease(needed - len(pending))
+            candidates = [pending.popleft() for _ in range(needed)]
+            async with self.db.pipeline(transaction=False) as pipe:
+                for uid in candidates:
+                    claim_one(pipe, uid)
+                if self.version_key is not None:
+                    pipe.incr(self.version_key)
+                claimed = (await pipe.execute())[:len(candidates)]
+            result.extend(uid for uid, success in zip(candidates, claimed)
+                if success)
+        return tuple(result)
+
+
+class AsyncANOIRedis32Space(AsyncANOISpace):
+    '''Asynchronous counterpart of ANOIRedis32Space.  Concurrent coroutines
+    share the client's connection pool.
+
+    The namespace's content encoding follows the same rules as for the
+    ANOIRedis32Space constructor.  Since a constructor cannot wait on the
+    server, it is read on first use; ``await AsyncANOIRedis32Space.open(...)``
+    reads it up front instead.
+    '''
+    server_side_tries = True
+
+    itob = staticmethod(ANOIRedis32Space.itob)
+    istob = staticmethod(ANOIRedis32Space.istob)
+    btoi = staticmethod(ANOIRedis32Space.btoi)
+    btois = staticmethod(ANOIRedis32Space.btois)
+
+    def __init__(
+        self,
+        db: Optional[redis.asyncio.Redis] = None,
+        namespace: Optional[str] = None,
+        content_encoding: Optional[str] = None
+    ):
+        if db is None:
+            db = redis.asyncio.Redis()
+        self.db = db
+        self.namespace = (
+            namespace.encode() if namespace is not None else b'') + b'_'
+        self.content_key = self.namespace + b'content'
+        self.crnt_key = self.namespace + b'crnt'
+        self.free_key = self.namespace + b'free'
+        self.encoding_key = self.namespace + b'encoding'
+        self.version_key = self.namespace + b'version'
+        self.uid_blocks = AsyncANOIRedisUIDBlocks(
+            self.db, self.crnt_key, self.free_key,
+            version_key=self.version_key)
+        if content_encoding not in (
+                None, *ANOIRedis32Space.CONTENT_ENCODINGS):
+            raise ValueError(
+                f'unknown content encoding {content_encoding!r}')
+        # The encoding asked for, until _resolve_encoding() has checked it
+        # against the namespace's.
+        self.content_encoding = content_encoding
+        self.encoding_resolved = False
+        self._trie_get = self.db.register_script(_REDIS_TRIE_GET_LUA)
+        self._trie_set = self.db.register_script(_REDIS_TRIE_SET_LUA)
+        self._trie_compress = self.db.register_script(
+            _REDIS_TRIE_COMPRESS_LUA)
+
+    @classmethod
+    async def open(
+        cls,
+        db: Optional[redis.asyncio.Redis] = None,
+        namespace: Optional[str] = None,
+        content_encoding: Optional[str] = None
+    ) -> 'AsyncANOIRedis32Space':
+        '''Connect to a namespace, reading its content encoding.'''
+        space = cls(db, namespace, content_encoding)
+        await space._resolve_encoding()
+        return space
+
+    async def _resolve_encoding(self) -> None:
+        '''Settle the content encoding, following the same rules as the
+        ANOIRedis32Space constructor.  Called before anything that reads or
+        writes contents.'''
+        if self.encoding_resolved:
+            return
+        content_encoding = self.content_encoding
+        stored_encoding = await self.db.get(self.encoding_key)
+        if stored_encoding is not None:
+            stored_encoding = stored_encoding.decode()
+            if content_encoding not in (None, stored_encoding):
+                raise ValueError(f'namespace content is encoded as '
+                    f'{stored_encoding}, not {content_encoding}')
+            content_encoding = stored_encoding
+        elif content_encoding not in (None, 'uint32'):
+            if await self.db.exists(self.content_key):
+                raise ValueError('namespace already holds uint32 content')
+            await self.db.set(self.encoding_key, content_encoding)
+        if content_encoding is None:
+            content_encoding = 'uint32'
+        self.content_encoding = content_encoding
+        if content_encoding == 'atf8':
+            self.encode_content = atf8.encode
+            self.decode_content = atf8.decode
+        else:
+            self.encode_content = self.istob
+            self.decode_content = self.btois
+        self.encoding_resolved = True
+
+    async def close(self) -> None:
+        await self.db.aclose()
+
+    async def cross(self, uid0: int, uid1: int) -> int:
+        result = await self.db.hget(
+            self.namespace + self.itob(uid0), self.itob(uid1))
+        if result is None or len(result) != 4:
+            return NIL
+        return self.btoi(result)
+
+    async def cross_equals(self, uid0: int, uid1: int, uid2: int) -> None:
+        async with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(self.namespace + self.itob(uid0), self.itob(uid1),
+                self.itob(uid2))
+            pipe.incr(self.version_key)
+            await pipe.execute()
+
+    async def free_uid(self, uid: int) -> None:
+        await self.check(uid)
+        uid_bytes = self.itob(uid)
+        async with self.db.pipeline(transaction=False) as pipe:
+            pipe.delete(self.namespace + uid_bytes)
+            pipe.hdel(self.content_key, uid_bytes)
+            pipe.lpush(self.free_key, uid)
+            pipe.incr(self.version_key)
+            await pipe.execute()
+
+    async def get_content(self, uid: int) -> Tuple[int]:
+        await self._resolve_encoding()
+        result = await self.db.hget(self.content_key, self.itob(uid))
+        if result is None:
+            raise ValueError(f'UID {uid} contents not found')
+        return self.decode_content(result)
+
+    async def get_keys(self, uid: int) -> Tuple[int]:
+        result = await self.db.hkeys(self.namespace + self.itob(uid))
+        return tuple(self.btoi(value) for value in result)
+
+    async def get_uid(self) -> int:
+        return (await self.get_uids(1))[0]
+
+    async def get_uids(self, count: int) -> Tuple[int]:
+        # Claiming UIDs creates the content hash, after which the encoding
+        # can no longer be chosen.
+        await self._resolve_encoding()
+        return await self.uid_blocks.claim(
+            count, lambda pipe, uid: pipe.hsetnx(
+                self.content_key, self.itob(uid), b''))
+
+    async def get_version(self) -> int:
+        return int(await self.db.get(self.version_key) or 0)
+
+    async def is_valid(self, uid: int) -> bool:
+        return bool(await self.db.hexists(self.content_key, self.itob(uid)))
+
+    async def set_content(self, uid: int, content: Tuple[int]) -> None:
+        await self.check(uid)
+        await self._resolve_encoding()
+        async with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(self.content_key, self.itob(uid),
+                self.encode_content(content))
+            pipe.incr(self.version_key)
+            await pipe.execute()
+
+    async def validate(self, uid: int) -> bool:
+        await self._resolve_encoding()
+        if await self.db.hsetnx(self.content_key, self.itob(uid), b''):
+            await self.db.incr(self.version_key)
+            return False
+        return True
+
+    async def trie_get_vector(self, root: int, vec: Tuple[int]) -> int:
+        itob = self.itob
+        result = await self._trie_get(args=[
+            self.namespace, itob(root), itob(ANOIReserved.REF.value),
+            *(itob(uid) for uid in vec)])
+        if result is None:
+            return NIL
+        return self.btoi(result)
+
+    async def trie_set_vector(
+        self,
+        root: int,
+        vec: Tuple[int],
+        uid: int
+    ) -> int:
+        itob = self.itob
+        result = await self._trie_set(args=[
+            self.namespace, self.content_key, self.crnt_key, itob(root),
+            itob(uid), itob(ANOIReserved.PARENT.value),
+            itob(ANOIReserved.ROOT.value), itob(ANOIReserved.REF.value),
+            ANOIReserved.MIN_UNRESERVED.value, *(itob(elem) for elem in vec)])
+        return self.btoi(result)
+
+    async def trie_compress(self, root: int, vec: Tuple[int]) -> Tuple[int]:
+        if len(vec) == 0:
+            return ()
+        result = await self._trie_compress(args=[
+            self.namespace, self.itob(root), self.itob(ANOIReserved.REF.value),
+            self.istob(vec)])
+        return self.btois(result)
+
+    # Batch operations are pipelined, as in ANOIRedis32Space.
+
+    async def cross_many(
+        self,
+        pairs: Iterable[Tuple[int, int]]
+    ) -> Tuple[int]:
+        itob = self.itob
+        async with self.db.pipeline(transaction=False) as pipe:
+            for uid0, uid1 in pairs:
+                pipe.hget(self.namespace + itob(uid0), itob(uid1))
+            results = await pipe.execute()
+        btoi = self.btoi
+        return tuple(
+            NIL if result is None or len(result) != 4 else btoi(result)
+            for result in results)
+
+    async def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        itob = self.itob
+        async with self.db.pipeline(transaction=False) as pipe:
+            for uid0, uid1, uid2 in triples:
+                pipe.hset(self.namespace + itob(uid0), itob(uid1), itob(uid2))
+            pipe.incr(self.version_key)
+            await pipe.execute()
+
+    async def get_content_many(
+        self,
+        uids: Iterable[int]
+    ) -> Tuple[Tuple[int]]:
+        uids = tuple(uids)
+        if len(uids) == 0:
+            return ()
+        await self._resolve_encoding()
+        results = await self.db.hmget(
+            self.content_key, [self.itob(uid) for uid in uids])
+        contents = []
+        for uid, result in zip(uids, results):
+            if result is None:
+                raise ValueError(f'UID {uid} contents not found')
+            contents.append(self.decode_content(result))
+        return tuple(contents)
+
+    async def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        itob = self.itob
+        async with self.db.pipeline(transaction=False) as pipe:
+            for uid in uids:
+                pipe.hkeys(self.namespace + itob(uid))
+            results = await pipe.execute()
+        btoi = self.btoi
+        return tuple(tuple(btoi(key) for key in keys) for keys in results)
+
+    async def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        itob = self.itob
+        async with self.db.pipeline(transaction=False) as pipe:
+            for uid in uids:
+                pipe.hexists(self.content_key, itob(uid))
+            results = await pipe.execute()
+        return tuple(bool(result) for result in results)
+
+    async def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        items = tuple(items)
+        valids = await self.is_valid_many(uid for uid, _ in items)
+        for (uid, _), valid in zip(items, valids):
+            if not valid:
+                raise ValueError(f'UID {uid} is not valid.')
+        if len(items) > 0:
+            await self._resolve_encoding()
+            async with self.db.pipeline(transaction=False) as pipe:
+                pipe.hset(self.content_key, mapping={
+                    self.itob(uid): self.encode_content(content)
+                    for uid, content in items})
+                pipe.incr(self.version_key)
+                await pipe.execute()
+
+
+class AsyncANOITrie:
+    '''Asynchronous counterpart of the lookup side of ANOITrie.'''
+    def __init__(
+        self,
+        space: AsyncANOISpace,
+        root: int = ANOIReserved.ROOT.value
+    ):
+        self.space = space
+        self.root = root
+
+    async def get_name(self, name: str) -> int:
+        return await self.get_vector(str_to_vec(name))
+
+    async def get_vector(self, vec: Tuple[int]) -> int:
+        if len(vec) == 0:
+            return NIL
+        if self.space.server_side_tries:
+            return await self.space.trie_get_vector(self.root, tuple(vec))
+        cross = self.space.cross
+        ret_val = await cross(self.root, vec[0])
+        i = 1
+        while (i < len(vec)) and (ret_val != NIL):
+            ret_val = await cross(ret_val, vec[i])
+            i = i + 1
+        if ret_val != NIL:
+            ret_val = await cross(ret_val, ANOIReserved.REF.value)
+        return ret_val
+
+    async def has_name(self, name: str) -> bool:
+        return await self.get_name(name) != NIL
+
+    async def has_vector(self, vec: Tuple[int]) -> bool:
+        return await self.get_vector(vec) != NIL
+
+    async def set_name(self, name: str, uid: int) -> int:
+        return await self.set_vector(str_to_vec(name), uid)
+
+    async def create_node(self, prev_uid: int, key_uid: int) -> int:
+        ret_val = await self.space.get_uid()
+        await self.space.cross_equals_many((
+            (ret_val, ANOIReserved.PARENT.value, prev_uid),
+            (ret_val, ANOIReserved.ROOT.value, self.root),
+            (prev_uid, key_uid, ret_val),
+        ))
+        return ret_val
+
+    async def set_vector(self, vec: Tuple[int], uid: int) -> int:
+        if len(vec) == 0:
+            raise ValueError('Empty vector cannot map to anything.')
+        if self.space.server_side_tries:
+            return await self.space.trie_set_vector(
+                self.root, tuple(vec), uid)
+        cross = self.space.cross
+        crnt_uid = self.root
+        # Handle vec[i - 1] x vec[i]
+        i = 0
+        while (i < len(vec)) and (crnt_uid != NIL):
+            prev_uid = crnt_uid
+            crnt_uid = await cross(crnt_uid, vec[i])
+            i = i + 1
+        if crnt_uid == NIL:
+            # We had a miss and need to back up one.
+            i = i - 1
+            crnt_uid = prev_uid
+            while i < len(vec):
+                crnt_uid = await self.create_node(crnt_uid, vec[i])
+                i = i + 1
+        await self.space.cross_equals_many((
+            (crnt_uid, ANOIReserved.REF.value, uid),
+            (uid, self.root, crnt_uid),
+        ))
+        return uid
+
+
+async def compress(trie: AsyncANOITrie, uid_vec: Tuple[int]) -> Tuple[int]:
+    '''Asynchronous counterpart of basis.compress().'''
+    space = trie.space
+    uid_vec = tuple(uid_vec)
+    if space.server_side_tries:
+        return await space.trie_compress(trie.root, uid_vec)
+    if isinstance(space, AsyncANOISpaceAdapter):
+        # Use the compiled automaton, as basis.compress() does.
+        return compile_trie(ANOITrie(space.space, trie.root)).compress(
+            uid_vec)
+    REF = ANOIReserved.REF.value
+    result = []
+    i = 0
+    uid_vec_len = len(uid_vec)
+    while i < uid_vec_len:
+        crnt_uid = await space.cross(trie.root, uid_vec[i])
+        last_good_ref = NIL
+        last_good_pos = i
+        j = i + 1
+        while (j <= uid_vec_len) and (NIL != crnt_uid):
+            crnt_ref = await space.cross(crnt_uid, REF)
+            if NIL != crnt_ref:
+                last_good_ref = crnt_ref
+                last_good_pos = j
+            if j >= uid_vec_len:
+                break
+            crnt_uid = await space.cross(crnt_uid, uid_vec[j])
+            j = j + 1
+        if last_good_ref == NIL:
+            result.append(uid_vec[i])
+            i = i + 1
+        else:
+            result.append(last_good_ref)
+            i = last_good_pos
+    return tuple(result)
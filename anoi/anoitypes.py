@@ -2,12 +2,12 @@
 '''
 import abc
 import dataclasses
-import functools
 from typing import Any, Dict, List, Optional, Set, Type, Union
 from .basis import (
     ANOISpace,
     ANOITrieProxy,
     ANOINamespace,
+    space_cached,
 )
 from .atom import ANOIAtom
 
@@ -111,7 +111,7 @@ class ANOIProperty:
         raise NotImplementedError()
 
 
-@functools.cache
+@space_cached
 def ty_to_uid(space: ANOISpace, ty: PyANOIType) -> int:
     if isinstance(ty, int):
         return ty
@@ -161,7 +161,7 @@ BUILTINS = {
 }
 
 
-@functools.cache
+@space_cached
 def anoi_types(space: ANOISpace) -> ANOITrieProxy:
     result = ANOITrieProxy(ANOINamespace(space, 'TYPES'))
     for builtin in ('STRING',):
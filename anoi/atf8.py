@@ -0,0 +1,232 @@
+'''ANOI transfer format (ATF-8), a variable length encoding for UID vectors.
+
+ATF-8 follows UTF-8's rules taken to arbitrary bit depth (see the README's
+2021.10.27 notes).  A UID below 0x80 takes one byte.  Otherwise an *n* byte
+encoding carries *5n + 1* payload bits, most significant bits first:
+
+- For *2 <= n <= 7* the lead byte is *n* one bits, a zero bit, and *7 - n*
+  payload bits, followed by *n - 1* continuation bytes ``10xxxxxx``.
+- For *8 <= n <= 13* the lead byte is ``0xff``, and the second byte is ``10``,
+  *n - 8* one bits, a zero bit, and *13 - n* payload bits, followed by *n - 2*
+  continuation bytes.
+
+Thirteen bytes hold 66 bits, which covers 64-bit UIDs.  The decoder does not
+reject overlong encodings.
+
+NumPy is used to vectorize encoding and decoding of longer vectors when it is
+installed.
+'''
+
+from typing import Iterable, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MAX_BYTES = 13
+# Vectors shorter than this are faster to handle in pure Python.
+NUMPY_THRESHOLD = 64
+
+
+def encoded_length(uid: int) -> int:
+    '''Returns the number of bytes needed to encode a UID.'''
+    if uid < 0x80:
+        if uid < 0:
+            raise ValueError(f'UID {uid} is negative')
+        return 1
+    bits = uid.bit_length()
+    length = max(2, (bits + 3) // 5)
+    if length > MAX_BYTES:
+        raise ValueError(f'UID {uid} is too large to encode')
+    return length
+
+
+def _second_header(length: int) -> int:
+    '''Returns the header bits of the second byte of an 0xff led
+    encoding.'''
+    extra = length - 8
+    return 0x80 | (((1 << extra) - 1) << (6 - extra))
+
+
+def _encode_one(uid: int, out: bytearray) -> None:
+    length = encoded_length(uid)
+    if length == 1:
+        out.append(uid)
+        return
+    if length <= 7:
+        out.append(((0xff << (8 - length)) & 0xff) |
+            (uid >> (6 * (length - 1))))
+        first_continuation = 1
+    else:
+        out.append(0xff)
+        out.append(_second_header(length) | (uid >> (6 * (length - 2))))
+        first_continuation = 2
+    for index in range(first_continuation, length):
+        out.append(0x80 | ((uid >> (6 * (length - 1 - index))) & 0x3f))
+
+
+def _lead_length(lead: int) -> int:
+    '''Returns the encoded length given a lead byte other than 0xff, or 0
+    for continuation bytes.'''
+    if lead < 0x80:
+        return 1
+    ones = 8 - (lead ^ 0xff).bit_length()
+    return ones if ones > 1 else 0
+
+
+def _second_extra(second: int) -> int:
+    '''Returns the number of bytes past eight given the second byte of an
+    0xff led encoding, or -1 if the byte is invalid.'''
+    extra = 6 - ((second & 0x3f) ^ 0x3f).bit_length()
+    return extra if second & 0xc0 == 0x80 and extra <= 5 else -1
+
+
+def _decode_py(data: bytes) -> Tuple[int]:
+    result: List[int] = []
+    index = 0
+    data_len = len(data)
+    while index < data_len:
+        lead = data[index]
+        if lead < 0x80:
+            result.append(lead)
+            index += 1
+            continue
+        if lead != 0xff:
+            length = _lead_length(lead)
+            if length == 0:
+                raise ValueError(
+                    f'unexpected continuation byte at {index}')
+            value = lead & (0x7f >> length)
+            start = index + 1
+        else:
+            if index + 1 >= data_len:
+                raise ValueError('truncated ATF-8 data')
+            extra = _second_extra(data[index + 1])
+            if extra < 0:
+                raise ValueError(f'invalid ATF-8 byte at {index + 1}')
+            length = 8 + extra
+            value = data[index + 1] & (0x3f >> (extra + 1))
+            start = index + 2
+        end = index + length
+        if end > data_len:
+            raise ValueError('truncated ATF-8 data')
+        for byte in data[start:end]:
+            if byte & 0xc0 != 0x80:
+                raise ValueError(
+                    f'invalid ATF-8 continuation byte {byte:#x}')
+            value = (value << 6) | (byte & 0x3f)
+        result.append(value)
+        index = end
+    return tuple(result)
+
+
+if np is not None:
+    # Smallest UID that needs more than each encoded length, indexed by
+    # length - 1.
+    _LIMITS = np.array(
+        [0x80] + [1 << (5 * length + 1) for length in range(2, MAX_BYTES)],
+        dtype=np.uint64)
+    # Lead and second byte header bits, indexed by encoded length.
+    _LEAD_HEADERS = np.array(
+        [0, 0] + [(0xff << (8 - length)) & 0xff for length in range(2, 8)] +
+        [0xff] * (MAX_BYTES - 7), dtype=np.uint64)
+    _SECOND_HEADERS = np.array(
+        [0] * 8 + [_second_header(length) for length in range(8, 14)],
+        dtype=np.uint64)
+    _SECOND_MASKS = np.array(
+        [0] * 8 + [0x3f >> (length - 7) for length in range(8, 14)],
+        dtype=np.uint64)
+    # Tables indexed by byte value.
+    _LEAD_LENGTHS = np.array(
+        [_lead_length(byte) for byte in range(256)], dtype=np.int64)
+    _LEAD_MASKS = np.array(
+        [0x7f] * 0x80 + [0x7f >> _lead_length(byte) for byte in range(
+            0x80, 0xff)] + [0], dtype=np.uint64)
+    _SECOND_EXTRAS = np.array(
+        [_second_extra(byte) for byte in range(256)], dtype=np.int64)
+
+    def _encode_np(uids) -> bytes:
+        uids = np.asarray(uids, dtype=np.uint64)
+        lengths = np.searchsorted(_LIMITS, uids, side='right') + 1
+        offsets = np.zeros(len(uids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        out = np.empty(offsets[-1], dtype=np.uint8)
+        for index in range(int(lengths.max(initial=0))):
+            selected = lengths > index
+            length = lengths[selected]
+            uid = uids[selected]
+            shift = np.minimum(
+                6 * (length - 1 - index), 63).astype(np.uint64)
+            byte = 0x80 | ((uid >> shift) & 0x3f)
+            if index == 0:
+                byte = np.where(length == 1, uid, np.where(
+                    length <= 7, _LEAD_HEADERS[length] | (uid >> shift),
+                    0xff))
+            elif index == 1:
+                byte = np.where(length >= 8, _SECOND_HEADERS[length] | (
+                    (uid >> shift) & _SECOND_MASKS[length]), byte)
+            out[offsets[:-1][selected] + index] = byte
+        return out.tobytes()
+
+    def _decode_np(data: bytes) -> Tuple[int]:
+        buffer = np.frombuffer(data, dtype=np.uint8).astype(np.int64)
+        buffer_len = len(buffer)
+        is_lead = (buffer & 0xc0) != 0x80
+        if not is_lead[0]:
+            raise ValueError('unexpected continuation byte at 0')
+        starts = np.flatnonzero(is_lead)
+        leads = buffer[starts]
+        lengths = _LEAD_LENGTHS[leads]
+        long = leads == 0xff
+        if long.any():
+            second_index = starts[long] + 1
+            if second_index[-1] >= buffer_len:
+                raise ValueError('truncated ATF-8 data')
+            extras = _SECOND_EXTRAS[buffer[second_index]]
+            if (extras < 0).any():
+                raise ValueError('invalid ATF-8 data')
+            lengths[long] = 8 + extras
+        ends = np.append(starts[1:], buffer_len)
+        if (ends - starts != lengths).any():
+            raise ValueError('malformed or truncated ATF-8 data')
+        # Per byte: which element it belongs to, its position within that
+        # element, and the element's length.
+        element = np.cumsum(is_lead) - 1
+        position = np.arange(buffer_len) - starts[element]
+        length = lengths[element]
+        unsigned = buffer.astype(np.uint64)
+        payload = np.where(
+            position == 0, unsigned & _LEAD_MASKS[buffer], unsigned & 0x3f)
+        second = (position == 1) & (length >= 8)
+        payload[second] &= _SECOND_MASKS[length[second]]
+        shift = 6 * (length - 1 - position)
+        if ((shift == 60) & (payload > 0xf)).any():
+            # Values past 64 bits need Python integers.
+            return _decode_py(data)
+        shift = np.minimum(shift, 63).astype(np.uint64)
+        values = np.bitwise_or.reduceat(payload << shift, starts)
+        return tuple(values.tolist())
+
+
+def encode(uids: Iterable[int]) -> bytes:
+    '''Encode a vector of UIDs as ATF-8 bytes.'''
+    if not isinstance(uids, (tuple, list)):
+        uids = tuple(uids)
+    if np is not None and len(uids) >= NUMPY_THRESHOLD:
+        if min(uids) < 0:
+            raise ValueError('UIDs must be non-negative')
+        if max(uids) < (1 << 64):
+            return _encode_np(uids)
+    out = bytearray()
+    for uid in uids:
+        _encode_one(uid, out)
+    return bytes(out)
+
+
+def decode(data: bytes) -> Tuple[int]:
+    '''Decode ATF-8 bytes into a vector of UIDs.'''
+    if np is not None and len(data) >= NUMPY_THRESHOLD:
+        return _decode_np(data)
+    return _decode_py(data)
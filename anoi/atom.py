@@ -3,6 +3,7 @@ from typing import Any, Dict, Iterable, Optional, Tuple
 from . import (
     ANOISpace,
     ANOINamespace,
+    str_to_vec,
 )
 
 
@@ -64,7 +65,7 @@ class ANOIAtom:
         May be overridden to throw a TypeError if the atom type doesn't support
         arbitrary length strings, or UID's in the Unicode code point range.
         '''
-        self.contents = tuple(ord(ch) for ch in in_str)
+        self.contents = str_to_vec(in_str)
 
     def obj_to_uid(self, obj: Any) -> int:
         if isinstance(obj, int):
@@ -2,13 +2,29 @@
 '''
 
 import abc
+import array
+import codecs
+import collections
 import enum
 import functools
+import heapq
+import itertools
 import struct
-from typing import Any, Dict, Iterator, Optional, Tuple
+import sys
+import time
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple,
+    Union)
+import weakref
 
 import redis
 
+from . import atf8
+
+# Whether array('I') matches the little-endian uint32 layout used for packed
+# contents, so packed bytes can be viewed as UIDs without copying.
+_NATIVE_UINT32 = (
+    sys.byteorder == 'little' and array.array('I').itemsize == 4)
 
 class ANOIReserved(enum.Enum):
     NIL = 0x0  # None, by any other name...
@@ -30,6 +46,16 @@ ANOIReservedSet = set(elem.value for elem in ANOIReserved)
 
 
 class ANOISpace(abc.ABC):
+    # True if the space implements trie_get_vector(), trie_set_vector() and
+    # trie_compress(), in which case tries and compression hand whole vectors
+    # to the space instead of walking the trie one cross product at a time.
+    server_side_tries: bool = False
+    # (version before, version after) the space's last write, for spaces
+    # that learn the new version as part of each write, such as the Redis
+    # spaces, whose write pipelines end with an INCR of the version.  None if
+    # the space does not track them.
+    write_versions: Optional[Tuple[int, int]] = None
+
     def check(self, uid: int) -> None:
         '''Utility to check that given UID is valid.'''
         if not self.is_valid(uid):
@@ -43,6 +69,22 @@ class ANOISpace(abc.ABC):
         '''Sets uid0 x uid1 = uid2.'''
         raise NotImplementedError()
 
+    def close(self) -> None:
+        '''Release resources held by the space, including any objects cached
+        for it (see evict()).'''
+        evict(self)
+
+    def _wrote(self, version: int) -> None:
+        '''Record the version returned by a write's INCR.'''
+        self.write_versions = (version - 1, version)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        '''Pickle the space without the objects cached for it, which are
+        made again as needed (see space_registry()).'''
+        state = self.__dict__.copy()
+        state.pop('_registry', None)
+        return state
+
     def free_uid(self, uid: int) -> None:
         '''Marks UID argument as no longer in use.'''
         raise NotImplementedError()
@@ -51,6 +93,17 @@ class ANOISpace(abc.ABC):
         '''Returns the contents associated with the given UID.'''
         raise NotImplementedError()
 
+    def get_content_view(self, uid: int) -> Sequence[int]:
+        '''Returns the contents associated with the given UID as a buffer of
+        unsigned integers (an array or memoryview), for passing to
+        vec_to_str(), NumPy and so on without a tuple of ints in between.
+        Spaces that store packed contents return them without unpacking.'''
+        content = self.get_content(uid)
+        try:
+            return array.array('I', content)
+        except OverflowError:
+            return array.array('Q', content)
+
     def get_keys(self, uid: int) -> Tuple[int]:
         '''Get a list of valid cross product arguments.'''
         raise NotImplementedError()
@@ -59,10 +112,26 @@ class ANOISpace(abc.ABC):
         '''Returns a free UID.'''
         raise NotImplementedError()
 
+    def get_uids(self, count: int) -> Tuple[int]:
+        '''Returns the given number of free UIDs.'''
+        return tuple(self.get_uid() for _ in range(count))
+
+    def get_version(self) -> int:
+        '''Returns the space's modification counter, which changes whenever
+        an atom is allocated, validated, freed, or has its edges or content
+        set.  Comparing versions is a cheap way to tell whether anything
+        derived from the space is stale.'''
+        raise NotImplementedError()
+
     def is_valid(self, uid: int) -> bool:
         '''Returns true if the given UID is defined, false otherwise.'''
         raise NotImplementedError()
 
+    def iter_uids(self) -> Iterator[int]:
+        '''Iterate over all valid UIDs in the space, in no particular
+        order.'''
+        raise NotImplementedError()
+
     def set_content(self, uid: int, content: Tuple[int]) -> None:
         '''Associates the given content with a UID.'''
         raise NotImplementedError()
@@ -72,6 +141,75 @@ class ANOISpace(abc.ABC):
         valid, false otherwise.'''
         raise NotImplementedError()
 
+    def trie_get_vector(self, root: int, vec: Tuple[int]) -> int:
+        '''Returns the REF for the given vector in the trie rooted at root,
+        or NIL if there is no such entry.'''
+        raise NotImplementedError()
+
+    def trie_set_vector(self, root: int, vec: Tuple[int], uid: int) -> int:
+        '''Maps the given vector to uid in the trie rooted at root, creating
+        any missing trie nodes, and returns uid.'''
+        raise NotImplementedError()
+
+    def trie_compress(self, root: int, vec: Tuple[int]) -> Tuple[int]:
+        '''Returns compress() of the given vector against the trie rooted at
+        root.'''
+        raise NotImplementedError()
+
+    # Batch operations.  The defaults below just loop over the single atom
+    # methods; subclasses should override them where the backend can do
+    # better (fewer round trips, fewer Python-level calls).
+
+    def cross_many(self, pairs: Iterable[Tuple[int, int]]) -> Tuple[int]:
+        '''Returns uid0 x uid1 for each (uid0, uid1) pair.'''
+        return tuple(self.cross(uid0, uid1) for uid0, uid1 in pairs)
+
+    def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        '''Sets uid0 x uid1 = uid2 for each (uid0, uid1, uid2) triple.'''
+        for uid0, uid1, uid2 in triples:
+            self.cross_equals(uid0, uid1, uid2)
+
+    def free_uid_many(self, uids: Iterable[int]) -> None:
+        '''Marks each of the given UIDs as no longer in use.'''
+        for uid in uids:
+            self.free_uid(uid)
+
+    def get_content_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        '''Returns the contents associated with each of the given UIDs.'''
+        return tuple(self.get_content(uid) for uid in uids)
+
+    def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        '''Returns the valid cross product arguments for each given UID.'''
+        return tuple(self.get_keys(uid) for uid in uids)
+
+    def get_edges_many(self, uids: Iterable[int]) -> Tuple[Dict[int, int]]:
+        '''Returns a {uid1: uid0 x uid1} dictionary for each given uid0.
+        UIDs that are not valid have no edges.'''
+        uids = tuple(uids)
+        valid_uids = [uid
+            for uid, valid in zip(uids, self.is_valid_many(uids)) if valid]
+        keys_list = self.get_keys_many(valid_uids)
+        values = iter(self.cross_many((uid, key)
+            for uid, keys in zip(valid_uids, keys_list) for key in keys))
+        edges = {uid: {key: next(values) for key in keys}
+            for uid, keys in zip(valid_uids, keys_list)}
+        return tuple(edges.get(uid, {}) for uid in uids)
+
+    def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        '''Returns the validity of each of the given UIDs.'''
+        return tuple(self.is_valid(uid) for uid in uids)
+
+    def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        '''Associates content with a UID for each (uid, content) pair.'''
+        for uid, content in items:
+            self.set_content(uid, content)
+
 
 class ANOIInMemorySpace(ANOISpace):
     def __init__(self) -> None:
@@ -79,6 +217,10 @@ class ANOIInMemorySpace(ANOISpace):
         self.crnt: int = ANOIReserved.MIN_UNRESERVED.value
         self.uid_map: Dict[int, Dict[int, int]] = {}
         self.uid_content: Dict[int, Tuple[int]] = {}
+        self.free_uids: List[int] = []
+        # Start from the clock, so versions are not reused by later
+        # processes holding different data.
+        self.version: int = time.time_ns()
 
     def cross(self, uid0: int, uid1: int) -> int:
         self.check(uid0)  # Force a value error before we raise a key error.
@@ -91,11 +233,14 @@ class ANOIInMemorySpace(ANOISpace):
         self.check(uid0)
         uid_map = self.uid_map[uid0]
         uid_map[uid1] = uid2
+        self.version += 1
 
     def free_uid(self, uid: int) -> None:
         self.check(uid)
         del self.uid_map[uid]
         del self.uid_content[uid]
+        self.free_uids.append(uid)
+        self.version += 1
 
     def get_content(self, uid: int) -> Tuple[int]:
         self.check(uid)
@@ -106,37 +251,338 @@ class ANOIInMemorySpace(ANOISpace):
         return tuple(self.uid_map[uid].keys())
 
     def get_uid(self) -> int:
-        while self.is_valid(self.crnt):
-            self.crnt += 1
-        result = self.crnt
-        self.uid_map[result] = {}
-        self.uid_content[result] = ()
-        self.crnt += 1
-        return result
+        return self.get_uids(1)[0]
+
+    def get_uids(self, count: int) -> Tuple[int]:
+        uid_map = self.uid_map
+        uid_content = self.uid_content
+        free_uids = self.free_uids
+        result = []
+        while len(result) < count:
+            if len(free_uids) > 0:
+                uid = free_uids.pop()
+            else:
+                uid = self.crnt
+                self.crnt += 1
+            # Skip anything validated since it was freed or counted past.
+            if uid not in uid_map:
+                uid_map[uid] = {}
+                uid_content[uid] = ()
+                result.append(uid)
+        self.version += 1
+        return tuple(result)
+
+    def get_version(self) -> int:
+        return self.version
 
     def is_valid(self, uid: int) -> bool:
         # return ((uid in range(0x110000)) or 
         #         ((uid in self.uid_map) and (uid in self.uid_content)))
         return ((uid in self.uid_map) and (uid in self.uid_content))
 
+    def iter_uids(self) -> Iterator[int]:
+        return iter(tuple(self.uid_map.keys()))
+
     def set_content(self, uid: int, content: Tuple[int]) -> None:
         self.check(uid)
         self.uid_content[uid] = content
+        self.version += 1
 
     def validate(self, uid: int) -> bool:
         if self.is_valid(uid):
             return True
         self.uid_map[uid] = {}
         self.uid_content[uid] = ()
+        self.version += 1
         return False
 
+    def _get_map(self, uid: int) -> Dict[int, int]:
+        uid_map = self.uid_map.get(uid)
+        if uid_map is None or uid not in self.uid_content:
+            raise ValueError(f'UID {uid} is not valid.')
+        return uid_map
+
+    def cross_many(self, pairs: Iterable[Tuple[int, int]]) -> Tuple[int]:
+        get_map = self._get_map
+        NIL = ANOIReserved.NIL.value
+        return tuple(get_map(uid0).get(uid1, NIL) for uid0, uid1 in pairs)
+
+    def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        # Bump the version first, so a batch that fails part way through
+        # still invalidates anything derived from the earlier writes.
+        self.version += 1
+        get_map = self._get_map
+        for uid0, uid1, uid2 in triples:
+            get_map(uid0)[uid1] = uid2
+
+    def get_content_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        uid_content = self.uid_content
+        result = []
+        for uid in uids:
+            if uid not in uid_content or uid not in self.uid_map:
+                raise ValueError(f'UID {uid} is not valid.')
+            result.append(uid_content[uid])
+        return tuple(result)
+
+    def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        get_map = self._get_map
+        return tuple(tuple(get_map(uid).keys()) for uid in uids)
+
+    def get_edges_many(self, uids: Iterable[int]) -> Tuple[Dict[int, int]]:
+        uid_map = self.uid_map
+        uid_content = self.uid_content
+        return tuple(dict(uid_map[uid])
+            if uid in uid_map and uid in uid_content else {} for uid in uids)
+
+    def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        uid_map = self.uid_map
+        uid_content = self.uid_content
+        return tuple((uid in uid_map) and (uid in uid_content) for uid in uids)
+
+    def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        self.version += 1
+        get_map = self._get_map
+        uid_content = self.uid_content
+        for uid, content in items:
+            get_map(uid)
+            uid_content[uid] = content
+
+
+class ANOIRedisUIDBlocks:
+    '''UID allocator shared by the Redis spaces.
+
+    Rather than touching the shared counter for every UID, each client
+    leases a block of UIDs at a time with a single INCRBY, along with any
+    UIDs other clients have pushed onto the namespace's free list.  Since
+    INCRBY and LPOP are atomic, concurrent clients never see the same
+    candidates.  Candidates are then claimed with HSETNX on the space's
+    validity hash, which skips any UID that was validated by other means.
+
+    The counter holds the last UID handed out by any client, so it stays
+    compatible with counters written before block allocation.
+
+    If a version_key is given, each round of claims also increments it (see
+    ANOISpace.get_version()), and write_versions holds the versions before
+    the first round and after the last one of the latest claim().
+    '''
+    def __init__(
+        self,
+        db: redis.Redis,
+        crnt_key: bytes,
+        free_key: bytes,
+        block_size: int = 1024,
+        version_key: Optional[bytes] = None
+    ):
+        self.db = db
+        self.crnt_key = crnt_key
+        self.free_key = free_key
+        self.block_size = block_size
+        self.version_key = version_key
+        self.write_versions: Optional[Tuple[int, int]] = None
+        self.pending: collections.deque = collections.deque()
+
+    def lease(self, count: int) -> None:
+        '''Reserve at least count more candidate UIDs.'''
+        count = max(count, self.block_size)
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.lpop(self.free_key, count)
+            pipe.set(
+                self.crnt_key, ANOIReserved.MIN_UNRESERVED.value - 1, nx=True)
+            pipe.incrby(self.crnt_key, count)
+            freed, _, end = pipe.execute()
+        self.pending.extend(int(uid) for uid in freed or ())
+        self.pending.extend(range(end - count + 1, end + 1))
+
+    def release(self, pipe: Any, uids: Sequence[int]) -> None:
+        '''Queue a single LPUSH on pipe returning uids to the free list, for
+        the next lease() by any client.'''
+        if len(uids) > 0:
+            pipe.lpush(self.free_key, *uids)
+
+    def claim(
+        self,
+        count: int,
+        claim_one: Callable[[Any, int], None]
+    ) -> Tuple[int]:
+        '''Returns count UIDs, where claim_one(pipeline, uid) queues a
+        command returning true if the UID was successfully claimed.'''
+        result = []
+        pending = self.pending
+        first_version = None
+        while len(result) < count:
+            needed = count - len(result)
+            if len(pending) < needed:
+                self.lease(needed - len(pending))
+            candidates = [pending.popleft() for _ in range(needed)]
+            with self.db.pipeline(transaction=False) as pipe:
+                for uid in candidates:
+                    claim_one(pipe, uid)
+                if self.version_key is not None:
+                    pipe.incr(self.version_key)
+                replies = pipe.execute()
+            claimed = replies[:len(candidates)]
+            if self.version_key is not None:
+                if first_version is None:
+                    first_version = replies[-1] - 1
+                self.write_versions = (first_version, replies[-1])
+            result.extend(uid for uid, success in zip(candidates, claimed)
+                if success)
+        return tuple(result)
+
+
+# Lua scripts used by ANOIRedis32Space to walk tries next to the data.  These
+# take the space's key prefix and packed UIDs in ARGV, and touch keys derived
+# from the trie nodes they visit, so they assume a single (non-clustered)
+# Redis server.  Scripts run atomically, blocking other clients while they
+# do, so very long documents are better compressed in pieces.
+
+_REDIS_TRIE_GET_LUA = '''
+local prefix = ARGV[1]
+local node = ARGV[2]
+local ref = ARGV[3]
+local nil_bytes = string.rep(string.char(0), 4)
+for i = 4, #ARGV do
+    node = redis.call('HGET', prefix .. node, ARGV[i])
+    if not node or #node ~= 4 or node == nil_bytes then
+        return false
+    end
+end
+node = redis.call('HGET', prefix .. node, ref)
+if not node or #node ~= 4 then
+    return false
+end
+return node
+'''
+
+_REDIS_TRIE_SET_LUA = '''
+local prefix = ARGV[1]
+local content_key = ARGV[2]
+local crnt_key = ARGV[3]
+local root = ARGV[4]
+local uid = ARGV[5]
+local parent_key = ARGV[6]
+local root_key = ARGV[7]
+local ref_key = ARGV[8]
+local min_unreserved = tonumber(ARGV[9])
+local nil_bytes = string.rep(string.char(0), 4)
+
+local function itob(n)
+    return string.char(
+        n % 256,
+        math.floor(n / 0x100) % 256,
+        math.floor(n / 0x10000) % 256,
+        math.floor(n / 0x1000000) % 256)
+end
+
+-- Claims the next UID from the shared counter (see ANOIRedisUIDBlocks).
+local function get_uid()
+    redis.call('SET', crnt_key, min_unreserved - 1, 'NX')
+    while true do
+        local crnt_bytes = itob(redis.call('INCR', crnt_key))
+        if redis.call('HSETNX', content_key, crnt_bytes, '') == 1 then
+            return crnt_bytes
+        end
+    end
+end
+
+local node = root
+local i = 10
+while i <= #ARGV do
+    local child = redis.call('HGET', prefix .. node, ARGV[i])
+    if not child or #child ~= 4 or child == nil_bytes then
+        break
+    end
+    node = child
+    i = i + 1
+end
+while i <= #ARGV do
+    local child = get_uid()
+    redis.call('HSET', prefix .. child, parent_key, node, root_key, root)
+    redis.call('HSET', prefix .. node, ARGV[i], child)
+    node = child
+    i = i + 1
+end
+redis.call('HSET', prefix .. node, ref_key, uid)
+redis.call('HSET', prefix .. uid, root, node)
+redis.call('INCR', prefix .. 'version')
+return uid
+'''
+
+# Greedy longest-match compression, mirroring compress_iter().  The vector to
+# compress is passed packed in ARGV[4], and the result is returned packed.
+_REDIS_TRIE_COMPRESS_LUA = '''
+local prefix = ARGV[1]
+local root = ARGV[2]
+local ref_key = ARGV[3]
+local vec = ARGV[4]
+local vec_len = #vec / 4
+local nil_bytes = string.rep(string.char(0), 4)
+
+local function elem(k)
+    return string.sub(vec, 4 * k + 1, 4 * k + 4)
+end
+
+local function cross(node, key)
+    local result = redis.call('HGET', prefix .. node, key)
+    if not result or #result ~= 4 or result == nil_bytes then
+        return false
+    end
+    return result
+end
+
+local out = {}
+local i = 0
+while i < vec_len do
+    local crnt = cross(root, elem(i))
+    local last_good_ref = false
+    local last_good_pos = i
+    local j = i + 1
+    while j <= vec_len and crnt do
+        local crnt_ref = cross(crnt, ref_key)
+        if crnt_ref then
+            last_good_ref = crnt_ref
+            last_good_pos = j
+        end
+        if j >= vec_len then
+            break
+        end
+        crnt = cross(crnt, elem(j))
+        j = j + 1
+    end
+    if not last_good_ref then
+        out[#out + 1] = elem(i)
+        i = i + 1
+    else
+        out[#out + 1] = last_good_ref
+        i = last_good_pos
+    end
+end
+return table.concat(out)
+'''
+
 
 class ANOIRedis32Space(ANOISpace):
+    server_side_tries = True
+
+    CONTENT_ENCODINGS = ('uint32', 'atf8')
+
     def __init__(
         self,
         db: Optional[redis.Redis] = None,
-        namespace: Optional[str] = None
+        namespace: Optional[str] = None,
+        content_encoding: Optional[str] = None
     ):
+        '''Content is stored as packed uint32 values by default.  Passing
+        content_encoding='atf8' for a new namespace stores it as ATF-8
+        instead, and records that choice under the namespace's encoding key
+        so later clients pick it up.  Namespaces without that key use
+        uint32.'''
         assert len(struct.pack('<I', 0)) == 4
         if db is None:
             db = redis.Redis()
@@ -145,14 +591,50 @@ class ANOIRedis32Space(ANOISpace):
             namespace.encode() if namespace is not None else b'') + b'_'
         self.content_key = self.namespace + b'content'
         self.crnt_key = self.namespace + b'crnt'
+        self.free_key = self.namespace + b'free'
+        self.encoding_key = self.namespace + b'encoding'
+        # Also written by the trie set script.
+        self.version_key = self.namespace + b'version'
+        self.uid_blocks = ANOIRedisUIDBlocks(
+            self.db, self.crnt_key, self.free_key,
+            version_key=self.version_key)
+        stored_encoding = self.db.get(self.encoding_key)
+        if stored_encoding is not None:
+            stored_encoding = stored_encoding.decode()
+            if content_encoding not in (None, stored_encoding):
+                raise ValueError(f'namespace content is encoded as '
+                    f'{stored_encoding}, not {content_encoding}')
+            content_encoding = stored_encoding
+        elif content_encoding not in (None, 'uint32'):
+            if self.db.exists(self.content_key):
+                raise ValueError('namespace already holds uint32 content')
+            self.db.set(self.encoding_key, content_encoding)
+        if content_encoding is None:
+            content_encoding = 'uint32'
+        if content_encoding not in self.CONTENT_ENCODINGS:
+            raise ValueError(
+                f'unknown content encoding {content_encoding!r}')
+        self.content_encoding = content_encoding
+        if content_encoding == 'atf8':
+            self.encode_content = atf8.encode
+            self.decode_content = atf8.decode
+        else:
+            self.encode_content = self.istob
+            self.decode_content = self.btois
+        # Scripts are sent via EVALSHA, and loaded on first use.
+        self._trie_get = self.db.register_script(_REDIS_TRIE_GET_LUA)
+        self._trie_set = self.db.register_script(_REDIS_TRIE_SET_LUA)
+        self._trie_compress = self.db.register_script(
+            _REDIS_TRIE_COMPRESS_LUA)
 
     @staticmethod
     def itob(integer: int) -> bytes:
         return struct.pack('<I', integer)
 
     @staticmethod
-    def istob(uid_vec: Tuple[int]) -> bytes:
-        return struct.pack(f'<{len(uid_vec)}I', *uid_vec)
+    def istob(uid_vec: Sequence[int]) -> bytes:
+        return vec_to_array(uid_vec).tobytes() if _NATIVE_UINT32 else (
+            struct.pack(f'<{len(uid_vec)}I', *uid_vec))
 
     @ staticmethod
     def btoi(byte_vec: bytes) -> int:
@@ -163,6 +645,15 @@ class ANOIRedis32Space(ANOISpace):
         vec_len = len(byte_vec) >> 2
         return struct.unpack(f'<{vec_len}I', byte_vec)
 
+    @staticmethod
+    def btoa(byte_vec: bytes) -> Sequence[int]:
+        '''Like btois(), but returns a zero-copy view where possible.'''
+        if _NATIVE_UINT32:
+            return memoryview(byte_vec).cast('I')
+        result = array.array('I', byte_vec)
+        result.byteswap()
+        return result
+
     def cross(self, uid0: int, uid1: int) -> int:
         uid0_key = self.namespace + self.itob(uid0)
         uid1_bytes = self.itob(uid1)
@@ -175,22 +666,53 @@ class ANOIRedis32Space(ANOISpace):
         uid0_key = self.namespace + self.itob(uid0)
         uid1_bytes = self.itob(uid1)
         uid2_bytes = self.itob(uid2)
-        result = self.db.hset(uid0_key, uid1_bytes, uid2_bytes)
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(uid0_key, uid1_bytes, uid2_bytes)
+            pipe.incr(self.version_key)
+            result, version = pipe.execute()
+        self._wrote(version)
         assert result == 1, f'Operation {uid0} x {uid1} = {uid2} failed'
 
     def free_uid(self, uid: int) -> None:
         self.check(uid)
         uid_bytes = self.itob(uid)
         uid_key = self.namespace + uid_bytes
-        self.db.delete(uid_key)
-        self.db.hdel(self.content_key, uid_bytes)
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.delete(uid_key)
+            pipe.hdel(self.content_key, uid_bytes)
+            pipe.lpush(self.free_key, uid)
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+
+    def free_uid_many(self, uids: Iterable[int]) -> None:
+        uids = tuple(uids)
+        if len(uids) == 0:
+            return
+        for uid, valid in zip(uids, self.is_valid_many(uids)):
+            if not valid:
+                raise ValueError(f'UID {uid} is not valid.')
+        uid_bytes = [self.itob(uid) for uid in uids]
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.delete(*(self.namespace + key for key in uid_bytes))
+            pipe.hdel(self.content_key, *uid_bytes)
+            self.uid_blocks.release(pipe, uids)
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
 
     def get_content(self, uid: int) -> Tuple[int]:
         uid_bytes = self.itob(uid)
         result = self.db.hget(self.content_key, uid_bytes)
         if result is None:
             raise ValueError(f'UID {uid} contents not found')
-        return self.btois(result)
+        return self.decode_content(result)
+
+    def get_content_view(self, uid: int) -> Sequence[int]:
+        if self.content_encoding != 'uint32':
+            return super().get_content_view(uid)
+        result = self.db.hget(self.content_key, self.itob(uid))
+        if result is None:
+            raise ValueError(f'UID {uid} contents not found')
+        return self.btoa(result)
 
     def get_keys(self, uid: int) -> Tuple[int]:
         uid_key = self.namespace + self.itob(uid)
@@ -198,16 +720,16 @@ class ANOIRedis32Space(ANOISpace):
         return tuple(self.btoi(value) for value in result)
 
     def get_uid(self) -> int:
-        if self.db.exists(self.crnt_key) != 1:
-            crnt = ANOIReserved.MIN_UNRESERVED.value
-            self.db.set(self.crnt_key, crnt)
-        else:
-            crnt = int(self.db.get(self.crnt_key))
-        while self.is_valid(crnt):
-            crnt = self.db.incr(self.crnt_key)
-        crnt_bytes = self.itob(crnt)
-        self.db.hset(self.content_key, crnt_bytes, b'')
-        return crnt
+        return self.get_uids(1)[0]
+
+    def get_uids(self, count: int) -> Tuple[int]:
+        result = self.uid_blocks.claim(count, lambda pipe, uid: pipe.hsetnx(
+            self.content_key, self.itob(uid), b''))
+        self.write_versions = self.uid_blocks.write_versions
+        return result
+
+    def get_version(self) -> int:
+        return int(self.db.get(self.version_key) or 0)
 
     def is_valid(self, uid: int) -> bool:
         # if uid in range(0x110000):
@@ -215,28 +737,185 @@ class ANOIRedis32Space(ANOISpace):
         uid_bytes = self.itob(uid)
         return self.db.hexists(self.content_key, uid_bytes)
 
+    def iter_uids(self) -> Iterator[int]:
+        return (self.btoi(uid_bytes)
+            for uid_bytes, _ in self.db.hscan_iter(self.content_key))
+
     def set_content(self, uid: int, content: Tuple[int]) -> None:
         self.check(uid)
         uid_bytes = self.itob(uid)
-        content_bytes = self.istob(content)
-        self.db.hset(self.content_key, uid_bytes, content_bytes)
+        content_bytes = self.encode_content(content)
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(self.content_key, uid_bytes, content_bytes)
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
 
     def validate(self, uid: int) -> bool:
         if self.is_valid(uid):
             return True
         uid_bytes = self.itob(uid)
-        self.db.hset(self.content_key, uid_bytes, b'')
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(self.content_key, uid_bytes, b'')
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
         return False
 
+    def trie_get_vector(self, root: int, vec: Tuple[int]) -> int:
+        itob = self.itob
+        result = self._trie_get(args=[
+            self.namespace, itob(root), itob(ANOIReserved.REF.value),
+            *(itob(uid) for uid in vec)])
+        if result is None:
+            return ANOIReserved.NIL.value
+        return self.btoi(result)
+
+    def trie_set_vector(self, root: int, vec: Tuple[int], uid: int) -> int:
+        itob = self.itob
+        result = self._trie_set(args=[
+            self.namespace, self.content_key, self.crnt_key, itob(root),
+            itob(uid), itob(ANOIReserved.PARENT.value),
+            itob(ANOIReserved.ROOT.value), itob(ANOIReserved.REF.value),
+            ANOIReserved.MIN_UNRESERVED.value, *(itob(elem) for elem in vec)])
+        return self.btoi(result)
+
+    def trie_compress(self, root: int, vec: Tuple[int]) -> Tuple[int]:
+        if len(vec) == 0:
+            return ()
+        itob = self.itob
+        result = self._trie_compress(args=[
+            self.namespace, itob(root), itob(ANOIReserved.REF.value),
+            self.istob(vec)])
+        return self.btois(result)
+
+    # Batch operations are pipelined, or use multi-field hash commands, so
+    # that each call costs a single round trip to the server.
+
+    def cross_many(self, pairs: Iterable[Tuple[int, int]]) -> Tuple[int]:
+        itob = self.itob
+        namespace = self.namespace
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid0, uid1 in pairs:
+                pipe.hget(namespace + itob(uid0), itob(uid1))
+            results = pipe.execute()
+        NIL = ANOIReserved.NIL.value
+        btoi = self.btoi
+        return tuple(
+            NIL if result is None or len(result) != 4 else btoi(result)
+            for result in results)
+
+    def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        itob = self.itob
+        namespace = self.namespace
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid0, uid1, uid2 in triples:
+                pipe.hset(namespace + itob(uid0), itob(uid1), itob(uid2))
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+
+    def get_content_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        uids = tuple(uids)
+        if len(uids) == 0:
+            return ()
+        results = self.db.hmget(self.content_key, [
+            self.itob(uid) for uid in uids])
+        decode_content = self.decode_content
+        contents = []
+        for uid, result in zip(uids, results):
+            if result is None:
+                raise ValueError(f'UID {uid} contents not found')
+            contents.append(decode_content(result))
+        return tuple(contents)
+
+    def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        itob = self.itob
+        namespace = self.namespace
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid in uids:
+                pipe.hkeys(namespace + itob(uid))
+            results = pipe.execute()
+        btoi = self.btoi
+        return tuple(
+            tuple(btoi(value) for value in result) for result in results)
+
+    def get_edges_many(self, uids: Iterable[int]) -> Tuple[Dict[int, int]]:
+        itob = self.itob
+        namespace = self.namespace
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid in uids:
+                pipe.hgetall(namespace + itob(uid))
+            results = pipe.execute()
+        btoi = self.btoi
+        return tuple({btoi(key): btoi(value)
+            for key, value in result.items() if len(value) == 4}
+            for result in results)
+
+    def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        uids = tuple(uids)
+        if len(uids) == 0:
+            return ()
+        results = self.db.hmget(self.content_key, [
+            self.itob(uid) for uid in uids])
+        return tuple(result is not None for result in results)
+
+    def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        mapping = {self.itob(uid): self.encode_content(content)
+            for uid, content in items}
+        if len(mapping) == 0:
+            return
+        uids = tuple(self.btoi(uid_bytes) for uid_bytes in mapping)
+        for uid, valid in zip(uids, self.is_valid_many(uids)):
+            if not valid:
+                raise ValueError(f'UID {uid} is not valid.')
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(self.content_key, mapping=mapping)
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+
+
+# Code points go through the UTF-32 codec, which converts whole strings in C.
+# surrogatepass lets lone surrogates through, as ord() and chr() do.
+_UTF32 = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
 
 def ord_iter(in_str: str) -> Iterator[int]:
-    return (ord(ch) for ch in in_str)
+    return map(ord, in_str)
 
-def str_to_vec(in_str: str) -> Tuple[int]:
-    return tuple(ord_iter(in_str))
+def str_to_array(in_str: str) -> array.array:
+    '''Returns the code points of a string as an array('I').'''
+    result = array.array('I')
+    result.frombytes(in_str.encode(_UTF32, 'surrogatepass'))
+    return result
 
-def vec_to_str(in_vec: Iterator[int]) -> str:
-    return ''.join(map(chr, in_vec))
+def str_to_vec(in_str: str) -> Tuple[int]:
+    return tuple(str_to_array(in_str))
+
+def vec_to_array(in_vec: Iterable[int]) -> array.array:
+    '''Returns a vector as an array('I'), without copying it if it already
+    is one.'''
+    if isinstance(in_vec, array.array) and in_vec.typecode == 'I':
+        return in_vec
+    return array.array('I', in_vec)
+
+def vec_to_str(in_vec: Iterable[int]) -> str:
+    if isinstance(in_vec, memoryview) and in_vec.format == 'I':
+        buffer = in_vec
+    else:
+        if not isinstance(in_vec, (tuple, list, array.array, memoryview)):
+            in_vec = tuple(in_vec)
+        try:
+            buffer = vec_to_array(in_vec)
+        except (OverflowError, TypeError):
+            # Let chr() raise its usual errors.
+            return ''.join(map(chr, in_vec))
+    try:
+        return str(buffer, _UTF32, 'surrogatepass')
+    except UnicodeDecodeError as error:
+        raise ValueError(str(error)) from None
 
 
 class ANOITrie:
@@ -247,9 +926,11 @@ class ANOITrie:
 
     def create_node(self, prev_uid: int, key_uid: int) -> int:
         ret_val = self.space.get_uid()
-        self.space.cross_equals(ret_val, ANOIReserved.PARENT.value, prev_uid)
-        self.space.cross_equals(ret_val, ANOIReserved.ROOT.value, self.root)
-        self.space.cross_equals(prev_uid, key_uid, ret_val)
+        self.space.cross_equals_many((
+            (ret_val, ANOIReserved.PARENT.value, prev_uid),
+            (ret_val, ANOIReserved.ROOT.value, self.root),
+            (prev_uid, key_uid, ret_val),
+        ))
         return ret_val
 
     def get_name(self, name: str) -> int:
@@ -257,7 +938,9 @@ class ANOITrie:
 
     def get_vector(self, vec: Tuple[int]) -> int:
         ret_val = NIL = ANOIReserved.NIL.value
-        if len(vec) > 0:
+        if len(vec) > 0 and self.space.server_side_tries:
+            ret_val = self.space.trie_get_vector(self.root, vec)
+        elif len(vec) > 0:
             cross = self.space.cross
             ret_val = cross(self.root, vec[0])
             i = 1
@@ -270,7 +953,10 @@ class ANOITrie:
 
     def has_vector(self, vec: Tuple[int]) -> bool:
         ret_val = False
-        if len(vec) > 0:
+        if len(vec) > 0 and self.space.server_side_tries:
+            ret_val = (self.space.trie_get_vector(self.root, vec) !=
+                ANOIReserved.NIL.value)
+        elif len(vec) > 0:
             NIL = ANOIReserved.NIL.value
             cross = self.space.cross
             crnt_uid = cross(self.root, vec[0])
@@ -293,9 +979,10 @@ class ANOITrie:
         ret_val = ANOIReserved.NIL.value
         if len(vec) == 0:
             raise ValueError('Empty vector cannot map to anything.')
+        elif self.space.server_side_tries:
+            ret_val = self.space.trie_set_vector(self.root, vec, uid)
         else:
             cross = self.space.cross
-            cross_eq = self.space.cross_equals
             NIL = ANOIReserved.NIL.value
             crnt_uid = self.root
             # Handle vec[i - 1] x vec[i]
@@ -311,46 +998,782 @@ class ANOITrie:
                 while i < len(vec):
                     crnt_uid = self.create_node(crnt_uid, vec[i])
                     i = i + 1
-            cross_eq(crnt_uid, ANOIReserved.REF.value, uid)
-            # XXX Not sure I like the following convention, but it allows us
-            # to backchain the name for a given trie.
-            cross_eq(uid, self.root, crnt_uid)
+            # XXX Not sure I like the second edge's convention, but it allows
+            # us to backchain the name for a given trie.
+            self.space.cross_equals_many((
+                (crnt_uid, ANOIReserved.REF.value, uid),
+                (uid, self.root, crnt_uid),
+            ))
             ret_val = uid
         return ret_val
 
+    def _walk(
+        self,
+        vec: Tuple[int],
+        node: int,
+        state: Any,
+        step: Callable[[Any, int], Any]
+    ) -> Iterator[Tuple[Tuple[int], int, Any]]:
+        '''Walk the trie breadth first from the node for vec, yielding
+        (vector, uid, state) for each entry found.  step(state, key)
+        returns the state for the child along key, or None to skip that
+        child's subtrie.
+
+        Each level costs one get_edges_many() call, which is a single round
+        trip for the Redis spaces.  Only edges to nodes whose PARENT is the
+        current node are followed, so other properties of trie nodes (such
+        as a namespace's NAME) are not mistaken for trie entries.
+        '''
+        NIL = ANOIReserved.NIL.value
+        PARENT = ANOIReserved.PARENT.value
+        REF = ANOIReserved.REF.value
+        ROOT = ANOIReserved.ROOT.value
+        # (vector, node, state, expected parent or None)
+        level = [(vec, node, state, None)]
+        while len(level) > 0:
+            edges_list = self.space.get_edges_many(
+                node for _, node, _, _ in level)
+            next_level = []
+            for (vec, node, state, parent), edges in zip(level, edges_list):
+                if parent is not None and edges.get(PARENT) != parent:
+                    continue
+                ref = edges.get(REF, NIL)
+                if ref != NIL and len(vec) > 0:
+                    yield vec, ref, state
+                for key, child in edges.items():
+                    if key == PARENT or key == REF or key == ROOT:
+                        continue
+                    child_state = step(state, key)
+                    if child_state is not None:
+                        next_level.append(
+                            (vec + (key,), child, child_state, node))
+            level = next_level
+
+    def _find_node(self, prefix: Tuple[int]) -> int:
+        '''Returns the trie node for prefix, or NIL.'''
+        NIL = ANOIReserved.NIL.value
+        node = self.root
+        for elem in prefix:
+            node = self.space.cross(node, elem)
+            if node == NIL:
+                break
+        return node
+
+    def entries(self) -> Iterator[Tuple[Tuple[int], int]]:
+        '''Iterate over the (vector, uid) entries of the trie, breadth first,
+        fetching one level of the trie at a time (see prefix_entries()).'''
+        return self.prefix_entries(())
 
-def compress_iter(trie: ANOITrie, uid_vec: Tuple[int]) -> Iterator[int]:
-    cross = trie.space.cross
-    NIL = ANOIReserved.NIL.value
-    REF = ANOIReserved.REF.value
+    def prefix_entries(
+        self,
+        prefix: Tuple[int],
+        limit: Optional[int] = None
+    ) -> Iterator[Tuple[Tuple[int], int]]:
+        '''Iterate over the (vector, uid) entries whose vectors start with
+        prefix, shortest first, stopping after limit entries if given.'''
+        node = self._find_node(prefix)
+        if node == ANOIReserved.NIL.value:
+            return iter(())
+        entries = ((vec, uid) for vec, uid, _ in self._walk(
+            tuple(prefix), node, True, lambda state, key: True))
+        return itertools.islice(entries, limit)
+
+    def prefix_names(
+        self,
+        prefix: str,
+        limit: Optional[int] = None
+    ) -> Iterator[Tuple[str, int]]:
+        '''Iterate over the (name, uid) entries starting with prefix.'''
+        return ((vec_to_str(vec), uid)
+            for vec, uid in self.prefix_entries(str_to_vec(prefix), limit))
+
+    def frequency_bounds(
+        self,
+        frequency: Callable[[int], float],
+        prefix: Tuple[int] = ()
+    ) -> Dict[int, float]:
+        '''Returns a map from each node under prefix that has entries below
+        it to the highest frequency(uid) among those entries.
+
+        This walks the whole subtrie, one level per get_edges_many() call.
+        The bounds stay valid until the trie or the frequencies change, so
+        callers making many most_frequent() queries should compute them
+        once and pass them in.
+        '''
+        NIL = ANOIReserved.NIL.value
+        PARENT = ANOIReserved.PARENT.value
+        REF = ANOIReserved.REF.value
+        ROOT = ANOIReserved.ROOT.value
+        bounds: Dict[int, float] = {}
+        node = self._find_node(prefix)
+        if node == NIL:
+            return bounds
+        # (node, parent) pairs in breadth first order.
+        visited = []
+        level = [(node, None)]
+        while len(level) > 0:
+            edges_list = self.space.get_edges_many(node for node, _ in level)
+            next_level = []
+            for (node, parent), edges in zip(level, edges_list):
+                if parent is not None and edges.get(PARENT) != parent:
+                    continue
+                visited.append((node, parent))
+                ref = edges.get(REF, NIL)
+                if ref != NIL and (parent is not None or len(prefix) > 0):
+                    bounds[node] = frequency(ref)
+                next_level.extend((child, node)
+                    for key, child in edges.items()
+                    if key != PARENT and key != REF and key != ROOT)
+            level = next_level
+        # Children come after their parents, so a reverse pass carries each
+        # bound up to the root of the subtrie.
+        for node, parent in reversed(visited):
+            if parent is not None and node in bounds and (
+                    parent not in bounds or bounds[parent] < bounds[node]):
+                bounds[parent] = bounds[node]
+        return bounds
+
+    def most_frequent(
+        self,
+        prefix: Tuple[int],
+        count: int,
+        frequency: Callable[[int], float],
+        bounds: Optional[Dict[int, float]] = None
+    ) -> List[Tuple[Tuple[int], int]]:
+        '''Returns the count (vector, uid) entries starting with prefix
+        that have the highest frequency(uid), most frequent first, and
+        shortest first among equals.
+
+        The search expands the subtries with the highest bounds (see
+        frequency_bounds()) first, up to count nodes per get_edges_many()
+        call, and stops once no unexpanded subtrie can beat the count best
+        entries found.  Without bounds, they are computed for the subtrie
+        under prefix first, which costs a walk of the whole subtrie.
+        '''
+        NIL = ANOIReserved.NIL.value
+        PARENT = ANOIReserved.PARENT.value
+        REF = ANOIReserved.REF.value
+        ROOT = ANOIReserved.ROOT.value
+        if count <= 0:
+            return []
+        if bounds is None:
+            bounds = self.frequency_bounds(frequency, prefix)
+        node = self._find_node(prefix)
+        if node == NIL or node not in bounds:
+            return []
+        # A min-heap of the best entries found, and a max-heap of subtries
+        # to expand, both keyed so that shorter vectors win ties.
+        best = []
+        frontier = [(-bounds[node], len(prefix), tuple(prefix), node, None)]
+        while len(frontier) > 0:
+            if len(best) == count and -frontier[0][0] < best[0][0]:
+                break
+            batch = []
+            while len(frontier) > 0 and len(batch) < count and (
+                    len(best) < count or -frontier[0][0] >= best[0][0]):
+                batch.append(heapq.heappop(frontier))
+            edges_list = self.space.get_edges_many(
+                node for _, _, _, node, _ in batch)
+            for (_, _, vec, node, parent), edges in zip(batch, edges_list):
+                if parent is not None and edges.get(PARENT) != parent:
+                    continue
+                ref = edges.get(REF, NIL)
+                if ref != NIL and len(vec) > 0:
+                    entry = (frequency(ref), -len(vec), vec, ref)
+                    if len(best) < count:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+                for key, child in edges.items():
+                    if key == PARENT or key == REF or key == ROOT:
+                        continue
+                    if child in bounds:
+                        heapq.heappush(frontier, (-bounds[child],
+                            len(vec) + 1, vec + (key,), child, node))
+        best.sort(reverse=True)
+        return [(vec, uid) for _, _, vec, uid in best]
+
+    def fuzzy_entries(
+        self,
+        vec: Tuple[int],
+        max_distance: int
+    ) -> List[Tuple[Tuple[int], int, int]]:
+        '''Returns (vector, uid, distance) for the entries within the given
+        Levenshtein distance of vec, closest first.
+
+        Each trie node carries the last row of the edit distance table
+        between vec and the node's vector, so shared prefixes are only
+        scored once, and subtries are skipped as soon as every cell of that
+        row exceeds max_distance.
+        '''
+        vec = tuple(vec)
+        def step(row: Tuple[int], key: int) -> Optional[Tuple[int]]:
+            next_row = [row[0] + 1]
+            for index, elem in enumerate(vec):
+                next_row.append(min(next_row[index] + 1, row[index + 1] + 1,
+                    row[index] + (elem != key)))
+            return tuple(next_row) if min(next_row) <= max_distance else None
+        result = [(entry_vec, uid, row[-1])
+            for entry_vec, uid, row in self._walk(
+                (), self.root, tuple(range(len(vec) + 1)), step)
+            if row[-1] <= max_distance]
+        result.sort(key=lambda entry: (entry[2], entry[0]))
+        return result
+
+    def fuzzy_names(
+        self,
+        name: str,
+        max_distance: int
+    ) -> List[Tuple[str, int, int]]:
+        '''Returns (name, uid, distance) for the entries within the given
+        edit distance of name, closest first.'''
+        return [(vec_to_str(vec), uid, distance)
+            for vec, uid, distance in self.fuzzy_entries(
+                str_to_vec(name), max_distance)]
+
+
+class ANOIAutomaton:
+    '''Immutable Aho-Corasick automaton compiled from the entries of a trie,
+    used to compress vectors in time linear in their length.
+
+    The automaton is built over the reversed entries, so scanning a vector
+    from back to front finds the longest entry starting at each position.  A
+    greedy forward pass over those matches then gives exactly what compress()
+    does against the source trie.
+    '''
+    def __init__(self, entries: Iterable[Tuple[Tuple[int], int]]):
+        NIL = ANOIReserved.NIL.value
+        goto: List[Dict[int, int]] = [{}]
+        match_len = [0]
+        match_ref = [NIL]
+        for vec, ref in entries:
+            state = 0
+            for uid in reversed(vec):
+                next_state = goto[state].get(uid)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto.append({})
+                    match_len.append(0)
+                    match_ref.append(NIL)
+                    goto[state][uid] = next_state
+                state = next_state
+            match_len[state] = len(vec)
+            match_ref[state] = ref
+        # Failure links, computed breadth first so a state's failure target
+        # always has its longest match finalized before the state does.
+        fail = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            if match_len[state] == 0:
+                match_len[state] = match_len[fail[state]]
+                match_ref[state] = match_ref[fail[state]]
+            for uid, next_state in goto[state].items():
+                fail_state = fail[state]
+                while fail_state != 0 and uid not in goto[fail_state]:
+                    fail_state = fail[fail_state]
+                fail[next_state] = goto[fail_state].get(uid, 0)
+                queue.append(next_state)
+        self.goto: Tuple[Dict[int, int]] = tuple(goto)
+        self.fail: Tuple[int] = tuple(fail)
+        self.match_len: Tuple[int] = tuple(match_len)
+        self.match_ref: Tuple[int] = tuple(match_ref)
+        # The longest entry, which is as far ahead as a match can reach.
+        self.max_len = max(match_len)
+
+    def __len__(self) -> int:
+        return len(self.goto)
+
+    def longest_matches(
+        self,
+        uid_vec: Tuple[int]
+    ) -> Tuple[List[int], List[int]]:
+        '''Returns the length and REF of the longest entry starting at each
+        position of the given vector (zero and NIL where there is none).'''
+        goto = self.goto
+        fail = self.fail
+        match_len = self.match_len
+        match_ref = self.match_ref
+        uid_vec_len = len(uid_vec)
+        lens = [0] * uid_vec_len
+        refs = [ANOIReserved.NIL.value] * uid_vec_len
+        state = 0
+        for i in range(uid_vec_len - 1, -1, -1):
+            uid = uid_vec[i]
+            while state != 0 and uid not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(uid, 0)
+            lens[i] = match_len[state]
+            refs[i] = match_ref[state]
+        return lens, refs
+
+    def compress_iter(self, uid_vec: Tuple[int]) -> Iterator[int]:
+        uid_vec = tuple(uid_vec)
+        return _greedy_matches(uid_vec, *self.longest_matches(uid_vec))
+
+    def compress(self, uid_vec: Tuple[int]) -> Tuple[int]:
+        return tuple(self.compress_iter(uid_vec))
+
+    def compress_stream(
+        self,
+        chunks: Iterable['ANOIChunk'],
+        encoding: str = 'utf-8'
+    ) -> Iterator[int]:
+        '''Compress a stream of chunks, see compress_stream().'''
+        return _compress_chunks(self.longest_matches, self.max_len,
+            _decode_chunks(chunks, encoding))
+
+
+def _greedy_matches(
+    uid_vec: Tuple[int],
+    lens: List[int],
+    refs: List[int]
+) -> Iterator[int]:
+    '''Yield the REF of the longest match at each position, skipping past
+    it, or the UID itself where nothing matches.'''
     i = 0
     uid_vec_len = len(uid_vec)
     while i < uid_vec_len:
-        crnt_uid = cross(trie.root, uid_vec[i])
-        last_good_ref = NIL
-        last_good_pos = i
-        j = i + 1
-        while (j <= uid_vec_len) and (NIL != crnt_uid):
-            crnt_ref = cross(crnt_uid, REF)
-            if NIL != crnt_ref:
-                last_good_ref = crnt_ref
-                last_good_pos = j
-            if j >= uid_vec_len:
-                break
-            crnt_uid = cross(crnt_uid, uid_vec[j])
-            j = j + 1
-        if last_good_ref == NIL:
-            # We got nothing, so yield the first UID...
+        if lens[i] == 0:
             yield uid_vec[i]
             i = i + 1
         else:
-            # Yield the largest match we found...
-            yield last_good_ref
-            i = last_good_pos
+            yield refs[i]
+            i = i + lens[i]
+
+
+# A piece of a stream to compress: text, encoded text, or UIDs.
+ANOIChunk = Union[str, bytes, bytearray, memoryview, Iterable[int]]
+
+def _decode_chunks(
+    chunks: Iterable[ANOIChunk],
+    encoding: str
+) -> Iterator[Tuple[int]]:
+    '''Turn a stream of chunks into UID vectors.  Bytes are decoded
+    incrementally, so characters may be split across chunks.'''
+    decoder = None
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            yield str_to_vec(chunk)
+        elif isinstance(chunk, (bytes, bytearray, memoryview)):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)()
+            yield str_to_vec(decoder.decode(chunk))
+        else:
+            yield tuple(chunk)
+    if decoder is not None:
+        yield str_to_vec(decoder.decode(b'', final=True))
+
+def _compress_chunks(
+    longest_matches: Callable[
+        [Tuple[int]], Tuple[List[int], List[int]]],
+    lookahead: int,
+    vecs: Iterable[Tuple[int]]
+) -> Iterator[int]:
+    '''Greedy compression of a stream of UID vectors.
+
+    The longest match starting at a position only depends on the next
+    lookahead UIDs, so once those have arrived it is final.  UIDs are
+    buffered until there are at least 2 * lookahead of them, and each scan
+    leaves fewer than lookahead behind, so the buffer holds fewer than
+    2 * lookahead UIDs plus the chunk just received.  Each scan covers at
+    least lookahead new positions, so small chunks do not cause the held
+    back UIDs to be rescanned over and over.
+    '''
+    buffer: List[int] = []
+    for vec in vecs:
+        buffer.extend(vec)
+        buffer_len = len(buffer)
+        if buffer_len < 2 * lookahead or buffer_len == 0:
+            continue
+        lens, refs = longest_matches(buffer)
+        stop = buffer_len - max(lookahead, 1)
+        i = 0
+        while i <= stop:
+            if lens[i] == 0:
+                yield buffer[i]
+                i = i + 1
+            else:
+                yield refs[i]
+                i = i + lens[i]
+        # Only the fewer than lookahead UIDs left over are moved.
+        del buffer[:i]
+    yield from _greedy_matches(buffer, *longest_matches(buffer))
+
+
+# Objects derived from a space (root tries, namespaces, compiled automata,
+# and so on) are cached in a registry stored on the space itself, so they are
+# freed along with it.  Spaces with registries are tracked weakly, so that
+# evict_all() can find them.
+_registered_spaces: weakref.WeakSet = weakref.WeakSet()
+
+def space_registry(space: ANOISpace) -> Dict[Any, Any]:
+    '''Returns the cache of objects derived from a space.'''
+    registry = space.__dict__.get('_registry')
+    if registry is None:
+        registry = space._registry = {}
+        _registered_spaces.add(space)
+    return registry
+
+def get_cached(space: ANOISpace, key: Any, factory: Callable[[], Any]) -> Any:
+    '''Returns the object cached for a space under key, calling factory()
+    to create it if there is none.'''
+    registry = space_registry(space)
+    try:
+        return registry[key]
+    except KeyError:
+        result = registry[key] = factory()
+        return result
+
+def get_versioned(
+    space: ANOISpace,
+    key: Any,
+    factory: Callable[[], Any]
+) -> Any:
+    '''Like get_cached(), but the object is made again once the space's
+    version has changed (see ANOISpace.get_version()), for objects that
+    depend on what is in the space, whatever wrote to it.'''
+    version = space.get_version()
+    registry = space_registry(space)
+    cached = registry.get(key)
+    if cached is None or cached[0] != version:
+        cached = registry[key] = (version, factory())
+    return cached[1]
+
+def space_cached(func: Callable) -> Callable:
+    '''Decorator caching func(space, *args) in the space's registry.'''
+    @functools.wraps(func)
+    def wrapper(space: ANOISpace, *args):
+        return get_cached(space, (wrapper,) + args, lambda: func(space, *args))
+    return wrapper
+
+def evict(space: ANOISpace, key: Any = None) -> None:
+    '''Drop the object cached for a space under key, or everything cached for
+    the space if no key is given.'''
+    if key is None:
+        space.__dict__.pop('_registry', None)
+        _registered_spaces.discard(space)
+    else:
+        space.__dict__.get('_registry', {}).pop(key, None)
+
+def evict_all() -> None:
+    '''Drop everything cached for every space.'''
+    for space in tuple(_registered_spaces):
+        evict(space)
+
+def compile_trie(trie: ANOITrie) -> ANOIAutomaton:
+    '''Returns a (cached) automaton for compressing against the given trie.
+    The automaton is compiled again after any write to the space, since the
+    space version is all that says whether the trie changed.
+    '''
+    return get_versioned(trie.space, (compile_trie, trie.root),
+        lambda: ANOIAutomaton(trie.entries()))
+
+
+def compress_iter(trie: ANOITrie, uid_vec: Tuple[int]) -> Iterator[int]:
+    '''Greedy longest-match compression of a vector against a trie, in a
+    single pass over the vector using the trie's compiled automaton (see
+    compile_trie()), or on the server for spaces with server side tries.'''
+    if trie.space.server_side_tries:
+        return iter(trie.space.trie_compress(trie.root, tuple(uid_vec)))
+    return compile_trie(trie).compress_iter(uid_vec)
 
 def compress(trie: ANOITrie, uid_vec: Tuple[int]) -> Tuple[int]:
     return tuple(compress_iter(trie, uid_vec))
 
+def compress_stream(
+    trie: ANOITrie,
+    chunks: Iterable[ANOIChunk],
+    encoding: str = 'utf-8'
+) -> Iterator[int]:
+    '''Compress a stream of chunks (from a file, a socket, and so on),
+    yielding the same UIDs compress() would for their concatenation.
+
+    Chunks may be strings, bytes in the given encoding, or UID vectors.
+    Besides the current chunk, fewer than twice as many UIDs as the longest
+    entry of the trie are held at once, so memory does not grow with the
+    stream.
+    '''
+    return compile_trie(trie).compress_stream(chunks, encoding)
+
+
+class ANOIDecompressor:
+    '''Inverse of compress() against one or more tries.
+
+    A UID in a compressed vector is expanded if it is an entry of one of the
+    tries, that is, if uid x root gives a trie node (see set_vector()), and
+    is passed through unchanged otherwise.  Where a UID is an entry of more
+    than one trie, the first trie given wins.  Vectors are rebuilt from the
+    node's PARENT chain, using each parent's edges to find the key of the
+    child below it.
+
+    Expansions are memoized per UID, and vectors per trie node, in caches
+    of up to cache_size entries each, so nodes shared by many entries are
+    walked once.  Uncached UIDs are expanded together: one cross_many() to
+    find their nodes, then one get_edges_many() per trie level for all of
+    their PARENT chains.
+
+    Compressing input that already contains trie entries is ambiguous, so
+    decompress(compress(vec)) == vec only holds for vectors with no
+    entries in them, such as text.
+    '''
+    def __init__(
+        self,
+        tries: Iterable[ANOITrie],
+        cache_size: int = 65536
+    ) -> None:
+        self.tries = tuple(tries)
+        if len(self.tries) == 0:
+            raise ValueError('at least one trie is required')
+        self.space = self.tries[0].space
+        self.roots = tuple(trie.root for trie in self.tries)
+        self.cache_size = cache_size
+        self.expansions: Dict[int, Tuple[int]] = {}
+        self.vectors: Dict[int, Tuple[int]] = {root: () for root in self.roots}
+        # Root edges, reversed, which are needed by every expansion.
+        self.root_keys: Dict[int, Dict[int, int]] = {}
+
+    @staticmethod
+    def _trim(cache: Dict[int, Tuple[int]], size: int, keep=()) -> None:
+        '''Drop the oldest entries of a cache past the given size.'''
+        if len(cache) > size:
+            for key in tuple(itertools.islice(cache, len(cache) - size)):
+                if key not in keep:
+                    del cache[key]
+
+    def _node_vectors(self, nodes: Iterable[int]) -> Dict[int, Tuple[int]]:
+        '''Returns the vectors of the given trie nodes, leaving out any that
+        are not properly linked into a trie.'''
+        NIL = ANOIReserved.NIL.value
+        PARENT = ANOIReserved.PARENT.value
+        vectors = self.vectors
+        roots = self.roots
+        space = self.space
+        if len(self.root_keys) == 0:
+            self.root_keys = {root: {child: key
+                for key, child in edges.items()}
+                for root, edges in zip(roots, space.get_edges_many(roots))}
+        parents: Dict[int, int] = {}
+        child_keys: Dict[int, Dict[int, int]] = dict(self.root_keys)
+        # Walk up the PARENT chains of all uncached nodes a level at a
+        # time.  Each wave fetches the edges of the nodes still being
+        # walked, giving their parents, and the keys of their children.
+        wave = {node for node in nodes if node not in vectors}
+        while len(wave) > 0:
+            wave = tuple(wave)
+            next_wave = set()
+            for node, edges in zip(wave, space.get_edges_many(wave)):
+                child_keys[node] = {child: key
+                    for key, child in edges.items()}
+                if node in vectors:
+                    continue
+                parent = parents[node] = edges.get(PARENT, NIL)
+                if parent != NIL and parent not in child_keys:
+                    next_wave.add(parent)
+            wave = next_wave
+        result = {}
+        for node in nodes:
+            chain = []
+            while node not in vectors and node not in result:
+                parent = parents.get(node, NIL)
+                key = child_keys.get(parent, {}).get(node)
+                # Give up on broken links, and on PARENT cycles.
+                if key is None or len(chain) > len(parents):
+                    break
+                chain.append((node, key))
+                node = parent
+            else:
+                vec = vectors[node] if node in vectors else result[node]
+                for child, key in reversed(chain):
+                    vec = vec + (key,)
+                    result[child] = vec
+                    vectors[child] = vec
+                if len(chain) == 0:
+                    result[node] = vec
+        self._trim(vectors, self.cache_size, roots)
+        return result
+
+    def expand_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        '''Returns the expansion of each of the given UIDs.'''
+        uids = tuple(uids)
+        expansions = self.expansions
+        missing = [uid for uid in dict.fromkeys(uids)
+            if uid not in expansions]
+        if len(missing) > 0:
+            NIL = ANOIReserved.NIL.value
+            space = self.space
+            roots = self.roots
+            valid_uids = [uid
+                for uid, valid in zip(missing, space.is_valid_many(missing))
+                if valid]
+            nodes = iter(space.cross_many((uid, root)
+                for uid in valid_uids for root in roots))
+            entry_nodes = {}
+            for uid in valid_uids:
+                uid_nodes = [next(nodes) for _ in roots]
+                for node in uid_nodes:
+                    if node != NIL:
+                        entry_nodes[uid] = node
+                        break
+            node_vectors = self._node_vectors(entry_nodes.values())
+            for uid in missing:
+                node = entry_nodes.get(uid)
+                expansions[uid] = node_vectors.get(node, (uid,))
+            result = tuple(expansions[uid] for uid in uids)
+            self._trim(expansions, self.cache_size)
+            return result
+        return tuple(expansions[uid] for uid in uids)
+
+    def expand(self, uid: int) -> Tuple[int]:
+        '''Returns the vector a UID stands for, or (uid,) if it is not an
+        entry of any of the tries.'''
+        return self.expand_many((uid,))[0]
+
+    def decompress_iter(
+        self,
+        uid_vec: Iterable[int],
+        chunk_size: int = 4096
+    ) -> Iterator[int]:
+        '''Stream the expansion of a compressed vector, which may be any
+        iterable, expanding chunk_size UIDs at a time.'''
+        uid_iter = iter(uid_vec)
+        while True:
+            chunk = tuple(itertools.islice(uid_iter, chunk_size))
+            if len(chunk) == 0:
+                break
+            for expansion in self.expand_many(chunk):
+                yield from expansion
+
+    def decompress(self, uid_vec: Iterable[int]) -> Tuple[int]:
+        return tuple(self.decompress_iter(uid_vec))
+
+
+def get_decompressor(tries: Iterable[ANOITrie]) -> ANOIDecompressor:
+    '''Returns the (cached) decompressor for the given tries, which is made
+    again after any write to the space, as in compile_trie().'''
+    tries = tuple(tries)
+    return get_versioned(tries[0].space,
+        (ANOIDecompressor, tuple(trie.root for trie in tries)),
+        lambda: ANOIDecompressor(tries))
+
+def decompress_iter(trie: ANOITrie, uid_vec: Iterable[int]) -> Iterator[int]:
+    return get_decompressor((trie,)).decompress_iter(uid_vec)
+
+def decompress(trie: ANOITrie, uid_vec: Iterable[int]) -> Tuple[int]:
+    return tuple(decompress_iter(trie, uid_vec))
+
+
+class ANOIAutomatonStack:
+    '''Compiled automata of a stack of tries, top first, which compress as
+    ANOILexicon does.  Unlike a lexicon, a stack does not refer to the space
+    (or see later changes to the tries), so it can be sent to worker
+    processes.
+
+    At each position the longest entry in any of the tries wins, and where
+    tries tie, the one nearer the top of the stack does.  The automata are
+    run side by side, so a vector is scanned once however deep the stack
+    is.
+    '''
+    def __init__(self, automata: Iterable[ANOIAutomaton]) -> None:
+        self.automata = tuple(automata)
+        if len(self.automata) == 0:
+            raise ValueError('a lexicon needs at least one trie')
+        self.max_len = max(automaton.max_len for automaton in self.automata)
+
+    def longest_matches(
+        self,
+        uid_vec: Tuple[int]
+    ) -> Tuple[List[int], List[int]]:
+        '''Returns the length and REF of the longest entry starting at each
+        position, as ANOIAutomaton.longest_matches() does for one trie.'''
+        tables = [
+            (automaton.goto, automaton.fail, automaton.match_len,
+                automaton.match_ref)
+            for automaton in self.automata]
+        states = [0] * len(tables)
+        uid_vec_len = len(uid_vec)
+        NIL = ANOIReserved.NIL.value
+        lens = [0] * uid_vec_len
+        refs = [NIL] * uid_vec_len
+        for i in range(uid_vec_len - 1, -1, -1):
+            uid = uid_vec[i]
+            best_len = 0
+            best_ref = NIL
+            for index, (goto, fail, match_len, match_ref) in enumerate(
+                    tables):
+                state = states[index]
+                while state != 0 and uid not in goto[state]:
+                    state = fail[state]
+                state = states[index] = goto[state].get(uid, 0)
+                if match_len[state] > best_len:
+                    best_len = match_len[state]
+                    best_ref = match_ref[state]
+            lens[i] = best_len
+            refs[i] = best_ref
+        return lens, refs
+
+    def compress_iter(self, uid_vec: Tuple[int]) -> Iterator[int]:
+        uid_vec = tuple(uid_vec)
+        return _greedy_matches(uid_vec, *self.longest_matches(uid_vec))
+
+    def compress(self, uid_vec: Tuple[int]) -> Tuple[int]:
+        return tuple(self.compress_iter(uid_vec))
+
+    def compress_stream(
+        self,
+        chunks: Iterable[ANOIChunk],
+        encoding: str = 'utf-8'
+    ) -> Iterator[int]:
+        '''Compress a stream of chunks, see compress_stream().  The lookahead
+        is that of the trie with the longest entry.'''
+        return _compress_chunks(self.longest_matches, self.max_len,
+            _decode_chunks(chunks, encoding))
+
+
+class ANOILexicon:
+    '''A stack of tries to compress against, top first, see
+    ANOIAutomatonStack.
+
+    Each trie's automaton comes from compile_trie(), so it is shared with
+    every other lexicon and compress() call that uses the trie, and is
+    rebuilt once the space has been written to.  Compile the lexicon once
+    for a run of compressions without writes in between.
+    '''
+    def __init__(self, tries: Iterable[ANOITrie]) -> None:
+        self.tries = tuple(tries)
+        if len(self.tries) == 0:
+            raise ValueError('a lexicon needs at least one trie')
+
+    def compile(self) -> ANOIAutomatonStack:
+        '''Returns the automata of the tries as they are now.'''
+        return ANOIAutomatonStack(compile_trie(trie) for trie in self.tries)
+
+    def longest_matches(
+        self,
+        uid_vec: Tuple[int]
+    ) -> Tuple[List[int], List[int]]:
+        return self.compile().longest_matches(uid_vec)
+
+    def compress_iter(self, uid_vec: Tuple[int]) -> Iterator[int]:
+        return self.compile().compress_iter(uid_vec)
+
+    def compress(self, uid_vec: Tuple[int]) -> Tuple[int]:
+        return tuple(self.compress_iter(uid_vec))
+
+    def compress_stream(
+        self,
+        chunks: Iterable[ANOIChunk],
+        encoding: str = 'utf-8'
+    ) -> Iterator[int]:
+        return self.compile().compress_stream(chunks, encoding)
+
+    def decompress_iter(self, uid_vec: Iterable[int]) -> Iterator[int]:
+        return get_decompressor(self.tries).decompress_iter(uid_vec)
+
+    def decompress(self, uid_vec: Iterable[int]) -> Tuple[int]:
+        return tuple(self.decompress_iter(uid_vec))
+
+
 def build_root_trie(space: ANOISpace) -> ANOITrie:
     '''Build the boot trie for a space.'''
     root_trie = ANOITrie(space)
@@ -365,11 +1788,13 @@ def build_root_trie(space: ANOISpace) -> ANOITrie:
         root_trie.set_name(bootstrapped_name, target_uid)
         target_name_uid = space.get_uid()
         space.set_content(target_name_uid, str_to_vec(bootstrapped_name))
-        space.cross_equals(target_uid, name_uid, target_name_uid)
-        space.cross_equals(target_name_uid, type_uid, name_uid)
+        space.cross_equals_many((
+            (target_uid, name_uid, target_name_uid),
+            (target_name_uid, type_uid, name_uid),
+        ))
     return root_trie
 
-@functools.cache
+@space_cached
 def root_trie(space: ANOISpace) -> ANOITrie:
     # TODO: More type checking than just validity on ROOT atom?
     if not space.is_valid(ANOIReserved.ROOT.value):
@@ -405,9 +1830,9 @@ class ANOITrieProxy:
         self.__trie__.set_name(str(item), int(value))
 
     @classmethod
-    @functools.cache
     def root(cls, space: ANOISpace):
-        return cls(root_trie(space))
+        return get_cached(
+            space, (cls, 'root'), lambda: cls(root_trie(space)))
 
 
 class ANOINamespace(ANOITrie):
@@ -437,8 +1862,10 @@ class ANOINamespace(ANOITrie):
         if result == ANOIReserved.NIL.value:
             result = self.space.get_uid()
             self.space.set_content(result, str_to_vec(name))
-            self.space.cross_equals(result, self.TYPE, self.NAME)
-            self.space.cross_equals(atom_uid, self.NAME, result)
+            self.space.cross_equals_many((
+                (result, self.TYPE, self.NAME),
+                (atom_uid, self.NAME, result),
+            ))
         return result
 
     def set_name(self, name: str, uid: int) -> int:
@@ -447,8 +1874,9 @@ class ANOINamespace(ANOITrie):
         return result
 
     @classmethod
-    @functools.cache
     def get(cls, space: ANOISpace, name: str, basis_uid: int = None):
-        '''Either construct or return a singleton ANOINamespace instance.
+        '''Either construct or return the ANOINamespace instance cached for
+        the space.
         '''
-        return cls(space, name, basis_uid)
+        return get_cached(space, (cls, 'get', name, basis_uid),
+            lambda: cls(space, name, basis_uid))
@@ -0,0 +1,293 @@
+'''Read-through atom cache in front of another ANOI space.
+'''
+
+import collections
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from .basis import ANOISpace
+
+
+class _CachedAtom:
+    '''What is known about one atom.  None means not cached.'''
+    __slots__ = ('valid', 'keys', 'content', 'edges')
+
+    def __init__(self) -> None:
+        self.valid: Optional[bool] = None
+        self.keys: Optional[Tuple[int]] = None
+        self.content: Optional[Tuple[int]] = None
+        self.edges: Dict[int, int] = {}
+
+
+class ANOICachedSpace(ANOISpace):
+    '''Space wrapper that caches validity, keys, contents and cross products
+    of recently used atoms.
+
+    The cache holds at most max_size entries, where an atom costs one entry
+    plus one per cached cross product, and least recently used atoms are
+    evicted first.  Writes go through to the wrapped space and update or
+    drop the affected atoms.
+
+    Writes by other clients of the wrapped space (another process sharing a
+    Redis namespace, or code holding the wrapped space itself) are noticed
+    through the wrapped space's get_version(), which is checked at most once
+    every check_interval seconds, and around each write.  Spaces that report
+    the versions their writes went between (see ANOISpace.write_versions),
+    as the Redis spaces do, need no extra round trips for that.  A cached
+    space that finds the version changed by someone else clears itself.
+    Writes made by others while a write of its own is in flight can be
+    missed until the next one.
+    '''
+    def __init__(
+        self,
+        space: ANOISpace,
+        max_size: int = 1 << 18,
+        check_interval: float = 1.
+    ) -> None:
+        super().__init__()
+        self.space = space
+        self.max_size = max_size
+        self.atoms: collections.OrderedDict = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.check_interval = check_interval
+        self.version = self.space.get_version()
+        self.checked = time.monotonic()
+        self.written: Optional[Tuple[int, int]] = None
+
+    def clear(self) -> None:
+        '''Drop all cached atoms.'''
+        self.atoms.clear()
+        self.size = 0
+
+    def _check_version(self, force: bool = False) -> None:
+        '''Clear the cache if the wrapped space changed since the last
+        check.'''
+        now = time.monotonic()
+        if not force and now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        version = self.space.get_version()
+        if version != self.version:
+            self.version = version
+            self.clear()
+
+    def _before_write(self) -> None:
+        self.written = self.space.write_versions
+        if self.written is None:
+            self._check_version(True)
+
+    def _after_write(self) -> None:
+        # The change is our own, and the cache is updated to match, but the
+        # versions the write went between can show other writes since the
+        # last check.
+        versions = self.space.write_versions
+        if versions is None:
+            self.version = self.space.get_version()
+        elif versions is not self.written:
+            if versions[0] != self.version:
+                self.clear()
+            self.version = versions[1]
+
+    def _atom(self, uid: int) -> _CachedAtom:
+        atom = self.atoms.get(uid)
+        if atom is None:
+            atom = self.atoms[uid] = _CachedAtom()
+            self.size += 1
+            self._evict()
+        else:
+            self.atoms.move_to_end(uid)
+        return atom
+
+    def _drop(self, uid: int) -> None:
+        atom = self.atoms.pop(uid, None)
+        if atom is not None:
+            self.size -= 1 + len(atom.edges)
+
+    def _evict(self) -> None:
+        atoms = self.atoms
+        while self.size > self.max_size and len(atoms) > 1:
+            _, atom = atoms.popitem(last=False)
+            self.size -= 1 + len(atom.edges)
+
+    def _set_edge(self, atom: _CachedAtom, uid1: int, uid2: int) -> None:
+        if uid1 not in atom.edges:
+            self.size += 1
+        atom.edges[uid1] = uid2
+
+    def cross(self, uid0: int, uid1: int) -> int:
+        self._check_version()
+        atom = self._atom(uid0)
+        result = atom.edges.get(uid1)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = self.space.cross(uid0, uid1)
+        self._set_edge(atom, uid1, result)
+        self._evict()
+        return result
+
+    def cross_equals(self, uid0: int, uid1: int, uid2: int) -> None:
+        self._before_write()
+        self.space.cross_equals(uid0, uid1, uid2)
+        self._after_write()
+        atom = self.atoms.get(uid0)
+        if atom is not None:
+            self._set_edge(atom, uid1, uid2)
+            atom.keys = None
+            self._evict()
+
+    def free_uid(self, uid: int) -> None:
+        self._before_write()
+        self.space.free_uid(uid)
+        self._after_write()
+        self._drop(uid)
+
+    def get_content(self, uid: int) -> Tuple[int]:
+        self._check_version()
+        atom = self._atom(uid)
+        if atom.content is not None:
+            self.hits += 1
+            return atom.content
+        self.misses += 1
+        atom.content = self.space.get_content(uid)
+        return atom.content
+
+    def get_keys(self, uid: int) -> Tuple[int]:
+        self._check_version()
+        atom = self._atom(uid)
+        if atom.keys is not None:
+            self.hits += 1
+            return atom.keys
+        self.misses += 1
+        atom.keys = self.space.get_keys(uid)
+        return atom.keys
+
+    def get_uid(self) -> int:
+        return self.get_uids(1)[0]
+
+    def get_uids(self, count: int) -> Tuple[int]:
+        self._before_write()
+        result = self.space.get_uids(count)
+        self._after_write()
+        for uid in result:
+            self._drop(uid)
+        return result
+
+    def get_version(self) -> int:
+        return self.space.get_version()
+
+    def is_valid(self, uid: int) -> bool:
+        self._check_version()
+        atom = self._atom(uid)
+        if atom.valid is not None:
+            self.hits += 1
+            return atom.valid
+        self.misses += 1
+        atom.valid = self.space.is_valid(uid)
+        return atom.valid
+
+    def iter_uids(self) -> Iterator[int]:
+        return self.space.iter_uids()
+
+    def set_content(self, uid: int, content: Tuple[int]) -> None:
+        self._before_write()
+        self.space.set_content(uid, content)
+        self._after_write()
+        atom = self.atoms.get(uid)
+        if atom is not None:
+            atom.content = tuple(content)
+
+    def validate(self, uid: int) -> bool:
+        self._before_write()
+        result = self.space.validate(uid)
+        self._after_write()
+        if not result:
+            self._drop(uid)
+        return result
+
+    # Batch reads only pass cache misses on to the wrapped space.
+
+    def cross_many(self, pairs: Iterable[Tuple[int, int]]) -> Tuple[int]:
+        self._check_version()
+        pairs = tuple(pairs)
+        results = [self._atom(uid0).edges.get(uid1) for uid0, uid1 in pairs]
+        missing = [index for index, result in enumerate(results)
+            if result is None]
+        self.hits += len(results) - len(missing)
+        self.misses += len(missing)
+        if len(missing) > 0:
+            fetched = self.space.cross_many(pairs[index] for index in missing)
+            for index, result in zip(missing, fetched):
+                uid0, uid1 = pairs[index]
+                results[index] = result
+                atom = self.atoms.get(uid0)
+                if atom is not None:
+                    self._set_edge(atom, uid1, result)
+            self._evict()
+        return tuple(results)
+
+    def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        triples = tuple(triples)
+        self._before_write()
+        self.space.cross_equals_many(triples)
+        self._after_write()
+        for uid0, uid1, uid2 in triples:
+            atom = self.atoms.get(uid0)
+            if atom is not None:
+                self._set_edge(atom, uid1, uid2)
+                atom.keys = None
+        self._evict()
+
+    def free_uid_many(self, uids: Iterable[int]) -> None:
+        uids = tuple(uids)
+        self._before_write()
+        self.space.free_uid_many(uids)
+        self._after_write()
+        for uid in uids:
+            self._drop(uid)
+
+    def _get_many(self, field: str, fetch, uids: Iterable[int]) -> tuple:
+        '''Shared body of the batch reads of per-atom fields, where fetch is
+        the wrapped space's batch method.'''
+        self._check_version()
+        uids = tuple(uids)
+        atoms = [self._atom(uid) for uid in uids]
+        results = [getattr(atom, field) for atom in atoms]
+        missing = [index for index, result in enumerate(results)
+            if result is None]
+        self.hits += len(results) - len(missing)
+        self.misses += len(missing)
+        if len(missing) > 0:
+            fetched = fetch(uids[index] for index in missing)
+            for index, result in zip(missing, fetched):
+                setattr(atoms[index], field, result)
+                results[index] = result
+        return tuple(results)
+
+    def get_content_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        return self._get_many('content', self.space.get_content_many, uids)
+
+    def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        return self._get_many('keys', self.space.get_keys_many, uids)
+
+    def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        return self._get_many('valid', self.space.is_valid_many, uids)
+
+    def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        items = tuple(items)
+        self._before_write()
+        self.space.set_content_many(items)
+        self._after_write()
+        for uid, content in items:
+            atom = self.atoms.get(uid)
+            if atom is not None:
+                atom.content = tuple(content)
@@ -0,0 +1,318 @@
+'''Compact, array backed in-memory ANOI space.
+'''
+
+import array
+import bisect
+import time
+from typing import Dict, Iterator, Sequence, Set, Tuple
+
+from .basis import ANOIReserved, ANOISpace
+
+
+MIN_UNRESERVED = ANOIReserved.MIN_UNRESERVED.value
+NIL = ANOIReserved.NIL.value
+UID_LIMIT = 1 << 32
+
+
+class ANOICompactSpace(ANOISpace):
+    '''In-memory space that keeps atoms in flat arrays instead of per-atom
+    Python objects.
+
+    UIDs allocated by get_uid() are dense from MIN_UNRESERVED, so their
+    validity, content offset, and content length live in parallel arrays
+    indexed by UID.  Contents are stored back to back in a single uint32
+    arena.  Any other UIDs that get validated (reserved UIDs, code points)
+    are kept in a small dictionary of content tuples.
+
+    Cross products live in a columnar edge table: a sorted array of packed
+    (uid0 << 32 | uid1) keys with a parallel array of uid2 values.  New edges
+    go into a small delta map, and freeing an atom queues its UID as dead
+    rather than deleting its run of the table.  Both are folded into the
+    sorted table once they grow past a fraction of the table size.
+
+    Like ANOIRedis32Space, UIDs are limited to 32 bits.
+    '''
+    def __init__(self, merge_threshold: int = 65536) -> None:
+        super().__init__()
+        assert array.array('I').itemsize == 4
+        self.merge_threshold = merge_threshold
+        # Dense atoms, indexed by uid - MIN_UNRESERVED.
+        self.valid = bytearray()
+        # Content offsets count uint32 units, so they fit in 32 bits too.
+        self.content_start = array.array('I')
+        self.content_len = array.array('I')
+        # Content arena, and how much of it is no longer referenced.
+        self.arena = array.array('I')
+        self.arena_garbage = 0
+        # Freed dense slots, reused before the dense range grows.
+        self.free_slots = array.array('I')
+        # Atoms outside the dense range.
+        self.sparse_content: Dict[int, Tuple[int]] = {}
+        # Edge table and unmerged edges.
+        self.edge_keys = array.array('Q')
+        self.edge_values = array.array('I')
+        self.edge_delta: Dict[int, Dict[int, int]] = {}
+        self.delta_size = 0
+        # Freed uid0s whose table entries are ignored until the next merge.
+        self.dead_uids: Set[int] = set()
+        # Modification counter, started from the clock as in
+        # ANOIInMemorySpace.
+        self.version = time.time_ns()
+
+    @staticmethod
+    def _check_width(uid: int) -> None:
+        if not 0 <= uid < UID_LIMIT:
+            raise ValueError(f'UID {uid} does not fit in 32 bits.')
+
+    def _slot(self, uid: int) -> int:
+        '''Returns the dense slot of a valid UID, or -1.'''
+        slot = uid - MIN_UNRESERVED
+        if 0 <= slot < len(self.valid) and self.valid[slot]:
+            return slot
+        return -1
+
+    def _edge_range(self, uid0: int) -> Tuple[int, int]:
+        keys = self.edge_keys
+        return (bisect.bisect_left(keys, uid0 << 32),
+                bisect.bisect_left(keys, (uid0 + 1) << 32))
+
+    def _merge_limit(self) -> int:
+        return max(self.merge_threshold, len(self.edge_keys) >> 3)
+
+    def _pending_size(self) -> int:
+        return self.delta_size + len(self.dead_uids)
+
+    def _drop_dead_edges(self) -> None:
+        '''Remove the table entries of freed uid0s.'''
+        old_keys = self.edge_keys
+        old_values = self.edge_values
+        keys = array.array('Q')
+        values = array.array('I')
+        start = 0
+        for uid0 in sorted(self.dead_uids):
+            lo, hi = self._edge_range(uid0)
+            keys.extend(old_keys[start:lo])
+            values.extend(old_values[start:lo])
+            start = max(start, hi)
+        keys.extend(old_keys[start:])
+        values.extend(old_values[start:])
+        self.edge_keys = keys
+        self.edge_values = values
+        self.dead_uids = set()
+
+    def merge_edges(self) -> None:
+        '''Fold the delta map and queued deletions into the sorted edge
+        table.'''
+        if len(self.dead_uids) > 0:
+            self._drop_dead_edges()
+        if self.delta_size == 0:
+            return
+        delta_items = sorted(
+            ((uid0 << 32) | uid1, uid2)
+            for uid0, uid_map in self.edge_delta.items()
+            for uid1, uid2 in uid_map.items())
+        # Delta keys are never in the table (cross_equals() overwrites those
+        # in place, and dead entries are gone by now), so each one is
+        # bisected into the table, and the runs of table entries between
+        # them are copied across as slices.
+        old_keys = self.edge_keys
+        old_values = self.edge_values
+        size = len(old_keys) + len(delta_items)
+        keys = array.array('Q', (0,)) * size
+        values = array.array('I', (0,)) * size
+        start = 0
+        for offset, (key, value) in enumerate(delta_items):
+            index = bisect.bisect_left(old_keys, key, start)
+            keys[start + offset:index + offset] = old_keys[start:index]
+            values[start + offset:index + offset] = old_values[start:index]
+            keys[index + offset] = key
+            values[index + offset] = value
+            start = index
+        keys[start + len(delta_items):] = old_keys[start:]
+        values[start + len(delta_items):] = old_values[start:]
+        self.edge_keys = keys
+        self.edge_values = values
+        self.edge_delta = {}
+        self.delta_size = 0
+
+    def compact_arena(self) -> None:
+        '''Rewrite the content arena without unreferenced contents.'''
+        arena = self.arena
+        new_arena = array.array('I')
+        content_start = self.content_start
+        content_len = self.content_len
+        for slot, valid in enumerate(self.valid):
+            if valid and content_len[slot] > 0:
+                start = content_start[slot]
+                content_start[slot] = len(new_arena)
+                new_arena.extend(arena[start:start + content_len[slot]])
+            else:
+                content_start[slot] = 0
+                content_len[slot] = 0
+        self.arena = new_arena
+        self.arena_garbage = 0
+
+    def compact(self) -> None:
+        '''Merge pending edges and drop unreferenced contents.'''
+        self.merge_edges()
+        self.compact_arena()
+
+    def cross(self, uid0: int, uid1: int) -> int:
+        self.check(uid0)
+        uid_map = self.edge_delta.get(uid0)
+        if uid_map is not None and uid1 in uid_map:
+            return uid_map[uid1]
+        if not 0 <= uid1 < UID_LIMIT or uid0 in self.dead_uids:
+            return NIL
+        key = (uid0 << 32) | uid1
+        keys = self.edge_keys
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            return self.edge_values[index]
+        return NIL
+
+    def cross_equals(self, uid0: int, uid1: int, uid2: int) -> None:
+        self.check(uid0)
+        self._check_width(uid1)
+        self._check_width(uid2)
+        self.version += 1
+        if uid0 not in self.dead_uids:
+            key = (uid0 << 32) | uid1
+            keys = self.edge_keys
+            index = bisect.bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                self.edge_values[index] = uid2
+                return
+        uid_map = self.edge_delta.setdefault(uid0, {})
+        if uid1 not in uid_map:
+            self.delta_size += 1
+        uid_map[uid1] = uid2
+        if self._pending_size() >= self._merge_limit():
+            self.merge_edges()
+
+    def free_uid(self, uid: int) -> None:
+        self.check(uid)
+        self.version += 1
+        # The atom's run of the edge table is dropped on the next merge.
+        self.dead_uids.add(uid)
+        self.delta_size -= len(self.edge_delta.pop(uid, ()))
+        slot = self._slot(uid)
+        if slot >= 0:
+            self.valid[slot] = 0
+            self.arena_garbage += self.content_len[slot]
+            self.content_len[slot] = 0
+            self.free_slots.append(slot)
+        else:
+            del self.sparse_content[uid]
+        if self._pending_size() >= self._merge_limit():
+            self.merge_edges()
+
+    def get_content(self, uid: int) -> Tuple[int]:
+        slot = self._slot(uid)
+        if slot >= 0:
+            start = self.content_start[slot]
+            return tuple(self.arena[start:start + self.content_len[slot]])
+        self.check(uid)
+        return self.sparse_content[uid]
+
+    def get_content_view(self, uid: int) -> Sequence[int]:
+        slot = self._slot(uid)
+        if slot >= 0:
+            start = self.content_start[slot]
+            return self.arena[start:start + self.content_len[slot]]
+        return super().get_content_view(uid)
+
+    def get_keys(self, uid: int) -> Tuple[int]:
+        self.check(uid)
+        result = ()
+        if uid not in self.dead_uids:
+            lo, hi = self._edge_range(uid)
+            result = tuple(key & 0xffffffff for key in self.edge_keys[lo:hi])
+        uid_map = self.edge_delta.get(uid)
+        if uid_map is not None:
+            result += tuple(uid_map.keys())
+        return result
+
+    def get_uid(self) -> int:
+        return self.get_uids(1)[0]
+
+    def get_uids(self, count: int) -> Tuple[int]:
+        result = []
+        valid = self.valid
+        free_slots = self.free_slots
+        while len(free_slots) > 0 and len(result) < count:
+            slot = free_slots.pop()
+            # The slot may have been validated again since it was freed, in
+            # which case it is in use, and free_uid() queues it again.
+            if not valid[slot]:
+                valid[slot] = 1
+                result.append(MIN_UNRESERVED + slot)
+        while len(result) < count:
+            needed = count - len(result)
+            start = len(valid)
+            self._check_width(MIN_UNRESERVED + start + needed - 1)
+            valid.extend(b'\1' * needed)
+            self.content_start.frombytes(bytes(4 * needed))
+            self.content_len.frombytes(bytes(4 * needed))
+            for slot in range(start, start + needed):
+                uid = MIN_UNRESERVED + slot
+                # UIDs that were validated before the dense range got here
+                # move into their slots, so that freeing them later frees
+                # the slot, and are skipped.
+                content = self.sparse_content.pop(uid, None)
+                if content is None:
+                    result.append(uid)
+                elif len(content) > 0:
+                    self.content_start[slot] = len(self.arena)
+                    self.content_len[slot] = len(content)
+                    self.arena.extend(content)
+        self.version += 1
+        return tuple(result)
+
+    def get_version(self) -> int:
+        return self.version
+
+    def is_valid(self, uid: int) -> bool:
+        return self._slot(uid) >= 0 or uid in self.sparse_content
+
+    def iter_uids(self) -> Iterator[int]:
+        for slot, valid in enumerate(self.valid):
+            if valid:
+                yield MIN_UNRESERVED + slot
+        yield from tuple(self.sparse_content.keys())
+
+    def set_content(self, uid: int, content: Tuple[int]) -> None:
+        self.check(uid)
+        self.version += 1
+        slot = self._slot(uid)
+        if slot < 0:
+            self.sparse_content[uid] = tuple(content)
+            return
+        content = array.array('I', content)
+        content_len = len(content)
+        old_len = self.content_len[slot]
+        if content_len <= old_len:
+            start = self.content_start[slot]
+            self.arena[start:start + content_len] = content
+            self.arena_garbage += old_len - content_len
+        else:
+            self.content_start[slot] = len(self.arena)
+            self.arena.extend(content)
+            self.arena_garbage += old_len
+        self.content_len[slot] = content_len
+        if self.arena_garbage > max(len(self.arena) >> 1, 1 << 16):
+            self.compact_arena()
+
+    def validate(self, uid: int) -> bool:
+        if self.is_valid(uid):
+            return True
+        self._check_width(uid)
+        self.version += 1
+        slot = uid - MIN_UNRESERVED
+        if 0 <= slot < len(self.valid):
+            self.valid[slot] = 1
+            self.content_len[slot] = 0
+        else:
+            self.sparse_content[uid] = ()
+        return False
+
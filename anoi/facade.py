@@ -1,54 +1,157 @@
-import functools
 import inspect
-from . import basis, wordnet as wn
+import itertools
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from . import basis, mapped, wordnet as wn
 
 
 class ANOIFacade:
+    # Maximum number of rendered UID fragments kept by render_fragments().
+    fragment_cache_size: int = 65536
+    # Part of every etag(); bump it when render_uid()'s output changes.
+    render_version: int = 1
+
     def __init__(self, space_or_cls, verbose:bool = False, *args, **kws):
         is_cls = inspect.isclass(space_or_cls)
+        # Spaces the facade creates are closed along with it.
+        self.owns_space = True
         if is_cls and issubclass(space_or_cls, basis.ANOISpace):
             self.space = space_or_cls(*args, **kws)
         elif isinstance(space_or_cls, basis.ANOISpace):
             self.space = space_or_cls
+            self.owns_space = False
+        elif isinstance(space_or_cls, str):
+            # A snapshot written by ANOIWordNetLoader.save_snapshot().
+            self.space = mapped.ANOIMappedSpace(space_or_cls)
         else:
             raise TypeError(f'{space_or_cls} is not an instance or subtype '
-                'of ANOISpace')
+                'of ANOISpace, or a snapshot path')
         self.namespace = basis.ANOINamespace(self.space, 'wordnet')
         self.name_uid = self.namespace.basis.get_name('NAME')
         self.loader = wn.ANOIWordNetLoader(self.namespace, verbose)
         if not self.loader.loaded:
             self.loader.load()
+        # Rendered fragments by UID, oldest first.
+        self.fragments: Dict[int, str] = {}
+        # Space version the fragments were rendered at, if checked.
+        self.version: Optional[int] = None
+        self.registry_key: Optional[Tuple[Any, ...]] = None
+
+    def close(self) -> None:
+        '''Drop the facade's caches and its get_facade() entry, and close
+        its space if the facade created it.'''
+        self.fragments.clear()
+        if _facades.get(self.registry_key) is self:
+            del _facades[self.registry_key]
+        if self.owns_space:
+            self.space.close()
+        else:
+            basis.evict(self.space, self.registry_key)
 
-    @functools.lru_cache(maxsize=65536)
-    def uid_to_html(self, uid):
-        valid = self.space.is_valid(uid)
-        if uid < 0x110000 and (char := chr(uid)).isprintable():
-            uid_str = f'{char}'
-        elif uid in basis.ANOIReservedSet:
-            reserved = basis.ANOIReserved(uid)
-            uid_str = reserved.name
-        elif valid and (
-            (name := self.space.cross(uid, self.name_uid)) !=
-            basis.ANOIReserved.NIL.value
-        ):
-            uid_str = basis.vec_to_str(self.space.get_content(name))
+    def invalidate(self, uids: Optional[Iterable[int]] = None) -> None:
+        '''Drop the rendered fragments of the given UIDs, or all of them.
+        Writes to the space are noticed through its version, see
+        check_version(), so this is only needed to force a re-render.'''
+        if uids is None:
+            self.fragments.clear()
         else:
-            uid_str = hex(uid)
-        return f'<a href="{hex(uid)}">{uid_str}</a>' if valid else uid_str
+            for uid in uids:
+                self.fragments.pop(uid, None)
+
+    def check_version(self) -> int:
+        '''Returns the space's version, dropping the rendered fragments if
+        the space changed since the last check.'''
+        version = self.space.get_version()
+        if version != self.version:
+            self.fragments.clear()
+            self.version = version
+        return version
+
+    def etag(self, uid: int) -> str:
+        '''Returns a strong entity tag for render_uid(uid).  Tags are
+        derived from the space version, so every write to the space changes
+        them, and checking one is a single space call.'''
+        return f'{self.render_version}-{self.check_version():x}-{uid:x}'
+
+    @staticmethod
+    def _is_printable(uid: int) -> bool:
+        return uid < 0x110000 and chr(uid).isprintable()
+
+    def render_fragments(self, uids: Iterable[int]) -> Dict[int, str]:
+        '''Returns the HTML fragments for a collection of UIDs.  Fragments
+        that are not cached are rendered together, using three batched
+        space calls: validity, names, and name contents.  Cached fragments
+        are dropped first if the space changed since they were rendered.
+        '''
+        self.check_version()
+        fragments = self.fragments
+        get_fragment = fragments.get
+        result = {uid: get_fragment(uid) for uid in uids}
+        missing = [uid for uid, fragment in result.items() if fragment is None]
+        if len(missing) == 0:
+            return result
+        space = self.space
+        NIL = basis.ANOIReserved.NIL.value
+        valids = space.is_valid_many(missing)
+        named = [uid for uid, valid in zip(missing, valids)
+            if valid and not self._is_printable(uid)
+            and uid not in basis.ANOIReservedSet]
+        names = dict(zip(named, space.cross_many(
+            (uid, self.name_uid) for uid in named)))
+        name_uids = [name for name in names.values() if name != NIL]
+        name_strs = dict(zip(name_uids, (basis.vec_to_str(content)
+            for content in space.get_content_many(name_uids))))
+        for uid, valid in zip(missing, valids):
+            if self._is_printable(uid):
+                uid_str = chr(uid)
+            elif uid in basis.ANOIReservedSet:
+                uid_str = basis.ANOIReserved(uid).name
+            elif valid and names[uid] != NIL:
+                uid_str = name_strs[names[uid]]
+            else:
+                uid_str = hex(uid)
+            fragment = (
+                f'<a href="{hex(uid)}">{uid_str}</a>' if valid else uid_str)
+            result[uid] = fragments[uid] = fragment
+        if len(fragments) > self.fragment_cache_size:
+            for uid in tuple(itertools.islice(fragments,
+                    len(fragments) - self.fragment_cache_size)):
+                del fragments[uid]
+        return result
+
+    def complete(
+        self,
+        prefix: str,
+        limit: int = 10,
+        max_distance: int = 1
+    ) -> List[Tuple[str, int]]:
+        '''Returns up to limit (name, UID) pairs from the WordNet namespace
+        that start with prefix, shortest first.  If there are none, returns
+        the names within max_distance edits of prefix instead.'''
+        result = list(self.namespace.prefix_names(prefix, limit))
+        if len(result) == 0 and max_distance > 0:
+            result = [(name, uid) for name, uid, _ in
+                self.namespace.fuzzy_names(prefix, max_distance)[:limit]]
+        return result
+
+    def uid_to_html(self, uid: int) -> str:
+        return self.render_fragments((uid,))[uid]
 
     def render_uid(self, uid: int) -> str:
-        uid_to_html = self.uid_to_html
         space = self.space
         if not space.is_valid(uid):
             raise ValueError()
-        iter_0 = ((uid_to_html(key), uid_to_html(space.cross(uid, key)))
-            for key in sorted(space.get_keys(uid)))
+        keys = sorted(space.get_keys(uid))
+        values = space.cross_many((uid, key) for key in keys)
+        content = space.get_content(uid)
+        fragments = self.render_fragments(
+            itertools.chain(keys, values, content))
+        iter_0 = ((fragments[key], fragments[value])
+            for key, value in zip(keys, values))
         nav_iter = ((key if len(key) > 1 else f'"{key}"', value)
             for key, value in iter_0)
         navbar = ''.join(
             f'<li>{key} : {value}</li>' for key, value in nav_iter)
-        contents = ''.join(
-            uid_to_html(child) for child in space.get_content(uid))
+        contents = ''.join(fragments[child] for child in content)
         title = f'UID {uid} ({hex(uid)})'
         return f'''<!DOCTYPE html>
 <html>
@@ -65,8 +168,27 @@ class ANOIFacade:
 '''
 
 
-@functools.cache
+# Facades that own their spaces, by get_facade() arguments.
+_facades: Dict[Tuple[Any, ...], ANOIFacade] = {}
+
+
 def get_facade(
     space_or_cls = basis.ANOIInMemorySpace, *args, **kws
 ) -> ANOIFacade:
-    return ANOIFacade(space_or_cls, *args, **kws)
+    '''Either construct or return the facade for the given arguments.
+    Facades over an existing space are cached in its registry (see
+    basis.get_cached()); others are kept until their close() is called.
+    '''
+    key = (get_facade, space_or_cls) + args + tuple(sorted(kws.items()))
+    if isinstance(space_or_cls, basis.ANOISpace):
+        key = (get_facade,) + key[2:]
+        def make_facade():
+            result = ANOIFacade(space_or_cls, *args, **kws)
+            result.registry_key = key
+            return result
+        return basis.get_cached(space_or_cls, key, make_facade)
+    result = _facades.get(key)
+    if result is None:
+        result = _facades[key] = ANOIFacade(space_or_cls, *args, **kws)
+        result.registry_key = key
+    return result
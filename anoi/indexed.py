@@ -0,0 +1,441 @@
+'''Reverse edge and content indexes over another ANOI space.
+'''
+
+import heapq
+import itertools
+import math
+from typing import (
+    Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple)
+
+from . import atf8
+from .basis import ANOIReserved, ANOISpace, str_to_vec
+
+
+NIL = ANOIReserved.NIL.value
+
+
+class ANOIContentIndex:
+    '''Positional inverted index over atom contents, mapping each UID to
+    the atoms whose contents contain it, and where.
+
+    Each posting list is a run of integers, one entry per atom in UID
+    order: the delta from the previous atom's UID, the number of
+    occurrences, the first position, then deltas between positions.  The
+    run is stored ATF-8 encoded, which like a varint takes one byte per
+    value below 0x80.
+
+    Updates go into a small map of uncompressed postings, which is merged
+    into the encoded lists once it grows past merge_threshold entries (as
+    ANOICompactSpace does with edges), or term by term as terms are
+    queried.  Since the encoding is self-delimiting, updates that only add
+    atoms past the end of a list are appended without decoding it.
+    '''
+    def __init__(self, merge_threshold: int = 65536) -> None:
+        self.merge_threshold = merge_threshold
+        # Encoded posting lists by term.
+        self.postings: Dict[int, bytes] = {}
+        # Last UID in each encoded posting list.
+        self.last_uids: Dict[int, int] = {}
+        # Unmerged updates, term -> uid -> positions, or None for removal.
+        self.pending: Dict[int, Dict[int, Optional[Tuple[int]]]] = {}
+        self.pending_size = 0
+        # Number of atoms with non-empty contents.
+        self.atom_count = 0
+
+    @property
+    def nbytes(self) -> int:
+        '''Size of the encoded posting lists, in bytes.'''
+        return sum(len(posting) for posting in self.postings.values())
+
+    def _update(self, term: int, uid: int,
+            positions: Optional[Tuple[int]]) -> None:
+        term_pending = self.pending.setdefault(term, {})
+        if uid not in term_pending:
+            self.pending_size += 1
+        term_pending[uid] = positions
+
+    def add(self, uid: int, content: Iterable[int]) -> None:
+        '''Index the content of an atom that is not indexed yet.'''
+        positions: Dict[int, List[int]] = {}
+        for position, term in enumerate(content):
+            positions.setdefault(term, []).append(position)
+        if len(positions) == 0:
+            return
+        self.atom_count += 1
+        for term, term_positions in positions.items():
+            self._update(term, uid, tuple(term_positions))
+        if self.pending_size >= self.merge_threshold:
+            self.merge()
+
+    def remove(self, uid: int, content: Iterable[int]) -> None:
+        '''Drop an atom from the index, given its indexed content.'''
+        terms = set(content)
+        if len(terms) == 0:
+            return
+        self.atom_count -= 1
+        for term in terms:
+            self._update(term, uid, None)
+        if self.pending_size >= self.merge_threshold:
+            self.merge()
+
+    @staticmethod
+    def _decode(posting: bytes) -> Iterator[Tuple[int, Tuple[int]]]:
+        values = atf8.decode(posting)
+        index = 0
+        uid = 0
+        while index < len(values):
+            uid += values[index]
+            count = values[index + 1]
+            positions = tuple(itertools.accumulate(
+                values[index + 2:index + 2 + count]))
+            index += 2 + count
+            yield uid, positions
+
+    @staticmethod
+    def _encode(
+        entries: Iterable[Tuple[int, Tuple[int]]],
+        prev_uid: int = 0
+    ) -> bytes:
+        values: List[int] = []
+        for uid, positions in entries:
+            values.append(uid - prev_uid)
+            values.append(len(positions))
+            prev_position = 0
+            for position in positions:
+                values.append(position - prev_position)
+                prev_position = position
+            prev_uid = uid
+        return atf8.encode(values)
+
+    def _merge_term(self, term: int) -> None:
+        updates = self.pending.pop(term, None)
+        if updates is None:
+            return
+        self.pending_size -= len(updates)
+        last_uid = self.last_uids.get(term, -1)
+        if (min(updates) > last_uid and
+                all(positions is not None for positions in updates.values())):
+            entries = sorted(updates.items())
+            self.postings[term] = self.postings.get(term, b'') + self._encode(
+                entries, max(last_uid, 0))
+            self.last_uids[term] = entries[-1][0]
+            return
+        entries = dict(self._decode(self.postings.get(term, b'')))
+        entries.update(updates)
+        entries = sorted((uid, positions)
+            for uid, positions in entries.items() if positions is not None)
+        if len(entries) > 0:
+            self.postings[term] = self._encode(entries)
+            self.last_uids[term] = entries[-1][0]
+        else:
+            self.postings.pop(term, None)
+            self.last_uids.pop(term, None)
+
+    def merge(self) -> None:
+        '''Fold all pending updates into the encoded posting lists.'''
+        for term in tuple(self.pending):
+            self._merge_term(term)
+
+    def get_postings(self, term: int) -> Iterator[Tuple[int, Tuple[int]]]:
+        '''Iterate over (uid, positions) for the atoms whose contents
+        contain term, in UID order.'''
+        self._merge_term(term)
+        return self._decode(self.postings.get(term, b''))
+
+    def search(self, terms: Iterable[int]) -> Tuple[int]:
+        '''Returns the atoms whose contents contain all of the given UIDs,
+        in UID order.'''
+        terms = set(terms)
+        if len(terms) == 0:
+            return ()
+        result: Optional[Set[int]] = None
+        # Intersect starting from the shortest posting list.
+        for term in sorted(terms, key=self._length):
+            uids = {uid for uid, _ in self.get_postings(term)
+                if result is None or uid in result}
+            result = uids
+            if len(result) == 0:
+                break
+        return tuple(sorted(result))
+
+    def _length(self, term: int) -> int:
+        self._merge_term(term)
+        return len(self.postings.get(term, b''))
+
+    def phrase(self, vec: Tuple[int]) -> Tuple[int]:
+        '''Returns the atoms whose contents contain vec as a contiguous
+        run, in UID order.'''
+        if len(vec) == 0:
+            return ()
+        candidates = set(self.search(vec))
+        starts: Dict[int, Set[int]] = {}
+        for offset, term in enumerate(vec):
+            for uid, positions in self.get_postings(term):
+                if uid not in candidates:
+                    continue
+                shifted = {position - offset for position in positions}
+                if offset == 0:
+                    starts[uid] = shifted
+                else:
+                    starts[uid] &= shifted
+                    if len(starts[uid]) == 0:
+                        candidates.discard(uid)
+        return tuple(sorted(candidates))
+
+    def rank(
+        self,
+        terms: Iterable[int],
+        limit: Optional[int] = None
+    ) -> Tuple[Tuple[int, float]]:
+        '''Returns (uid, score) for the atoms whose contents contain any of
+        the given UIDs, best first.  Scores sum each term's frequency in
+        the atom, weighted by how rare the term is (TF-IDF).'''
+        scores: Dict[int, float] = {}
+        for term in set(terms):
+            postings = tuple(self.get_postings(term))
+            if len(postings) == 0:
+                continue
+            idf = math.log(1 + self.atom_count / len(postings))
+            for uid, positions in postings:
+                scores[uid] = scores.get(uid, 0.) + len(positions) * idf
+        key = lambda item: (-item[1], item[0])
+        if limit is None:
+            return tuple(sorted(scores.items(), key=key))
+        return tuple(heapq.nsmallest(limit, scores.items(), key=key))
+
+
+class ANOIIndexedSpace(ANOISpace):
+    '''Space wrapper that maintains the inverse of the cross product: for
+    each (uid1, uid2), the set of uid0 with uid0 x uid1 = uid2.
+
+    That answers "who points at me" questions without scanning the space.
+    Since TYPE is an ordinary key, the atoms of a given type come from the
+    same index (see members()).  With index_content, the wrapper also keeps
+    an ANOIContentIndex of atom contents, so that questions like "which
+    synsets have X in their hypernym vector" take two lookups, and contents
+    can be searched for phrases.
+
+    The index is built from the wrapped space's iter_uids() when the wrapper
+    is created, and is then updated by every write through the wrapper.
+    Updates read the values being replaced first, which costs one extra
+    (batched) read per write.  As with ANOICachedSpace, writes made to the
+    wrapped space by other clients are not seen; call rebuild() after them.
+    '''
+    def __init__(
+        self,
+        space: ANOISpace,
+        index_content: bool = False,
+        batch_size: int = 4096
+    ) -> None:
+        super().__init__()
+        self.space = space
+        self.index_content = index_content
+        self.batch_size = batch_size
+        # uid2 -> uid1 -> set of uid0.
+        self.incoming: Dict[int, Dict[int, Set[int]]] = {}
+        self.content_index: Optional[ANOIContentIndex] = None
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        '''Rebuild the index from the contents of the wrapped space.'''
+        self.incoming.clear()
+        if self.index_content:
+            self.content_index = ANOIContentIndex()
+        space = self.space
+        uid_iter = space.iter_uids()
+        while True:
+            uids = tuple(itertools.islice(uid_iter, self.batch_size))
+            if len(uids) == 0:
+                break
+            pairs = [(uid0, uid1)
+                for uid0, keys in zip(uids, space.get_keys_many(uids))
+                for uid1 in keys]
+            for (uid0, uid1), uid2 in zip(pairs, space.cross_many(pairs)):
+                self._add_edge(uid0, uid1, uid2)
+            if self.index_content:
+                for uid, content in zip(uids, space.get_content_many(uids)):
+                    self._add_content(uid, content)
+
+    def _add_edge(self, uid0: int, uid1: int, uid2: int) -> None:
+        self.incoming.setdefault(uid2, {}).setdefault(uid1, set()).add(uid0)
+
+    def _remove_edge(self, uid0: int, uid1: int, uid2: int) -> None:
+        by_key = self.incoming.get(uid2)
+        if by_key is None:
+            return
+        sources = by_key.get(uid1)
+        if sources is None:
+            return
+        sources.discard(uid0)
+        if len(sources) == 0:
+            del by_key[uid1]
+            if len(by_key) == 0:
+                del self.incoming[uid2]
+
+    def _add_content(self, uid: int, content: Iterable[int]) -> None:
+        self.content_index.add(uid, content)
+
+    def _remove_content(self, uid: int, content: Iterable[int]) -> None:
+        if self.content_index is not None:
+            self.content_index.remove(uid, content)
+
+    # Queries.
+
+    def sources(self, uid1: int, uid2: int) -> Tuple[int]:
+        '''Returns every uid0 with uid0 x uid1 = uid2, in no particular
+        order.'''
+        return tuple(self.incoming.get(uid2, {}).get(uid1, ()))
+
+    def referrers(self, uid2: int) -> Tuple[Tuple[int, int]]:
+        '''Returns (uid0, uid1) for every edge uid0 x uid1 = uid2.'''
+        return tuple((uid0, uid1)
+            for uid1, sources in self.incoming.get(uid2, {}).items()
+            for uid0 in sources)
+
+    def members(
+        self,
+        type_uid: int,
+        type_key: Optional[int] = None
+    ) -> Tuple[int]:
+        '''Returns the atoms whose TYPE is type_uid.  The TYPE key defaults
+        to the one in the space's root trie, as used by ANOINamespace.'''
+        if type_key is None:
+            type_key = self._root_type()
+            if type_key == NIL:
+                return ()
+        return self.sources(type_key, type_uid)
+
+    def _root_type(self) -> int:
+        '''Look TYPE up in the root trie, without building the trie (or
+        writing anything) when the space has none.'''
+        ROOT = ANOIReserved.ROOT.value
+        if not self.space.is_valid(ROOT):
+            return NIL
+        node = ROOT
+        for key in str_to_vec('TYPE') + (ANOIReserved.REF.value,):
+            node = self.space.cross(node, key)
+            if node == NIL:
+                break
+        return node
+
+    def containers(self, uid: int) -> Tuple[int]:
+        '''Returns the atoms whose content contains uid.'''
+        if self.content_index is None:
+            raise ValueError('space was not created with index_content')
+        return self.content_index.search((uid,))
+
+    # Writes update the index once the wrapped space has accepted them.
+
+    def cross_equals(self, uid0: int, uid1: int, uid2: int) -> None:
+        old_uid2 = self.space.cross(uid0, uid1)
+        self.space.cross_equals(uid0, uid1, uid2)
+        self._remove_edge(uid0, uid1, old_uid2)
+        self._add_edge(uid0, uid1, uid2)
+
+    def free_uid(self, uid: int) -> None:
+        space = self.space
+        keys = space.get_keys(uid)
+        values = space.cross_many((uid, key) for key in keys)
+        content = space.get_content(uid) if self.index_content else ()
+        space.free_uid(uid)
+        for key, value in zip(keys, values):
+            self._remove_edge(uid, key, value)
+        self._remove_content(uid, content)
+
+    def free_uid_many(self, uids: Iterable[int]) -> None:
+        space = self.space
+        uids = tuple(uids)
+        edges_list = space.get_edges_many(uids)
+        contents = (space.get_content_many(uids) if self.index_content
+            else ((),) * len(uids))
+        space.free_uid_many(uids)
+        for uid, edges, content in zip(uids, edges_list, contents):
+            for key, value in edges.items():
+                self._remove_edge(uid, key, value)
+            self._remove_content(uid, content)
+
+    def set_content(self, uid: int, content: Tuple[int]) -> None:
+        if not self.index_content:
+            self.space.set_content(uid, content)
+            return
+        old_content = self.space.get_content(uid)
+        self.space.set_content(uid, content)
+        self._remove_content(uid, old_content)
+        self._add_content(uid, content)
+
+    def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        triples = tuple(triples)
+        pairs = [(uid0, uid1) for uid0, uid1, _ in triples]
+        current = dict(zip(pairs, self.space.cross_many(pairs)))
+        self.space.cross_equals_many(triples)
+        for uid0, uid1, uid2 in triples:
+            self._remove_edge(uid0, uid1, current[uid0, uid1])
+            self._add_edge(uid0, uid1, uid2)
+            current[uid0, uid1] = uid2
+
+    def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        if not self.index_content:
+            self.space.set_content_many(items)
+            return
+        items = tuple(items)
+        uids = [uid for uid, _ in items]
+        current = dict(zip(uids, self.space.get_content_many(uids)))
+        self.space.set_content_many(items)
+        for uid, content in items:
+            self._remove_content(uid, current[uid])
+            self._add_content(uid, content)
+            current[uid] = content
+
+    # Everything else goes straight to the wrapped space.  New and
+    # revalidated atoms have no edges or content to index.
+
+    def cross(self, uid0: int, uid1: int) -> int:
+        return self.space.cross(uid0, uid1)
+
+    def get_content(self, uid: int) -> Tuple[int]:
+        return self.space.get_content(uid)
+
+    def get_content_view(self, uid: int) -> Sequence[int]:
+        return self.space.get_content_view(uid)
+
+    def get_keys(self, uid: int) -> Tuple[int]:
+        return self.space.get_keys(uid)
+
+    def get_uid(self) -> int:
+        return self.space.get_uid()
+
+    def get_uids(self, count: int) -> Tuple[int]:
+        return self.space.get_uids(count)
+
+    def get_version(self) -> int:
+        return self.space.get_version()
+
+    def is_valid(self, uid: int) -> bool:
+        return self.space.is_valid(uid)
+
+    def iter_uids(self) -> Iterator[int]:
+        return self.space.iter_uids()
+
+    def validate(self, uid: int) -> bool:
+        return self.space.validate(uid)
+
+    def cross_many(self, pairs: Iterable[Tuple[int, int]]) -> Tuple[int]:
+        return self.space.cross_many(pairs)
+
+    def get_content_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        return self.space.get_content_many(uids)
+
+    def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        return self.space.get_keys_many(uids)
+
+    def get_edges_many(self, uids: Iterable[int]) -> Tuple[Dict[int, int]]:
+        return self.space.get_edges_many(uids)
+
+    def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        return self.space.is_valid_many(uids)
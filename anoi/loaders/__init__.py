@@ -1,10 +1,28 @@
-from typing import Optional
+import argparse
+import datetime
+import itertools
+import multiprocessing
+import os
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
 from lxml import etree
 import markdown as md
+import tqdm
 
 from . import article
+from .batch import ANOIBatchLoader
 from .. import basis
 
+
+NIL = basis.ANOIReserved.NIL.value
+# Elements whose text belongs to the enclosing block rather than being a
+# block of its own, see article.derive_article_structure().
+BLOCKS = {'p', 'ul', 'ol'}
+
+# Per-process state for parallel loads, set by _init_worker().
+_worker_stack: Optional[basis.ANOIAutomatonStack] = None
+
+
 class ANOIMarkupLoader:
     def __init__(self, namespace: basis.ANOINamespace, verbose: bool = False):
         self.namespace = namespace
@@ -19,3 +37,228 @@ class ANOIMarkupLoader:
 class ANOIMarkdownLoader(ANOIMarkupLoader):
     def load(self, source, **kws):
         return super().load(md.markdown(source), **kws)
+
+
+def article_sections(root: article.ArticleElement) -> List[str]:
+    '''Returns the text of each section of an article, in document order.
+    A section is a header followed by the blocks up to the next header, and
+    any blocks before the first header make a section of their own.'''
+    sections: List[List[str]] = [[]]
+    for branch in article.walk_article(root):
+        elem = branch.elem
+        if elem.tag in article.HEADERS:
+            sections.append([])
+        elif len(elem) > 0 and elem.tag not in BLOCKS:
+            # The text of its children is taken separately.
+            continue
+        text = ''.join(elem.itertext()).strip()
+        if len(text) > 0:
+            sections[-1].append(text)
+    return ['\n'.join(section) for section in sections if len(section) > 0]
+
+
+def parse_markdown(
+    stack: basis.ANOIAutomatonStack,
+    source: str
+) -> Tuple[str, List[Tuple[int]]]:
+    '''Returns the title of a markdown document (its first header, or else
+    its first line) and its compressed sections.'''
+    html = etree.HTML(md.markdown(source))
+    if html is None:
+        return '', []
+    root = article.derive_article_structure(html)
+    title = next((''.join(branch.elem.itertext()).strip()
+        for branch in article.walk_article(root)
+        if branch.elem.tag in article.HEADERS), None)
+    if title is None:
+        title = source.strip().split('\n', 1)[0]
+    return title, [stack.compress(basis.str_to_vec(section))
+        for section in article_sections(root)]
+
+
+def _init_worker(stack: basis.ANOIAutomatonStack) -> None:
+    global _worker_stack
+    _worker_stack = stack
+
+
+def _parse_worker(source: str) -> Tuple[str, List[Tuple[int]]]:
+    return parse_markdown(_worker_stack, source)
+
+
+def iter_markdown(path: str) -> Iterator[str]:
+    '''Yield the contents of a markdown file, or of every markdown file under
+    a directory in path order, reading one file at a time.'''
+    if os.path.isdir(path):
+        paths = sorted(
+            os.path.join(dirpath, filename)
+            for dirpath, _, filenames in os.walk(path)
+            for filename in filenames
+            if filename.endswith(('.md', '.markdown')))
+    else:
+        paths = [path]
+    for file_path in paths:
+        with open(file_path, encoding='utf-8') as file:
+            yield file.read()
+
+
+class ANOIArticleLoader(ANOIBatchLoader):
+    '''Loads markdown documents into a space as articles, following the
+    README's article creation workflow:
+
+    - An origin atom holds the source text.
+    - A title atom holds the title, and a date atom the UTC time of the
+      load, both as text.
+    - A section atom per section holds its text compressed against the
+      lexicon (a stack of tries, the namespace alone by default).
+    - The article atom holds its sections, and links to the origin, title
+      and date atoms, and to an atom holding the roots of the lexicon.
+
+    Parsing and compression run in a process pool when more than one process
+    is asked for, while UID allocation and batched writes (see
+    ANOIBatchLoader) stay in this process, as in the WordNet loader.  Wiki
+    links are not converted.
+    '''
+    article_uid: int = NIL
+    section_uid: int = NIL
+    title_uid: int = NIL
+    date_uid: int = NIL
+    origin_uid: int = NIL
+    lexicon_uid: int = NIL
+
+    def __init__(
+        self,
+        namespace: basis.ANOINamespace,
+        lexicon: Optional[basis.ANOILexicon] = None,
+        verbose: bool = False,
+        batch_size: int = 4096,
+        window_size: int = 64
+    ):
+        super().__init__(namespace, verbose, batch_size)
+        self.lexicon = (
+            lexicon if lexicon is not None else basis.ANOILexicon(
+                (namespace,)))
+        # Documents per process handed to the pool at a time.
+        self.window_size: int = window_size
+        self.articles: List[int] = []
+        # Load statistics, for report().
+        self.characters = 0
+        self.uids = 0
+        self.elapsed = 0.
+
+    def define_terms(self) -> None:
+        '''Name the properties articles use in the namespace, if they are
+        not already.'''
+        for uid_prop in self.__annotations__:
+            term = uid_prop[:-4]
+            prop_uid = self.namespace.get_name(term)
+            if prop_uid == NIL:
+                prop_uid = self.space.get_uid()
+                self.namespace.set_name(term, prop_uid)
+            setattr(self, uid_prop, prop_uid)
+
+    def parse_all(
+        self,
+        sources: Iterable[str],
+        processes: int = 1
+    ) -> Iterator[Tuple[str, str, List[Tuple[int]]]]:
+        '''Yield each source with its title and compressed sections, in
+        order.'''
+        stack = self.lexicon.compile()
+        if processes <= 1:
+            for source in sources:
+                yield (source, *parse_markdown(stack, source))
+            return
+        # Sources go to the pool a window at a time, so a stream of them is
+        # never held in memory all at once.  The next window is submitted
+        # before the results of the current one are consumed, so the pool
+        # keeps parsing while this process writes.
+        sources = iter(sources)
+        window_size = processes * self.window_size
+        chunk_size = max(1, self.window_size // 4)
+        with multiprocessing.Pool(
+                processes, _init_worker, (stack,)) as pool:
+            def submit():
+                window = list(itertools.islice(sources, window_size))
+                return window, pool.imap(_parse_worker, window, chunk_size)
+            window, results = submit()
+            while len(window) > 0:
+                next_window, next_results = submit()
+                for source, result in zip(window, results):
+                    yield (source, *result)
+                window, results = next_window, next_results
+
+    def load(self, sources: Iterable[str], processes: int = 1) -> List[int]:
+        '''Load markdown documents into the space, returning the UIDs of
+        their article atoms.'''
+        start = time.perf_counter()
+        self.define_terms()
+        edges: List[Tuple[int, int, int]] = []
+        contents: List[Tuple[int, Tuple[int]]] = []
+        lexicon_atom = self.build_vec(
+            (trie.root for trie in self.lexicon.tries), contents)
+        date_vec = basis.str_to_vec(
+            datetime.datetime.now(datetime.timezone.utc).isoformat())
+        TYPE = self.namespace.TYPE
+        results = self.parse_all(sources, processes)
+        if self.verbose:
+            results = tqdm.tqdm(results, desc='load()')
+        articles = []
+        for source, title, sections in results:
+            article_uid = self.new_uid()
+            section_uids = [self.build_vec(section, contents)
+                for section in sections]
+            contents.append((article_uid, tuple(section_uids)))
+            edges.extend((section_uid, TYPE, self.section_uid)
+                for section_uid in section_uids)
+            edges.extend((
+                (article_uid, TYPE, self.article_uid),
+                (article_uid, self.title_uid, self.build_vec(
+                    basis.str_to_vec(title), contents)),
+                (article_uid, self.date_uid, self.build_vec(
+                    date_vec, contents)),
+                (article_uid, self.origin_uid, self.build_vec(
+                    basis.str_to_vec(source), contents)),
+                (article_uid, self.lexicon_uid, lexicon_atom),
+            ))
+            articles.append(article_uid)
+            self.characters += len(source)
+            self.uids += sum(map(len, sections))
+            self.flush(edges, contents)
+        self.flush(edges, contents, True)
+        self.articles.extend(articles)
+        self.elapsed += time.perf_counter() - start
+        if self.verbose:
+            self.report()
+        return articles
+
+    def report(self) -> None:
+        documents = len(self.articles)
+        print(f'Loaded {documents} documents in {self.elapsed:.2f}s '
+            f'({documents / max(self.elapsed, 1e-9):.1f} documents/s)')
+        print(f'Total sources in code points: {self.characters}')
+        print(f'Total sections in UIDs: {self.uids}')
+        if self.uids > 0:
+            print(f'Compression ratio: 1:{self.characters / self.uids}')
+
+
+def main(
+    paths: Iterable[str],
+    verbose: bool = False,
+    processes: int = 1
+):
+    space = basis.ANOIInMemorySpace()
+    namespace = basis.ANOINamespace(space, 'articles')
+    loader = ANOIArticleLoader(namespace, verbose=verbose)
+    for path in paths:
+        loader.load(iter_markdown(path), processes)
+    return namespace
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load markdown articles into an in-memory space.')
+    parser.add_argument('paths', nargs='+',
+        help='markdown files or directories of them')
+    parser.add_argument('--processes', type=int, default=1)
+    parsed = parser.parse_args()
+    main(parsed.paths, True, parsed.processes)
@@ -0,0 +1,69 @@
+from typing import Iterable, List, Optional, Tuple
+
+from .. import basis
+
+
+class ANOIBatchLoader:
+    '''Base class for loaders that write to a namespace's space in batches.
+
+    UIDs come from a pool refilled batch_size at a time, and new contents
+    and edges are collected in lists that flush() writes out with the batch
+    space methods once there are batch_size of them.  Pooled UIDs that were
+    not used are returned to the space on the final flush.
+    '''
+    def __init__(
+        self,
+        namespace: basis.ANOINamespace,
+        verbose: bool = False,
+        batch_size: int = 4096
+    ):
+        self.space = namespace.space
+        self.namespace = namespace
+        self.verbose: bool = verbose
+        self.batch_size: int = batch_size
+        self.uid_pool: List[int] = []
+
+    def new_uid(self) -> int:
+        '''Allocate a UID from a pool that is refilled batch_size UIDs at a
+        time.'''
+        if len(self.uid_pool) == 0:
+            self.uid_pool.extend(
+                reversed(self.space.get_uids(self.batch_size)))
+        return self.uid_pool.pop()
+
+    def release_uids(self) -> None:
+        '''Return any pooled UIDs that were not used to the space.'''
+        self.space.free_uid_many(self.uid_pool)
+        self.uid_pool.clear()
+
+    def build_vec(
+        self,
+        vec_uids: Iterable[int],
+        contents: Optional[List[Tuple[int, Tuple[int]]]] = None
+    ) -> int:
+        '''Allocate an atom holding the given UID vector.  If a contents list
+        is given, the write is deferred to the next call to flush().
+        '''
+        result = self.new_uid()
+        if contents is None:
+            self.space.set_content(result, tuple(vec_uids))
+        else:
+            contents.append((result, tuple(vec_uids)))
+        return result
+
+    def flush(
+        self,
+        edges: List[Tuple[int, int, int]],
+        contents: List[Tuple[int, Tuple[int]]],
+        force: bool = False
+    ) -> None:
+        '''Write out pending contents and edges once there are enough of them
+        (or unconditionally if force is true), clearing both lists.
+        '''
+        if force or len(edges) + len(contents) >= self.batch_size:
+            self.space.set_content_many(contents)
+            self.space.cross_equals_many(edges)
+            contents.clear()
+            edges.clear()
+        if force:
+            self.release_uids()
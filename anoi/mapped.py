@@ -0,0 +1,276 @@
+'''Memory-mapped, read-only ANOI space files.
+
+File format
+-----------
+
+All integers are little-endian, and UIDs are limited to 32 bits (as in
+ANOIRedis32Space), so dump_space() raises ValueError for spaces holding
+larger ones.  The file starts with a 64 byte header:
+
+| Offset | Type     | Field                                             |
+|-------:|----------|---------------------------------------------------|
+| 0      | 8 bytes  | Magic, ``b'ANOISPC\\0'``                           |
+| 8      | uint32   | Format version (currently 1)                      |
+| 12     | uint32   | Content encoding (0: uint32 per UID, 1: ATF-8)    |
+| 16     | uint64   | Atom count, *n*                                   |
+| 24     | uint64   | Content arena size in bytes                       |
+| 32     | uint64   | Edge count, *m*                                   |
+| 40     | uint64   | Next UID to allocate (informational)              |
+| 48     | uint64   | Metadata size in bytes                            |
+| 56     | 8 bytes  | Reserved, zero                                    |
+
+The header is followed by these sections, each starting on an 8 byte
+boundary:
+
+1. Atom UIDs: *n* uint32 values, sorted.
+2. Content offsets: *n + 1* uint64 byte offsets into the arena; atom *i* owns
+   bytes ``offsets[i]:offsets[i + 1]``.
+3. Content arena.
+4. Edge keys: *m* uint64 values ``uid0 << 32 | uid1``, sorted.
+5. Edge values: *m* uint32 values, the uid2 for the matching key.
+6. Metadata: a UTF-8 encoded JSON object, parsed on first use, or nothing
+   for empty metadata.
+
+Lookups are binary searches over memoryviews of the mapping, so opening a
+file costs a constant amount of work, and processes opening the same file
+share its pages.
+'''
+
+import array
+import bisect
+import functools
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+from . import atf8
+from .basis import ANOIReserved, ANOISpace
+
+
+MAGIC = b'ANOISPC\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQQ8x')
+CONTENT_ENCODINGS = {'uint32': 0, 'atf8': 1}
+
+NIL = ANOIReserved.NIL.value
+UID_LIMIT = 1 << 32
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class ANOIMappedSpace(ANOISpace):
+    '''Read-only space served from a memory-mapped space file.  Use
+    dump_space() to write one.
+    '''
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        assert sys.byteorder == 'little'
+        self.path = path
+        with open(path, 'rb') as file_obj:
+            self.mmap = mmap.mmap(
+                file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+            # The space never changes, so its version identifies the file.
+            self.version = os.fstat(file_obj.fileno()).st_mtime_ns
+        view = memoryview(self.mmap)
+        (magic, version, encoding_id, atom_count, arena_size,
+            edge_count, self.crnt, metadata_size) = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an ANOI space file')
+        if version != VERSION:
+            raise ValueError(
+                f'{path} has unsupported format version {version}')
+        encodings = {value: key for key, value in CONTENT_ENCODINGS.items()}
+        if encoding_id not in encodings:
+            raise ValueError(
+                f'{path} has unsupported content encoding {encoding_id}')
+        self.content_encoding = encodings[encoding_id]
+        offset = HEADER.size
+        def section(size: int) -> memoryview:
+            nonlocal offset
+            start = _align(offset)
+            offset = start + size
+            if offset > len(view):
+                raise ValueError(f'{path} is truncated: {len(view)} bytes '
+                    f'where the header calls for at least {offset}')
+            return view[start:offset]
+        self.uids = section(4 * atom_count).cast('I')
+        self.offsets = section(8 * (atom_count + 1)).cast('Q')
+        self.arena = section(arena_size)
+        self.edge_keys = section(8 * edge_count).cast('Q')
+        self.edge_values = section(4 * edge_count).cast('I')
+        self.metadata_bytes = section(metadata_size)
+        if self.offsets[atom_count] != arena_size:
+            raise ValueError(f'{path} has content offsets past its arena')
+
+    @functools.cached_property
+    def metadata(self) -> Dict[str, Any]:
+        '''The metadata object stored by dump_space().'''
+        if len(self.metadata_bytes) == 0:
+            return {}
+        return json.loads(bytes(self.metadata_bytes))
+
+    def close(self) -> None:
+        for name in ('uids', 'offsets', 'arena', 'edge_keys', 'edge_values',
+                'metadata_bytes'):
+            getattr(self, name).release()
+        self.mmap.close()
+        super().close()
+
+    def __enter__(self) -> 'ANOIMappedSpace':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _index(self, uid: int) -> int:
+        '''Returns the atom index of a valid UID, or -1.'''
+        uids = self.uids
+        index = bisect.bisect_left(uids, uid)
+        if index < len(uids) and uids[index] == uid:
+            return index
+        return -1
+
+    def _read_only(self, *args, **kws):
+        raise io.UnsupportedOperation(f'{self.path} is mapped read-only')
+
+    cross_equals = free_uid = get_uid = set_content = _read_only
+
+    def cross(self, uid0: int, uid1: int) -> int:
+        self.check(uid0)
+        if not 0 <= uid1 < UID_LIMIT:
+            return NIL
+        key = (uid0 << 32) | uid1
+        keys = self.edge_keys
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            return self.edge_values[index]
+        return NIL
+
+    def get_content_bytes(self, uid: int) -> memoryview:
+        '''Returns a zero-copy view of an atom's encoded contents.'''
+        index = self._index(uid)
+        if index < 0:
+            raise ValueError(f'UID {uid} is not valid.')
+        offsets = self.offsets
+        return self.arena[offsets[index]:offsets[index + 1]]
+
+    def get_content_view(self, uid: int) -> Sequence[int]:
+        '''Returns a zero-copy view of an atom's contents as uint32 values,
+        or a decoded copy for ATF-8 encoded files.'''
+        if self.content_encoding != 'uint32':
+            return super().get_content_view(uid)
+        return self.get_content_bytes(uid).cast('I')
+
+    def get_content(self, uid: int) -> Tuple[int]:
+        if self.content_encoding == 'atf8':
+            return atf8.decode(self.get_content_bytes(uid))
+        return tuple(self.get_content_bytes(uid).cast('I'))
+
+    def get_keys(self, uid: int) -> Tuple[int]:
+        self.check(uid)
+        keys = self.edge_keys
+        lo = bisect.bisect_left(keys, uid << 32)
+        hi = bisect.bisect_left(keys, (uid + 1) << 32)
+        return tuple(key & 0xffffffff for key in keys[lo:hi])
+
+    def get_version(self) -> int:
+        return self.version
+
+    def is_valid(self, uid: int) -> bool:
+        return self._index(uid) >= 0
+
+    def iter_uids(self) -> Iterator[int]:
+        return iter(self.uids)
+
+    def validate(self, uid: int) -> bool:
+        if self.is_valid(uid):
+            return True
+        self._read_only()
+
+
+def dump_space(
+    space: ANOISpace,
+    path: str,
+    batch_size: int = 4096,
+    content_encoding: str = 'uint32',
+    metadata: Optional[Dict[str, Any]] = None
+) -> None:
+    '''Write the contents of any space that supports iter_uids() to a space
+    file at the given path, along with an optional JSON serializable
+    metadata object.'''
+    encoding_id = CONTENT_ENCODINGS[content_encoding]
+    uids = sorted(space.iter_uids())
+    if len(uids) > 0 and not 0 <= uids[0] <= uids[-1] < UID_LIMIT:
+        raise ValueError(f'UID {uids[-1]} does not fit in 32 bits, which '
+            'space files are limited to')
+    uids = array.array('I', uids)
+    offsets = array.array('Q', [0])
+    arena = array.array('I') if encoding_id == 0 else bytearray()
+    edges = []
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        for content in space.get_content_many(batch):
+            if encoding_id == 0:
+                arena.extend(content)
+            else:
+                arena += atf8.encode(content)
+            offsets.append(len(arena) * (4 if encoding_id == 0 else 1))
+        pairs = [(uid, key)
+            for uid, keys in zip(batch, space.get_keys_many(batch))
+            for key in keys]
+        values = space.cross_many(pairs)
+        # Keys and values may name UIDs that are not atoms of the space.
+        for (_, uid1), uid2 in zip(pairs, values):
+            if not (0 <= uid1 < UID_LIMIT and 0 <= uid2 < UID_LIMIT):
+                raise ValueError(f'edge {uid1} -> {uid2} does not fit in 32 '
+                    'bits, which space files are limited to')
+        edges.extend(zip(
+            ((uid0 << 32) | uid1 for uid0, uid1 in pairs), values))
+    edges.sort()
+    edge_keys = array.array('Q', (key for key, _ in edges))
+    edge_values = array.array('I', (value for _, value in edges))
+    del edges
+    crnt = getattr(space, 'crnt', max(
+        ANOIReserved.MIN_UNRESERVED.value, uids[-1] + 1 if uids else 0))
+    metadata_bytes = json.dumps(
+        metadata, separators=(',', ':')).encode() if metadata else b''
+    with open(path, 'wb') as file_obj:
+        file_obj.write(HEADER.pack(
+            MAGIC, VERSION, encoding_id, len(uids), offsets[-1],
+            len(edge_keys), crnt, len(metadata_bytes)))
+        for section in (uids, offsets, arena, edge_keys, edge_values,
+                metadata_bytes):
+            file_obj.write(b'\0' * (_align(file_obj.tell()) - file_obj.tell()))
+            file_obj.write(section)
+
+
+def copy_space(
+    source: ANOISpace,
+    space: ANOISpace,
+    batch_size: int = 4096
+) -> None:
+    '''Copy every atom of a source space that supports iter_uids(), such as
+    a mapped space, into another space, keeping the same UIDs.'''
+    uids = tuple(source.iter_uids())
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        for uid, valid in zip(batch, space.is_valid_many(batch)):
+            if not valid:
+                space.validate(uid)
+        space.set_content_many(zip(batch, source.get_content_many(batch)))
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        pairs = [(uid, key)
+            for uid, keys in zip(batch, source.get_keys_many(batch))
+            for key in keys]
+        space.cross_equals_many(
+            (uid0, uid1, uid2)
+            for (uid0, uid1), uid2 in zip(pairs, source.cross_many(pairs)))
+    if hasattr(space, 'crnt') and hasattr(source, 'crnt'):
+        space.crnt = max(space.crnt, source.crnt)
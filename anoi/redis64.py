@@ -0,0 +1,300 @@
+'''Redis-backed ANOI space with 64-bit UIDs and bucketed storage.
+'''
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import redis
+
+from . import atf8
+from .basis import ANOIReserved, ANOIRedisUIDBlocks, ANOISpace
+
+
+NIL = ANOIReserved.NIL.value
+UID_LIMIT = 1 << 64
+
+
+class ANOIRedis64Space(ANOISpace):
+    '''Space storing 64-bit UIDs in a Redis server.
+
+    Rather than one Redis hash per atom (as in ANOIRedis32Space), atoms are
+    grouped into buckets of 2 ** bucket_bits consecutive UIDs.  Each bucket
+    has one hash holding the edges of all its atoms, and one holding their
+    contents:
+
+    - ``<namespace>_e:<bucket>``, with fields ``atf8(uid0 & mask, uid1)`` and
+      values ``atf8(uid2)``.
+    - ``<namespace>_c:<bucket>``, with fields ``atf8(uid & mask)`` and ATF-8
+      encoded contents as values.
+
+    Bucket numbers are ATF-8 encoded too.  Small buckets with short fields
+    and values stay in Redis' compact listpack encoding (see the
+    hash-max-listpack-entries and hash-max-listpack-value settings), which
+    costs a few bytes per edge instead of a key and hash table per atom.
+
+    The first client to open a namespace stores its bucket_bits under
+    ``<namespace>_bucket_bits`` (5 if none is given).  Later clients use the
+    stored value, and raise ValueError if asked for a different one.
+    '''
+    def __init__(
+        self,
+        db: Optional[redis.Redis] = None,
+        namespace: Optional[str] = None,
+        bucket_bits: Optional[int] = None
+    ):
+        if db is None:
+            db = redis.Redis()
+        self.db = db
+        self.namespace = (
+            namespace.encode() if namespace is not None else b'') + b'_'
+        self.crnt_key = self.namespace + b'crnt'
+        self.free_key = self.namespace + b'free'
+        self.version_key = self.namespace + b'version'
+        self.uid_blocks = ANOIRedisUIDBlocks(
+            self.db, self.crnt_key, self.free_key,
+            version_key=self.version_key)
+        self.bucket_bits_key = self.namespace + b'bucket_bits'
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.set(self.bucket_bits_key,
+                5 if bucket_bits is None else bucket_bits, nx=True)
+            pipe.get(self.bucket_bits_key)
+            stored_bits = int(pipe.execute()[1])
+        if bucket_bits not in (None, stored_bits):
+            raise ValueError(f'namespace buckets hold 2 ** {stored_bits} '
+                f'UIDs, not 2 ** {bucket_bits}')
+        self.bucket_bits = stored_bits
+        self.bucket_mask = (1 << stored_bits) - 1
+
+    @staticmethod
+    def _check_width(uid: int) -> None:
+        if not 0 <= uid < UID_LIMIT:
+            raise ValueError(f'UID {uid} does not fit in 64 bits.')
+
+    def _edge_key(self, uid0: int) -> bytes:
+        return self.namespace + b'e:' + atf8.encode(
+            (uid0 >> self.bucket_bits,))
+
+    def _content_key(self, uid: int) -> bytes:
+        return self.namespace + b'c:' + atf8.encode(
+            (uid >> self.bucket_bits,))
+
+    def _edge_field(self, uid0: int, uid1: int) -> bytes:
+        return atf8.encode((uid0 & self.bucket_mask, uid1))
+
+    def _content_field(self, uid: int) -> bytes:
+        return atf8.encode((uid & self.bucket_mask,))
+
+    def _edge_keys(self, uid0: int, fields: Iterable[bytes]) -> Tuple[int]:
+        '''Pick out the uid1 values for uid0 from an edge bucket's fields.'''
+        prefix = self._content_field(uid0)
+        return tuple(atf8.decode(field[len(prefix):])[0]
+            for field in fields if field.startswith(prefix))
+
+    def cross(self, uid0: int, uid1: int) -> int:
+        if not 0 <= uid1 < UID_LIMIT:
+            return NIL
+        result = self.db.hget(
+            self._edge_key(uid0), self._edge_field(uid0, uid1))
+        if result is None:
+            return NIL
+        return atf8.decode(result)[0]
+
+    def cross_equals(self, uid0: int, uid1: int, uid2: int) -> None:
+        self._check_width(uid0)
+        self._check_width(uid1)
+        self._check_width(uid2)
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(self._edge_key(uid0), self._edge_field(uid0, uid1),
+                atf8.encode((uid2,)))
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+
+    def free_uid(self, uid: int) -> None:
+        self.check(uid)
+        edge_key = self._edge_key(uid)
+        prefix = self._content_field(uid)
+        fields = [field for field in self.db.hkeys(edge_key)
+            if field.startswith(prefix)]
+        with self.db.pipeline(transaction=False) as pipe:
+            if len(fields) > 0:
+                pipe.hdel(edge_key, *fields)
+            pipe.hdel(self._content_key(uid), prefix)
+            pipe.lpush(self.free_key, uid)
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+
+    def free_uid_many(self, uids: Iterable[int]) -> None:
+        uids = tuple(uids)
+        if len(uids) == 0:
+            return
+        for uid, valid in zip(uids, self.is_valid_many(uids)):
+            if not valid:
+                raise ValueError(f'UID {uid} is not valid.')
+        # One round trip reads the edge buckets, and a second deletes every
+        # freed atom's edges and content and returns the UIDs.
+        prefixes: Dict[bytes, List[bytes]] = {}
+        for uid in uids:
+            prefixes.setdefault(self._edge_key(uid), []).append(
+                self._content_field(uid))
+        with self.db.pipeline(transaction=False) as pipe:
+            for edge_key in prefixes:
+                pipe.hkeys(edge_key)
+            bucket_fields = pipe.execute()
+        with self.db.pipeline(transaction=False) as pipe:
+            for (edge_key, bucket_prefixes), fields in zip(
+                    prefixes.items(), bucket_fields):
+                bucket_prefixes = tuple(bucket_prefixes)
+                fields = [field for field in fields
+                    if field.startswith(bucket_prefixes)]
+                if len(fields) > 0:
+                    pipe.hdel(edge_key, *fields)
+            for uid in uids:
+                pipe.hdel(self._content_key(uid), self._content_field(uid))
+            self.uid_blocks.release(pipe, uids)
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+
+    def get_content(self, uid: int) -> Tuple[int]:
+        result = self.db.hget(
+            self._content_key(uid), self._content_field(uid))
+        if result is None:
+            raise ValueError(f'UID {uid} contents not found')
+        return atf8.decode(result)
+
+    def get_keys(self, uid: int) -> Tuple[int]:
+        return self._edge_keys(uid, self.db.hkeys(self._edge_key(uid)))
+
+    def get_uid(self) -> int:
+        return self.get_uids(1)[0]
+
+    def _claim_uid(self, pipe: redis.client.Pipeline, uid: int) -> None:
+        self._check_width(uid)
+        pipe.hsetnx(self._content_key(uid), self._content_field(uid), b'')
+
+    def get_uids(self, count: int) -> Tuple[int]:
+        result = self.uid_blocks.claim(count, self._claim_uid)
+        self.write_versions = self.uid_blocks.write_versions
+        return result
+
+    def get_version(self) -> int:
+        return int(self.db.get(self.version_key) or 0)
+
+    def is_valid(self, uid: int) -> bool:
+        if not 0 <= uid < UID_LIMIT:
+            return False
+        return self.db.hexists(
+            self._content_key(uid), self._content_field(uid))
+
+    def iter_uids(self) -> Iterator[int]:
+        prefix = self.namespace + b'c:'
+        for key in self.db.scan_iter(prefix + b'*'):
+            base = atf8.decode(key[len(prefix):])[0] << self.bucket_bits
+            for field in self.db.hkeys(key):
+                yield base | atf8.decode(field)[0]
+
+    def set_content(self, uid: int, content: Tuple[int]) -> None:
+        self.check(uid)
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(self._content_key(uid), self._content_field(uid),
+                atf8.encode(content))
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+
+    def validate(self, uid: int) -> bool:
+        if self.is_valid(uid):
+            return True
+        self._check_width(uid)
+        with self.db.pipeline(transaction=False) as pipe:
+            pipe.hset(
+                self._content_key(uid), self._content_field(uid), b'')
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+        return False
+
+    # Batch operations are pipelined, so each call costs one round trip.
+
+    def cross_many(self, pairs: Iterable[Tuple[int, int]]) -> Tuple[int]:
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid0, uid1 in pairs:
+                pipe.hget(self._edge_key(uid0), self._edge_field(uid0, uid1))
+            results = pipe.execute()
+        return tuple(NIL if result is None else atf8.decode(result)[0]
+            for result in results)
+
+    def cross_equals_many(
+        self,
+        triples: Iterable[Tuple[int, int, int]]
+    ) -> None:
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid0, uid1, uid2 in triples:
+                self._check_width(uid2)
+                pipe.hset(self._edge_key(uid0), self._edge_field(uid0, uid1),
+                    atf8.encode((uid2,)))
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
+
+    def get_content_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        uids = tuple(uids)
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid in uids:
+                pipe.hget(self._content_key(uid), self._content_field(uid))
+            results = pipe.execute()
+        contents = []
+        for uid, result in zip(uids, results):
+            if result is None:
+                raise ValueError(f'UID {uid} contents not found')
+            contents.append(atf8.decode(result))
+        return tuple(contents)
+
+    def get_keys_many(self, uids: Iterable[int]) -> Tuple[Tuple[int]]:
+        uids = tuple(uids)
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid in uids:
+                pipe.hkeys(self._edge_key(uid))
+            results = pipe.execute()
+        return tuple(self._edge_keys(uid, fields)
+            for uid, fields in zip(uids, results))
+
+    def get_edges_many(self, uids: Iterable[int]) -> Tuple[Dict[int, int]]:
+        uids = tuple(uids)
+        # Atoms sharing a bucket share its edge hash.
+        bucket_keys = list(dict.fromkeys(self._edge_key(uid) for uid in uids))
+        with self.db.pipeline(transaction=False) as pipe:
+            for key in bucket_keys:
+                pipe.hgetall(key)
+            buckets = dict(zip(bucket_keys, pipe.execute()))
+        result = []
+        for uid in uids:
+            prefix = self._content_field(uid)
+            result.append({atf8.decode(field[len(prefix):])[0]:
+                atf8.decode(value)[0]
+                for field, value in buckets[self._edge_key(uid)].items()
+                if field.startswith(prefix)})
+        return tuple(result)
+
+    def is_valid_many(self, uids: Iterable[int]) -> Tuple[bool]:
+        uids = tuple(uids)
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid in uids:
+                if 0 <= uid < UID_LIMIT:
+                    pipe.hexists(
+                        self._content_key(uid), self._content_field(uid))
+            results = iter(pipe.execute())
+        return tuple(bool(next(results)) if 0 <= uid < UID_LIMIT else False
+            for uid in uids)
+
+    def set_content_many(
+        self,
+        items: Iterable[Tuple[int, Tuple[int]]]
+    ) -> None:
+        items = tuple(items)
+        for uid, valid in zip(
+                (uid for uid, _ in items),
+                self.is_valid_many(uid for uid, _ in items)):
+            if not valid:
+                raise ValueError(f'UID {uid} is not valid.')
+        with self.db.pipeline(transaction=False) as pipe:
+            for uid, content in items:
+                pipe.hset(self._content_key(uid), self._content_field(uid),
+                    atf8.encode(content))
+            pipe.incr(self.version_key)
+            self._wrote(pipe.execute()[-1])
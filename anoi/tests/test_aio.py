@@ -0,0 +1,89 @@
+import asyncio
+import random
+import unittest
+
+import redis
+import redis.asyncio
+
+from .. import aio, basis
+from .test_anoi import check_redis
+
+
+class TestAsyncANOISpaces(unittest.IsolatedAsyncioTestCase):
+    async def _check_trie(self, space: aio.AsyncANOISpace, sync_space):
+        namespace = basis.ANOINamespace(sync_space, 'test')
+        for name in ('cat', 'cats', 'catalog', 'do', 'dog'):
+            namespace.set_name(name, sync_space.get_uid())
+        trie = aio.AsyncANOITrie(space, namespace.root)
+        lookups = await asyncio.gather(
+            *(trie.get_name(name) for name in ('cats', 'ca', 'dog')))
+        self.assertEqual(lookups, [namespace.get_name('cats'),
+                                   basis.ANOIReserved.NIL.value,
+                                   namespace.get_name('dog')])
+        rng = random.Random(0)
+        for _ in range(10):
+            vec = basis.str_to_vec(''.join(
+                rng.choice('cats dog') for _ in range(20)))
+            self.assertEqual(await aio.compress(trie, vec),
+                             basis.compress(namespace, vec))
+
+    async def test_adapter(self):
+        sync_space = basis.ANOIInMemorySpace()
+        space = aio.AsyncANOISpaceAdapter(sync_space)
+        await self._check_trie(space, sync_space)
+        uids = await space.get_uids(3)
+        await space.set_content_many(((uid, (uid,)) for uid in uids))
+        self.assertEqual(await space.get_content_many(uids),
+                         tuple((uid,) for uid in uids))
+        # Tries are built client side on spaces without server side tries.
+        namespace = basis.ANOINamespace(sync_space, 'test_set')
+        trie = aio.AsyncANOITrie(space, namespace.root)
+        for name, uid in zip(('cat', 'cats', 'ca'), uids):
+            self.assertEqual(await trie.set_name(name, uid), uid)
+        for name, uid in zip(('cat', 'cats', 'ca'), uids):
+            self.assertEqual(namespace.get_name(name), uid)
+            self.assertEqual(await trie.get_name(name), uid)
+        self.assertEqual(
+            basis.compress(namespace, basis.str_to_vec('cats')), (uids[1],))
+
+    @unittest.skipUnless(check_redis(), 'No Redis server found.')
+    async def test_redis_space(self):
+        sync_space = basis.ANOIRedis32Space(redis.Redis(), 'XXX_test_aio')
+        space = await aio.AsyncANOIRedis32Space.open(
+            redis.asyncio.Redis(), 'XXX_test_aio')
+        await self._check_trie(space, sync_space)
+        uids = await asyncio.gather(*(space.get_uid() for _ in range(4)))
+        uids += sync_space.get_uids(4)
+        self.assertEqual(len(set(uids)), 8)
+        self.assertTrue(all(await space.is_valid_many(uids)))
+        await space.set_content(uids[0], (1, 2))
+        self.assertEqual(sync_space.get_content(uids[0]), (1, 2))
+        trie = aio.AsyncANOITrie(space, uids[1])
+        self.assertEqual(await trie.set_name('x', uids[2]), uids[2])
+        self.assertEqual(
+            basis.ANOITrie(sync_space, uids[1]).get_name('x'), uids[2])
+        for uid in uids:
+            await space.free_uid(uid)
+        self.assertFalse(any(await space.is_valid_many(uids)))
+        await space.close()
+
+    @unittest.skipUnless(check_redis(), 'No Redis server found.')
+    async def test_redis_content_encoding(self):
+        for key in redis.Redis().scan_iter(b'XXX_test_aio_atf8_*'):
+            redis.Redis().delete(key)
+        sync_space = basis.ANOIRedis32Space(
+            redis.Redis(), 'XXX_test_aio_atf8', content_encoding='atf8')
+        uid = sync_space.get_uid()
+        sync_space.set_content(uid, (1, 0x10ffff))
+        # The constructor picks up the stored encoding on first use.
+        space = aio.AsyncANOIRedis32Space(
+            redis.asyncio.Redis(), 'XXX_test_aio_atf8')
+        self.assertEqual(await space.get_content(uid), (1, 0x10ffff))
+        self.assertEqual(space.content_encoding, 'atf8')
+        await space.close()
+        space = aio.AsyncANOIRedis32Space(
+            redis.asyncio.Redis(), 'XXX_test_aio_atf8', 'uint32')
+        with self.assertRaises(ValueError):
+            await space.get_content(uid)
+        await space.close()
+        sync_space.free_uid(uid)
@@ -1,8 +1,17 @@
+import gc
+import io
+import itertools
+import os
+import pickle
+import random
+import tempfile
 import unittest
+from unittest import mock
+import weakref
 
 import redis
 
-from .. import basis
+from .. import basis, cached, compact, facade, indexed, mapped, redis64
 
 
 redis_client = None
@@ -66,12 +75,590 @@ class TestANOISpaces(unittest.TestCase):
         self.assertRaises(ValueError, space.check, uid2)
         # TODO: Test validate().
 
+    def test_codecs(self):
+        text = 'a\u00e9\u4e2d\U0001f60f\ud800 '
+        vec = tuple(ord(ch) for ch in text)
+        self.assertEqual(basis.str_to_vec(text), vec)
+        self.assertEqual(tuple(basis.str_to_array(text)), vec)
+        self.assertEqual(tuple(basis.ord_iter(text)), vec)
+        self.assertEqual(basis.str_to_vec(''), ())
+        for in_vec in (vec, list(vec), iter(vec), basis.str_to_array(text),
+                       memoryview(basis.str_to_array(text))):
+            self.assertEqual(basis.vec_to_str(in_vec), text)
+        array = basis.str_to_array(text)
+        self.assertIs(basis.vec_to_array(array), array)
+        # The same errors as chr().
+        for bad in ((0x110000,), (-1,), iter((65, -1, 66))):
+            self.assertRaises(ValueError, basis.vec_to_str, bad)
+        self.assertRaises(OverflowError, basis.vec_to_str, (1 << 64,))
+        space = basis.ANOIRedis32Space
+        packed = space.istob(vec)
+        self.assertEqual(packed, b''.join(map(space.itob, vec)))
+        self.assertEqual(space.istob(array), packed)
+        self.assertEqual(space.btois(packed), vec)
+        self.assertEqual(tuple(space.btoa(packed)), vec)
+
+    def _check_content_view(self, space: basis.ANOISpace):
+        uid0, uid1 = space.get_uids(2)
+        test_tuple = tuple(ord(cp) for cp in 'test_tuple')
+        space.set_content(uid1, test_tuple)
+        self.assertEqual(tuple(space.get_content_view(uid1)), test_tuple)
+        self.assertEqual(
+            basis.vec_to_str(space.get_content_view(uid1)), 'test_tuple')
+        self.assertEqual(tuple(space.get_content_view(uid0)), ())
+        space.free_uid(uid0)
+        space.free_uid(uid1)
+
+    def _check_batch(self, space: basis.ANOISpace):
+        uid0, uid1, uid2 = (space.get_uid() for _ in range(3))
+        NIL = basis.ANOIReserved.NIL.value
+        empty = tuple()
+        test_tuple = tuple(ord(cp) for cp in 'test_tuple')
+        self.assertEqual(space.is_valid_many((uid0, uid1, uid2)),
+                         (True, True, True))
+        self.assertEqual(space.cross_many(((uid0, uid1), (uid1, uid2))),
+                         (NIL, NIL))
+        space.cross_equals_many(((uid0, uid1, uid2), (uid1, uid2, uid0)))
+        self.assertEqual(
+            space.cross_many(((uid0, uid1), (uid1, uid2), (uid2, uid0))),
+            (uid2, uid0, NIL))
+        self.assertEqual(space.get_keys_many((uid0, uid1, uid2)),
+                         ((uid1,), (uid2,), empty))
+        self.assertEqual(space.get_edges_many((uid0, uid1, uid2)),
+                         ({uid1: uid2}, {uid2: uid0}, {}))
+        space.set_content_many(((uid0, test_tuple), (uid2, test_tuple)))
+        self.assertEqual(space.get_content_many((uid0, uid1, uid2)),
+                         (test_tuple, empty, test_tuple))
+        self.assertEqual(space.get_content_many(()), empty)
+        space.free_uid_many((uid0, uid1, uid2))
+        self.assertEqual(space.is_valid_many((uid0, uid1, uid2)),
+                         (False, False, False))
+        self.assertEqual(space.get_edges_many((uid0, uid1)), ({}, {}))
+        self.assertRaises(ValueError, space.free_uid_many, (uid0,))
+        # Nothing of a freed atom survives its revalidation.
+        space.validate(uid1)
+        self.assertEqual(space.get_keys(uid1), empty)
+        self.assertEqual(space.get_content(uid1), empty)
+        space.free_uid(uid1)
+        self.assertRaises(ValueError, space.get_content_many, (uid0,))
+        self.assertRaises(
+            ValueError, space.set_content_many, ((uid1, test_tuple),))
+
+    def _check_get_uids(self, space: basis.ANOISpace, reuses: bool = True):
+        uids = space.get_uids(5)
+        self.assertEqual(len(set(uids)), 5)
+        self.assertTrue(all(space.is_valid_many(uids)))
+        space.free_uid_many(uids)
+        # Revalidated UIDs must not be handed out again.
+        space.validate(uids[0])
+        more_uids = space.get_uids(6)
+        self.assertEqual(len(set(more_uids)), 6)
+        self.assertNotIn(uids[0], more_uids)
+        if reuses:
+            self.assertEqual(set(uids[1:]), set(more_uids) & set(uids))
+        for uid in more_uids + uids[:1]:
+            space.free_uid(uid)
+
+    def _check_version(self, space: basis.ANOISpace):
+        versions = [space.get_version()]
+        def changed():
+            versions.append(space.get_version())
+            return versions[-1] != versions[-2]
+        uid0, uid1 = space.get_uids(2)
+        self.assertTrue(changed())
+        space.cross(uid0, uid1)
+        space.get_content_many((uid0, uid1))
+        self.assertFalse(changed())
+        space.set_content(uid0, (1, 2))
+        self.assertTrue(changed())
+        space.cross_equals(uid0, uid1, uid0)
+        self.assertTrue(changed())
+        space.set_content_many(((uid1, (3,)),))
+        self.assertTrue(changed())
+        space.cross_equals_many(((uid1, uid0, uid1),))
+        self.assertTrue(changed())
+        space.free_uid(uid1)
+        self.assertTrue(changed())
+        self.assertFalse(space.validate(uid1))
+        self.assertTrue(changed())
+        self.assertTrue(space.validate(uid1))
+        self.assertFalse(changed())
+        space.free_uid(uid0)
+        space.free_uid(uid1)
+
     def test_inmemory_space(self):
         self._check_space(basis.ANOIInMemorySpace())
+        self._check_content_view(basis.ANOIInMemorySpace())
+        self._check_batch(basis.ANOIInMemorySpace())
+        self._check_get_uids(basis.ANOIInMemorySpace())
+        self._check_version(basis.ANOIInMemorySpace())
+        # Batches that fail part way through still change the version.
+        space = basis.ANOIInMemorySpace()
+        uid = space.get_uid()
+        bad_uid = uid + 1000
+        for write in (
+                lambda: space.cross_equals_many(
+                    ((uid, uid, uid), (bad_uid, uid, uid))),
+                lambda: space.set_content_many(((uid, (1,)), (bad_uid, ())))):
+            version = space.get_version()
+            self.assertRaises(ValueError, write)
+            self.assertNotEqual(space.get_version(), version)
+
+    def test_cached_space(self):
+        self._check_space(cached.ANOICachedSpace(basis.ANOIInMemorySpace()))
+        self._check_content_view(
+            cached.ANOICachedSpace(basis.ANOIInMemorySpace()))
+        self._check_batch(cached.ANOICachedSpace(basis.ANOIInMemorySpace()))
+        self._check_get_uids(
+            cached.ANOICachedSpace(basis.ANOIInMemorySpace()))
+        self._check_version(cached.ANOICachedSpace(basis.ANOIInMemorySpace()))
+        inner = basis.ANOIInMemorySpace()
+        space = cached.ANOICachedSpace(inner, max_size=32, check_interval=1e6)
+        namespace = basis.ANOINamespace(space, 'test')
+        for name in ('cat', 'cats', 'dog'):
+            namespace.set_name(name, space.get_uid())
+        uid = namespace.get_name('cats')
+        hits = space.hits
+        self.assertEqual(namespace.get_name('cats'), uid)
+        self.assertGreater(space.hits, hits)
+        self.assertLessEqual(space.size, 32)
+        # Writes that bypass the cache are not seen until the next version
+        # check.
+        space.get_content(uid)
+        inner.set_content(uid, (1, 2))
+        self.assertEqual(space.get_content(uid), ())
+        space.clear()
+        self.assertEqual(space.get_content(uid), (1, 2))
+        self.assertEqual(space.get_content_many((uid, uid)), ((1, 2),) * 2)
+        inner.set_content(uid, (3,))
+        # A write through the cache checks first, and so clears it.
+        space.set_content(space.get_uid(), ())
+        self.assertEqual(space.get_content(uid), (3,))
+        space.check_interval = 0.
+        inner.set_content(uid, (4,))
+        self.assertEqual(space.get_content(uid), (4,))
+        # Its own writes do not clear it.
+        space.set_content(uid, (5,))
+        hits = space.hits
+        self.assertEqual(space.get_content(uid), (5,))
+        self.assertEqual(space.hits, hits + 1)
+
+    def test_indexed_space(self):
+        for index_content in (False, True):
+            def make_space():
+                return indexed.ANOIIndexedSpace(
+                    basis.ANOIInMemorySpace(), index_content)
+            self._check_space(make_space())
+            self._check_content_view(make_space())
+            self._check_batch(make_space())
+            self._check_get_uids(make_space())
+            self._check_version(make_space())
+        space = indexed.ANOIIndexedSpace(
+            basis.ANOIInMemorySpace(), index_content=True)
+        # Without a root trie there are no members, and none is built.
+        version = space.get_version()
+        self.assertEqual(space.members(basis.ANOIReserved.ROOT.value), ())
+        self.assertEqual(space.get_version(), version)
+        self.assertFalse(space.is_valid(basis.ANOIReserved.ROOT.value))
+        namespace = basis.ANOINamespace(space, 'test')
+        for name in ('synset', 'hypernym', 'lemma'):
+            namespace.set_name(name, space.get_uid())
+        synset, hypernym, lemma = (namespace.get_name(name)
+                                   for name in ('synset', 'hypernym', 'lemma'))
+        synsets = space.get_uids(4)
+        vecs = space.get_uids(2)
+        space.set_content_many(
+            ((vecs[0], synsets[:2]), (vecs[1], synsets[1:2])))
+        space.cross_equals_many(
+            [(uid, namespace.TYPE, synset) for uid in synsets] +
+            [(synsets[2], hypernym, vecs[0]), (synsets[3], hypernym, vecs[1])])
+        self.assertEqual(set(space.members(synset)), set(synsets))
+        self.assertEqual(set(space.members(lemma)), set())
+        self.assertEqual(set(space.containers(synsets[1])), set(vecs))
+        self.assertEqual(space.sources(hypernym, vecs[1]), (synsets[3],))
+        self.assertIn((synsets[2], hypernym), space.referrers(vecs[0]))
+        # Overwrites and frees keep the index consistent with the space.
+        space.cross_equals(synsets[0], namespace.TYPE, lemma)
+        space.set_content(vecs[0], synsets[2:3])
+        space.free_uid(synsets[3])
+        self.assertEqual(space.members(lemma), (synsets[0],))
+        self.assertEqual(set(space.containers(synsets[1])), {vecs[1]})
+        self.assertEqual(space.sources(hypernym, vecs[1]), ())
+        rebuilt = indexed.ANOIIndexedSpace(space.space, index_content=True)
+        self.assertEqual(rebuilt.incoming, space.incoming)
+        self._check_same_content_index(rebuilt, space)
+        rng = random.Random(0)
+        uids = list(space.get_uids(20))
+        for _ in range(200):
+            uid0, uid1, uid2 = (rng.choice(uids) for _ in range(3))
+            operation = rng.randrange(3)
+            if operation == 0:
+                space.cross_equals_many(((uid0, uid1, uid2),
+                                         (uid0, uid1, uid0)))
+            elif operation == 1:
+                space.set_content(uid0, (uid1, uid2, uid1))
+            else:
+                space.free_uid(uid0)
+                uids[uids.index(uid0)] = space.get_uid()
+        rebuilt.rebuild()
+        self.assertEqual(rebuilt.incoming, space.incoming)
+        self._check_same_content_index(rebuilt, space)
+
+    def _check_same_content_index(self, space0, space1):
+        for space in (space0, space1):
+            space.content_index.merge()
+        self.assertEqual(space0.content_index.postings,
+                         space1.content_index.postings)
+        self.assertEqual(space0.content_index.atom_count,
+                         space1.content_index.atom_count)
+
+    def test_content_index(self):
+        index = indexed.ANOIContentIndex(merge_threshold=4)
+        a, b, c, d = 0x61, 0x62, 0x63, 0x110000 + 1000
+        index.add(1, (a, b, c, a, b))
+        index.add(5, (b, c, d))
+        index.add(0x110000, (c, a, b, d, d, d))
+        self.assertGreater(len(index.postings), 0)
+        self.assertEqual(tuple(index.get_postings(a)),
+                         ((1, (0, 3)), (0x110000, (1,))))
+        self.assertEqual(index.search((a, b)), (1, 0x110000))
+        self.assertEqual(index.search((b, c, d)), (5, 0x110000))
+        self.assertEqual(index.search((a, 0x64)), ())
+        self.assertEqual(index.phrase((a, b)), (1, 0x110000))
+        self.assertEqual(index.phrase((b, c)), (1, 5))
+        self.assertEqual(index.phrase((a, b, c)), (1,))
+        self.assertEqual(index.phrase((d, d)), (0x110000,))
+        self.assertEqual(index.phrase((c, b)), ())
+        ranked = index.rank((a, d))
+        self.assertEqual([uid for uid, _ in ranked], [0x110000, 1, 5])
+        self.assertEqual(index.rank((a, d), limit=1), ranked[:1])
+        index.remove(1, (a, b, c, a, b))
+        index.add(1, (d,))
+        self.assertEqual(index.search((a,)), (0x110000,))
+        self.assertEqual(index.search((d,)), (1, 5, 0x110000))
+        index.merge()
+        self.assertEqual(index.pending, {})
+        self.assertEqual(index.atom_count, 3)
+
+    def test_compact_space(self):
+        self._check_space(compact.ANOICompactSpace())
+        self._check_content_view(compact.ANOICompactSpace())
+        self._check_batch(compact.ANOICompactSpace())
+        self._check_get_uids(compact.ANOICompactSpace())
+        self._check_version(compact.ANOICompactSpace())
+        space = compact.ANOICompactSpace(merge_threshold=4)
+        reference = basis.ANOIInMemorySpace()
+        for test_space in (space, reference):
+            namespace = basis.ANOINamespace(test_space, 'test')
+            for name in ('cat', 'cats', 'catalog', 'do', 'dog'):
+                namespace.set_name(name, test_space.get_uid())
+                test_space.set_content(
+                    namespace.get_name(name), basis.str_to_vec(name * 2))
+        self.assertGreater(len(space.edge_keys), 0)
+        self.assertEqual(
+            sorted(basis.ANOINamespace(space, 'test').entries()),
+            sorted(basis.ANOINamespace(reference, 'test').entries()))
+        uid = basis.ANOINamespace(space, 'test').get_name('dog')
+        space.set_content(uid, (1, 2))
+        space.compact()
+        self.assertEqual(space.get_content(uid), (1, 2))
+        self.assertEqual(space.arena_garbage, 0)
+        self.assertRaises(ValueError, space.cross_equals, uid, 1 << 32, uid)
+        # Freeing queues the atom's edges for the next merge, and a UID that
+        # is reused before then does not see them.
+        space.merge_edges()
+        self.assertEqual(len(space.edge_delta), 0)
+        uid1, uid2 = space.get_uids(2)
+        space.cross_equals(uid1, uid2, uid2)
+        space.cross_equals(uid1, uid1, uid2)
+        space.merge_edges()
+        edge_count = len(space.edge_keys)
+        space.free_uid(uid1)
+        self.assertEqual(len(space.edge_keys), edge_count)
+        self.assertEqual(space.get_uid(), uid1)
+        self.assertEqual(space.get_keys(uid1), ())
+        self.assertEqual(space.cross(uid1, uid2), compact.NIL)
+        space.cross_equals(uid1, uid1, uid1)
+        self.assertEqual(space.get_keys(uid1), (uid1,))
+        space.merge_edges()
+        self.assertEqual(len(space.edge_keys), edge_count - 1)
+        self.assertEqual(space.cross(uid1, uid1), uid1)
+        self.assertEqual(space.cross(uid1, uid2), compact.NIL)
+        # UIDs validated ahead of the dense range take over their slots, so
+        # freeing them makes the slots reusable.
+        space = compact.ANOICompactSpace()
+        uid = space.get_uid()
+        self.assertFalse(space.validate(uid + 1))
+        space.set_content(uid + 1, (1, 2))
+        self.assertEqual(space.get_uids(2), (uid + 2, uid + 3))
+        self.assertEqual(space.get_content(uid + 1), (1, 2))
+        space.free_uid(uid + 1)
+        self.assertEqual(space.get_uid(), uid + 1)
+
+    def test_mapped_space(self):
+        source = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace(source, 'test')
+        for name in ('cat', 'cats', 'dog'):
+            namespace.set_name(name, source.get_uid())
+        for encoding in ('uint32', 'atf8'):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'space.anoi')
+                mapped.dump_space(source, path, 7, encoding)
+                with mapped.ANOIMappedSpace(path) as space:
+                    self.assertEqual(space.content_encoding, encoding)
+                    self.assertEqual(space.get_version(),
+                                     os.stat(path).st_mtime_ns)
+                    self._check_mapped_space(space, source, namespace)
+
+    def test_mapped_space_limits(self):
+        source = basis.ANOIInMemorySpace()
+        uid = source.get_uid()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'space.anoi')
+            source.cross_equals(uid, uid, 1 << 40)
+            self.assertRaises(ValueError, mapped.dump_space, source, path)
+            source.cross_equals(uid, uid, uid)
+            source.validate(1 << 40)
+            self.assertRaises(ValueError, mapped.dump_space, source, path)
+            source.free_uid(1 << 40)
+            source.set_content(uid, (1, 2, 3))
+            mapped.dump_space(source, path)
+            with open(path, 'rb') as file_obj:
+                data = file_obj.read()
+            with open(path, 'wb') as file_obj:
+                file_obj.write(data[:-8])
+            self.assertRaisesRegex(
+                ValueError, 'truncated', mapped.ANOIMappedSpace, path)
+
+    def test_snapshot(self):
+        source = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace(source, 'wordnet')
+        for name in ('lemma', 'synset', 'definition', 'antonym', 'hypernym',
+                     'hyponym'):
+            namespace.set_name(name, source.get_uid())
+        metadata = {'wordnet_snapshot': 1, 'term_map': {'lemma': 1}}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'wordnet.anoi')
+            mapped.dump_space(source, path, metadata=metadata)
+            with mapped.ANOIMappedSpace(path) as space:
+                self.assertEqual(space.metadata, metadata)
+                copy = basis.ANOIInMemorySpace()
+                mapped.copy_space(space, copy, 5)
+                self._check_mapped_space(space, copy, namespace)
+                # Atoms already in the copy are overwritten, not validated.
+                mapped.copy_space(space, copy, 5)
+                self._check_mapped_space(space, copy, namespace)
+                self.assertNotIn(copy.get_uid(), set(space.iter_uids()))
+            # A snapshot is browsable without loading WordNet.
+            snapshot_facade = facade.ANOIFacade(path)
+            self.assertTrue(snapshot_facade.loader.loaded)
+            uid = namespace.get_name('synset')
+            self.assertIn(hex(uid), snapshot_facade.render_uid(uid))
+            snapshot_facade.close()
+
+    def _check_mapped_space(self, space, source, namespace):
+        self.assertEqual(sorted(space.iter_uids()),
+                         sorted(source.iter_uids()))
+        for uid in source.iter_uids():
+            self.assertEqual(space.get_content(uid),
+                             source.get_content(uid))
+            self.assertEqual(sorted(space.get_keys(uid)),
+                             sorted(source.get_keys(uid)))
+            for key in source.get_keys(uid):
+                self.assertEqual(space.cross(uid, key),
+                                 source.cross(uid, key))
+        self.assertEqual(
+            basis.ANOINamespace(space, namespace.name).get_name('cats'),
+            namespace.get_name('cats'))
+        self.assertRaises(io.UnsupportedOperation, space.get_uid)
+        self.assertRaises(ValueError, space.check, 0x10ffff)
 
     @unittest.skipUnless(check_redis(), 'No Redis server found.')
     def test_redis_space(self):
         self._check_space(basis.ANOIRedis32Space(redis_client, 'XXX_test'))
+        self._check_content_view(
+            basis.ANOIRedis32Space(redis_client, 'XXX_test'))
+        self._check_batch(basis.ANOIRedis32Space(redis_client, 'XXX_test'))
+        for key in redis_client.scan_iter(b'XXX_test_atf8_*'):
+            redis_client.delete(key)
+        space = basis.ANOIRedis32Space(redis_client, 'XXX_test_atf8', 'atf8')
+        self._check_space(space)
+        self._check_content_view(space)
+        self._check_batch(space)
+        self.assertEqual(basis.ANOIRedis32Space(
+            redis_client, 'XXX_test_atf8').content_encoding, 'atf8')
+        self.assertRaises(ValueError, basis.ANOIRedis32Space,
+                          redis_client, 'XXX_test_atf8', 'uint32')
+        self._check_get_uids(space, reuses=False)
+        self._check_version(space)
+        version = space.get_version()
+        space.trie_set_vector(basis.ANOIReserved.ROOT.value, (0x61,),
+                              basis.ANOIReserved.ROOT.value)
+        self.assertNotEqual(space.get_version(), version)
+        # Clients sharing a namespace lease disjoint blocks of UIDs.
+        spaces = [basis.ANOIRedis32Space(redis_client, 'XXX_test_atf8')
+                  for _ in range(2)]
+        for test_space in spaces:
+            test_space.uid_blocks.block_size = 3
+        allocated = []
+        for _ in range(4):
+            for test_space in spaces:
+                allocated.extend(test_space.get_uids(2))
+        self.assertEqual(len(set(allocated)), len(allocated))
+        for uid in allocated:
+            space.free_uid(uid)
+
+    @unittest.skipUnless(check_redis(), 'No Redis server found.')
+    def test_cached_redis_space(self):
+        inner = basis.ANOIRedis32Space(redis_client, 'XXX_test')
+        spaces = [cached.ANOICachedSpace(inner, check_interval=0.)
+            for _ in range(2)]
+        uid = spaces[0].get_uid()
+        self.assertEqual(spaces[1].get_content(uid), ())
+        spaces[0].set_content(uid, (1, 2))
+        self.assertEqual(spaces[1].get_content(uid), (1, 2))
+        spaces[1].free_uid(uid)
+        self.assertFalse(spaces[0].is_valid(uid))
+        # Writes learn the version from their own pipelines, and still see
+        # writes by other clients.
+        space = cached.ANOICachedSpace(inner, check_interval=1e6)
+        other = basis.ANOIRedis32Space(redis_client, 'XXX_test')
+        uid = space.get_uid()
+        with mock.patch.object(
+                inner, 'get_version', wraps=inner.get_version) as get_version:
+            space.set_content(uid, (1,))
+            space.cross_equals_many(((uid, uid, uid),))
+            self.assertEqual(space.get_content(uid), (1,))
+            other.set_content(uid, (2,))
+            self.assertEqual(space.get_content(uid), (1,))
+            space.cross_equals(uid, 1, uid)
+            self.assertEqual(space.get_content(uid), (2,))
+            self.assertFalse(space.validate(uid + (1 << 20)))
+            space.free_uid_many((uid, uid + (1 << 20)))
+        self.assertEqual(get_version.call_count, 0)
+
+    @unittest.skipUnless(check_redis(), 'No Redis server found.')
+    def test_redis64_space(self):
+        for key in redis_client.scan_iter(b'XXX_test64_*'):
+            redis_client.delete(key)
+        space = redis64.ANOIRedis64Space(redis_client, 'XXX_test64')
+        self._check_space(space)
+        self._check_content_view(space)
+        self._check_batch(space)
+        self._check_get_uids(space, reuses=False)
+        self._check_version(space)
+        big_uid = (1 << 63) + 5
+        self.assertFalse(space.validate(big_uid))
+        space.set_content(big_uid, (big_uid, 1))
+        space.cross_equals(big_uid, 0x61, big_uid - 1)
+        self.assertEqual(space.get_content(big_uid), (big_uid, 1))
+        self.assertEqual(space.cross(big_uid, 0x61), big_uid - 1)
+        self.assertEqual(space.get_keys(big_uid), (0x61,))
+        self.assertIn(big_uid, set(space.iter_uids()))
+        self.assertRaises(ValueError, space.validate, 1 << 64)
+        namespace = basis.ANOINamespace(space, 'test')
+        self.assertEqual(namespace.set_name('cat', big_uid), big_uid)
+        self.assertEqual(namespace.get_name('cat'), big_uid)
+        # Reopening the namespace keeps its bucket size.
+        space = redis64.ANOIRedis64Space(redis_client, 'XXX_test64')
+        self.assertEqual(space.bucket_bits, 5)
+        self.assertEqual(space.get_content(big_uid), (big_uid, 1))
+        self.assertRaises(ValueError, redis64.ANOIRedis64Space,
+                          redis_client, 'XXX_test64', 6)
+        space = redis64.ANOIRedis64Space(redis_client, 'XXX_test64', 5)
+        self.assertEqual(space.cross(big_uid, 0x61), big_uid - 1)
+
+
+class TestANOIFacade(unittest.TestCase):
+    def test_render_uid(self):
+        space = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace(space, 'wordnet')
+        for name in ('lemma', 'synset', 'definition', 'antonym', 'hypernym',
+                     'hyponym'):
+            namespace.set_name(name, space.get_uid())
+        page_facade = facade.ANOIFacade(space)
+        synset = namespace.get_name('synset')
+        definition = space.get_uid()
+        space.set_content(definition, basis.str_to_vec('a ') + (synset,))
+        space.cross_equals(synset, namespace.get_name('definition'),
+                           definition)
+        html = page_facade.render_uid(synset)
+        self.assertIn(f'<li><a href="{hex(namespace.NAME)}">NAME</a> : ', html)
+        self.assertIn(f'<a href="{hex(definition)}">{hex(definition)}</a>',
+                      html)
+        self.assertIn(f'<p>a <a href="{hex(synset)}">synset</a></p>',
+                      page_facade.render_uid(definition))
+        self.assertEqual(page_facade.uid_to_html(definition),
+                         f'<a href="{hex(definition)}">{hex(definition)}</a>')
+        # Writes to the space drop the cached fragments.
+        namespace.name_atom(definition, 'gloss')
+        self.assertEqual(page_facade.uid_to_html(definition),
+                         f'<a href="{hex(definition)}">gloss</a>')
+        self.assertIn(f'<a href="{hex(definition)}">gloss</a>',
+                      page_facade.render_uid(synset))
+        self.assertEqual(page_facade.uid_to_html(0x110000 + 0xffffff),
+                         hex(0x110000 + 0xffffff))
+
+    def test_etag(self):
+        space = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace(space, 'wordnet')
+        for name in ('lemma', 'synset', 'definition', 'antonym', 'hypernym',
+                     'hyponym'):
+            namespace.set_name(name, space.get_uid())
+        page_facade = facade.ANOIFacade(space)
+        synset = namespace.get_name('synset')
+        etag = page_facade.etag(synset)
+        self.assertEqual(page_facade.etag(synset), etag)
+        self.assertNotEqual(page_facade.etag(synset + 1), etag)
+        definition = space.get_uid()
+        space.set_content(definition, (synset,))
+        etag = page_facade.etag(definition)
+        self.assertIn('>synset<', page_facade.render_uid(definition))
+        # Writes change the tag, and drop stale fragments.
+        space.set_content(space.cross(synset, namespace.NAME),
+                          basis.str_to_vec('concept'))
+        self.assertNotEqual(page_facade.etag(definition), etag)
+        self.assertIn('>concept<', page_facade.render_uid(definition))
+
+
+class TestANOIRegistry(unittest.TestCase):
+    def test_spaces_are_freed(self):
+        space = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace.get(space, 'test')
+        namespace.set_name('cat', space.get_uid())
+        self.assertIs(basis.ANOINamespace.get(space, 'test'), namespace)
+        self.assertIs(basis.ANOITrieProxy.root(space).__trie__,
+                      basis.root_trie(space))
+        basis.compile_trie(namespace)
+        space_ref = weakref.ref(space)
+        del space, namespace
+        gc.collect()
+        self.assertIsNone(space_ref())
+
+    def test_pickle(self):
+        space = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace.get(space, 'test')
+        namespace.set_name('cat', space.get_uid())
+        basis.compile_trie(namespace)
+        copy = pickle.loads(pickle.dumps(space))
+        self.assertNotIn('_registry', copy.__dict__)
+        self.assertIn('_registry', space.__dict__)
+        namespace = basis.ANOINamespace.get(copy, 'test')
+        self.assertEqual(basis.compress(namespace, basis.str_to_vec('cat')),
+                         (namespace.get_name('cat'),))
+        self.assertIn(copy, basis._registered_spaces)
+
+    def test_evict(self):
+        space = basis.ANOIInMemorySpace()
+        trie = basis.root_trie(space)
+        automaton = basis.compile_trie(trie)
+        basis.evict(space, (basis.compile_trie, trie.root))
+        self.assertIs(basis.root_trie(space), trie)
+        self.assertIsNot(basis.compile_trie(trie), automaton)
+        space.close()
+        self.assertIsNot(basis.root_trie(space), trie)
+        basis.evict_all()
+        self.assertEqual(basis.space_registry(space), {})
 
 
 class TestANOITrie(unittest.TestCase):
@@ -123,6 +710,299 @@ class TestANOITrie(unittest.TestCase):
             self.assertEqual(trie.get_name(name), uid)
         self.assertEqual(basis.compress(trie, vec3), (uid3, ))
 
+    def test_compiled_trie(self):
+        space = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace(space, 'test')
+        rng = random.Random(42)
+        words = set(
+            ''.join(rng.choice('abc') for _ in range(rng.randint(1, 6)))
+            for _ in range(60))
+        for word in sorted(words):
+            namespace.set_name(word, space.get_uid())
+        automaton = basis.compile_trie(namespace)
+        self.assertIs(basis.compile_trie(namespace), automaton)
+        self.assertEqual(
+            sorted(basis.vec_to_str(vec) for vec, _ in namespace.entries()),
+            sorted(words))
+        def brute_force(text):
+            # The longest entry at each position, by trie lookups.
+            result = []
+            i = 0
+            while i < len(text):
+                ref, end = next(
+                    ((ref, end) for end in range(len(text), i, -1)
+                     if (ref := namespace.get_vector(text[i:end])) !=
+                     basis.ANOIReserved.NIL.value), (text[i], i + 1))
+                result.append(ref)
+                i = end
+            return tuple(result)
+        for _ in range(50):
+            text = basis.str_to_vec(''.join(
+                rng.choice('abcd') for _ in range(rng.randint(0, 40))))
+            self.assertEqual(automaton.compress(text), brute_force(text))
+            self.assertEqual(basis.compress(namespace, text),
+                             brute_force(text))
+        namespace.set_name('dddd', space.get_uid())
+        self.assertIsNot(basis.compile_trie(namespace), automaton)
+        text = basis.str_to_vec('abddddcab')
+        self.assertEqual(basis.compress(namespace, text), brute_force(text))
+        # So are writes that do not go through this trie's set_vector():
+        # through a wrapper space, and straight to a trie node's edges.
+        wrapped = cached.ANOICachedSpace(space)
+        basis.ANOITrie(wrapped, namespace.root).set_name('cd', space.get_uid())
+        text = basis.str_to_vec('abcdab')
+        self.assertEqual(basis.compress(namespace, text), brute_force(text))
+        node = namespace.root
+        for key in basis.str_to_vec('dddd'):
+            node = space.cross(node, key)
+        uid = space.get_uid()
+        space.cross_equals(node, basis.ANOIReserved.REF.value, uid)
+        text = basis.str_to_vec('dddd')
+        self.assertEqual(basis.compress(namespace, text), (uid,))
+        self.assertEqual(basis.compress(namespace, text), brute_force(text))
+
+    def _check_decompress(self, space: basis.ANOISpace):
+        namespace = basis.ANOINamespace(space, 'test_decompress')
+        rng = random.Random(7)
+        words = sorted(set(
+            ''.join(rng.choice('abc') for _ in range(rng.randint(1, 6)))
+            for _ in range(40)))
+        for word in words:
+            namespace.set_name(word, space.get_uid())
+        decompressor = basis.get_decompressor((namespace,))
+        self.assertIs(basis.get_decompressor((namespace,)), decompressor)
+        automaton = basis.compile_trie(namespace)
+        for _ in range(30):
+            text = basis.str_to_vec(''.join(
+                rng.choice('abcd ') for _ in range(rng.randint(0, 60))))
+            compressed = basis.compress(namespace, text)
+            self.assertEqual(automaton.compress(text), compressed)
+            self.assertEqual(basis.decompress(namespace, compressed), text)
+            self.assertEqual(tuple(decompressor.decompress_iter(
+                iter(compressed), chunk_size=3)), text)
+        for word in words:
+            self.assertEqual(
+                decompressor.expand(namespace.get_name(word)),
+                basis.str_to_vec(word))
+        self.assertEqual(decompressor.expand(ord('d')), (ord('d'),))
+        # Renaming an entry drops cached expansions.
+        uid = namespace.get_name(words[0])
+        namespace.set_name('dd', uid)
+        self.assertEqual(basis.decompress(namespace, (uid,)),
+                         basis.str_to_vec('dd'))
+        # A small cache gives the same results.
+        small = basis.ANOIDecompressor((namespace,), cache_size=2)
+        for word in words[1:]:
+            self.assertEqual(small.expand(namespace.get_name(word)),
+                             basis.str_to_vec(word))
+        self.assertLessEqual(len(small.expansions), 2)
+
+    def test_decompress(self):
+        self._check_decompress(basis.ANOIInMemorySpace())
+        self._check_decompress(compact.ANOICompactSpace())
+
+    @unittest.skipUnless(check_redis(), 'No Redis server found.')
+    def test_redis_decompress(self):
+        for key in redis_client.scan_iter(b'XXX_test_decompress_*'):
+            redis_client.delete(key)
+        self._check_decompress(
+            basis.ANOIRedis32Space(redis_client, 'XXX_test_decompress'))
+
+    def _check_lexicon(self, space: basis.ANOISpace):
+        rng = random.Random(11)
+        tries = tuple(basis.ANOINamespace(space, f'test_lexicon_{index}')
+                      for index in range(3))
+        for trie in tries:
+            for _ in range(15):
+                trie.set_name(''.join(rng.choice('abc') for _ in range(
+                    rng.randint(1, 5))), space.get_uid())
+        shared = space.get_uid()
+        tries[1].set_name('abcab', space.get_uid())
+        tries[2].set_name('abcab', shared)
+        tries[2].set_name('abcabc', space.get_uid())
+        lexicon = basis.ANOILexicon(tries)
+        # Longest across all tries, the top of the stack breaking ties.
+        self.assertEqual(lexicon.compress(basis.str_to_vec('abcabc')),
+                         (tries[2].get_name('abcabc'),))
+        self.assertEqual(lexicon.compress(basis.str_to_vec('abcab')),
+                         (tries[1].get_name('abcab'),))
+        automata = [basis.compile_trie(trie) for trie in tries]
+        for _ in range(30):
+            text = basis.str_to_vec(''.join(
+                rng.choice('abcd ') for _ in range(rng.randint(0, 60))))
+            # Brute force: the first of the longest matches at each
+            # position.
+            matches = [automaton.longest_matches(text)
+                       for automaton in automata]
+            lens = []
+            refs = []
+            for index in range(len(text)):
+                length, _, ref = max(
+                    (trie_lens[index], -rank, trie_refs[index])
+                    for rank, (trie_lens, trie_refs) in enumerate(matches))
+                lens.append(length)
+                refs.append(ref)
+            self.assertEqual(lexicon.longest_matches(text), (lens, refs))
+            compressed = lexicon.compress(text)
+            self.assertEqual(lexicon.decompress(compressed), text)
+        single = basis.ANOILexicon(tries[:1])
+        self.assertEqual(single.compress(basis.str_to_vec('abc cab')),
+                         basis.compress(tries[0], basis.str_to_vec('abc cab')))
+        self.assertRaises(ValueError, basis.ANOILexicon, ())
+
+    def test_lexicon(self):
+        self._check_lexicon(basis.ANOIInMemorySpace())
+        self._check_lexicon(compact.ANOICompactSpace())
+
+    def test_compress_stream(self):
+        space = basis.ANOIInMemorySpace()
+        rng = random.Random(5)
+        tries = (basis.ANOINamespace(space, 'test_stream_0'),
+                 basis.ANOINamespace(space, 'test_stream_1'))
+        for trie in tries:
+            for _ in range(20):
+                trie.set_name(''.join(rng.choice('abé') for _ in range(
+                    rng.randint(1, 7))), space.get_uid())
+        lexicon = basis.ANOILexicon(tries)
+        def split(seq):
+            chunks = []
+            while len(seq) > 0:
+                size = rng.randint(1, 12)
+                chunks.append(seq[:size])
+                seq = seq[size:]
+            return chunks
+        for _ in range(30):
+            text = ''.join(rng.choice('abé ') for _ in range(
+                rng.randint(0, 80)))
+            vec = basis.str_to_vec(text)
+            expected = basis.compress(tries[0], vec)
+            # Splits 'é' across byte chunks some of the time.
+            for chunks in (split(text), split(text.encode()), split(vec)):
+                self.assertEqual(tuple(basis.compress_stream(
+                    tries[0], chunks)), expected)
+                self.assertEqual(tuple(lexicon.compress_stream(chunks)),
+                                 lexicon.compress(vec))
+        # Output is produced as the input arrives.
+        stream = basis.compress_stream(tries[0], itertools.repeat('ab é'))
+        self.assertEqual(len(tuple(itertools.islice(stream, 100))), 100)
+        empty = basis.ANOINamespace(space, 'test_stream_empty')
+        self.assertEqual(tuple(basis.compress_stream(empty, ('ab', b'c'))),
+                         basis.str_to_vec('abc'))
+
+    def _check_trie_search(self, space: basis.ANOISpace):
+        namespace = basis.ANOINamespace(space, 'test_search')
+        words = ('an', 'animal', 'animals', 'anime', 'ant', 'bee', 'anim')
+        uids = {word: space.get_uid() for word in words}
+        for word, uid in uids.items():
+            namespace.set_name(word, uid)
+        self.assertEqual(
+            sorted(namespace.prefix_names('anim')),
+            sorted((word, uids[word]) for word in
+                   ('animal', 'animals', 'anime', 'anim')))
+        # Shortest first, and cut off at the limit.
+        self.assertEqual(list(namespace.prefix_names('an', 2)),
+                         [('an', uids['an']), ('ant', uids['ant'])])
+        self.assertEqual(list(namespace.prefix_names('cat')), [])
+        self.assertEqual(sorted(word for word, _ in namespace.prefix_names(
+            '')), sorted(words))
+        frequencies = {uids['animals']: 5, uids['anime']: 3, uids['an']: 1}
+        self.assertEqual(
+            namespace.most_frequent(basis.str_to_vec('an'), 2,
+                                    lambda uid: frequencies.get(uid, 0)),
+            [(basis.str_to_vec('animals'), uids['animals']),
+             (basis.str_to_vec('anime'), uids['anime'])])
+        # Precomputed bounds give the same answers as a full scan, and skip
+        # subtries that cannot make the cut.
+        frequency = lambda uid: frequencies.get(uid, 0)
+        bounds = namespace.frequency_bounds(frequency)
+        for prefix in ('', 'a', 'an', 'anim', 'b', 'x'):
+            entries = list(namespace.prefix_entries(basis.str_to_vec(prefix)))
+            for count in (1, 2, 3, 10):
+                expected = sorted(entries, key=lambda entry: (
+                    -frequency(entry[1]), len(entry[0]), entry[0]))[:count]
+                actual = namespace.most_frequent(
+                    basis.str_to_vec(prefix), count, frequency, bounds)
+                self.assertEqual(
+                    [(frequency(uid), len(vec)) for vec, uid in actual],
+                    [(frequency(uid), len(vec)) for vec, uid in expected])
+        fetched = []
+        get_edges_many = space.get_edges_many
+        def counting_get_edges_many(uids):
+            uids = tuple(uids)
+            fetched.extend(uids)
+            return get_edges_many(uids)
+        with mock.patch.object(
+                space, 'get_edges_many', counting_get_edges_many):
+            self.assertEqual(
+                namespace.most_frequent((), 1, frequency, bounds),
+                [(basis.str_to_vec('animals'), uids['animals'])])
+        self.assertLessEqual(len(fetched), len('animals') + 1)
+        self.assertEqual(namespace.fuzzy_names('anmal', 1),
+                         [('animal', uids['animal'], 1)])
+        self.assertEqual(
+            [(word, distance)
+             for word, _, distance in namespace.fuzzy_names('anim', 1)],
+            [('anim', 0), ('anime', 1)])
+        self.assertEqual(namespace.fuzzy_names('zzz', 1), [])
+        # Brute force check of the distances.
+        def distance(vec0, vec1):
+            row = list(range(len(vec1) + 1))
+            for index0, elem0 in enumerate(vec0, 1):
+                prev_row, row = row, [index0]
+                for index1, elem1 in enumerate(vec1, 1):
+                    row.append(min(row[-1] + 1, prev_row[index1] + 1,
+                                   prev_row[index1 - 1] + (elem0 != elem1)))
+            return row[-1]
+        for query in ('nt', 'animes', 'be', 'xanim'):
+            expected = sorted(
+                (word, distance(query, word)) for word in words
+                if distance(query, word) <= 2)
+            self.assertEqual(
+                sorted((word, dist) for word, _, dist in
+                       namespace.fuzzy_names(query, 2)), expected)
+
+    def test_trie_search(self):
+        self._check_trie_search(basis.ANOIInMemorySpace())
+        self._check_trie_search(compact.ANOICompactSpace())
+        self._check_trie_search(
+            cached.ANOICachedSpace(basis.ANOIInMemorySpace()))
+
+    @unittest.skipUnless(check_redis(), 'No Redis server found.')
+    def test_redis_trie_search(self):
+        for namespace in (b'XXX_test_search', b'XXX_test_search64'):
+            for key in redis_client.scan_iter(namespace + b'_*'):
+                redis_client.delete(key)
+        self._check_trie_search(
+            basis.ANOIRedis32Space(redis_client, 'XXX_test_search'))
+        self._check_trie_search(
+            redis64.ANOIRedis64Space(redis_client, 'XXX_test_search64'))
+
+    @unittest.skipUnless(check_redis(), 'No Redis server found.')
+    def test_redis_server_side_trie_and_compress(self):
+        space = basis.ANOIRedis32Space(redis_client, 'XXX_test_trie')
+        self.assertTrue(space.server_side_tries)
+        trie = basis.ANOITrie(space, space.get_uid())
+        client_trie = basis.ANOITrie(space, trie.root)
+        names = ('cat', 'cats', 'catalog', 'do', 'dog')
+        uids = {name: space.get_uid() for name in names}
+        for name, uid in uids.items():
+            self.assertEqual(trie.set_name(name, uid), uid)
+        text = basis.str_to_vec('a catalog of cats and dogs, cat, do')
+        space.server_side_tries = False
+        try:
+            for name, uid in uids.items():
+                self.assertEqual(client_trie.get_name(name), uid)
+            expected = basis.compress(client_trie, text)
+        finally:
+            space.server_side_tries = True
+        self.assertEqual(basis.compress(trie, text), expected)
+        self.assertEqual(basis.compress(trie, ()), ())
+        for name, uid in uids.items():
+            self.assertEqual(trie.get_name(name), uid)
+        NIL = basis.ANOIReserved.NIL.value
+        self.assertEqual(trie.get_name('ca'), NIL)
+        self.assertFalse(trie.has_name('catz'))
+
 
 if __name__ == '__main__':
     unittest.main()
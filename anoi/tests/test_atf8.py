@@ -0,0 +1,37 @@
+import random
+import unittest
+
+from .. import atf8
+
+
+class TestATF8(unittest.TestCase):
+    def test_lengths(self):
+        for uid, length in ((0, 1), (0x7f, 1), (0x80, 2), (0x7ff, 2),
+                            (0x800, 3), (0xffff, 3), (0x10ffff, 4),
+                            ((1 << 31) - 1, 6), ((1 << 36) - 1, 7),
+                            (1 << 36, 8), ((1 << 41) - 1, 8), (1 << 41, 9),
+                            ((1 << 64) - 1, 13)):
+            self.assertEqual(atf8.encoded_length(uid), length)
+            self.assertEqual(len(atf8.encode((uid,))), length)
+        self.assertEqual(atf8.encode(map(ord, 'résumé')),
+                         'résumé'.encode('utf-8'))
+        self.assertRaises(ValueError, atf8.encoded_length, -1)
+        self.assertRaises(ValueError, atf8.encoded_length, 1 << 66)
+
+    def test_round_trip(self):
+        rng = random.Random(0)
+        for _ in range(100):
+            vec = tuple(rng.randrange(1 << rng.randint(1, 64))
+                for _ in range(rng.randint(0, 200)))
+            encoded = atf8.encode(vec)
+            self.assertEqual(atf8.decode(encoded), vec)
+            self.assertEqual(atf8._decode_py(encoded), vec)
+
+    def test_invalid(self):
+        for data in (b'\x80', b'\xc3', b'\xff', b'\xff\xbf\x80', b'\xc3\xc3',
+                     b'a' * 100 + b'\xe0\x80'):
+            self.assertRaises(ValueError, atf8.decode, data)
+
+
+if __name__ == '__main__':
+    unittest.main()
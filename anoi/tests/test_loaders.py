@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+from .. import basis, loaders
+
+
+DOCUMENTS = (
+    'Preamble about a cat.\n\n# The cat\n\nThe cat sat on the mat.\n\n'
+    '## Dogs\n\n- a dog\n- another dog\n\n> The dog sat.\n',
+    '# Second\n\nNo sections below.\n',
+    'Just a line of text\n\nand another paragraph.\n',
+)
+
+
+class TestANOIArticleLoader(unittest.TestCase):
+    def _load(self, processes: int):
+        space = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace(space, 'test_articles')
+        for word in ('cat', 'dog', 'the ', 'sat on'):
+            namespace.set_name(word, space.get_uid())
+        loader = loaders.ANOIArticleLoader(namespace, batch_size=16)
+        return loader, loader.load(iter(DOCUMENTS), processes)
+
+    def _read(self, loader, article_uid):
+        space = loader.space
+        self.assertEqual(space.cross(article_uid, loader.namespace.TYPE),
+                         loader.article_uid)
+        def text(prop_uid):
+            return basis.vec_to_str(space.get_content(
+                space.cross(article_uid, prop_uid)))
+        sections = tuple(
+            basis.vec_to_str(loader.lexicon.decompress(
+                space.get_content(section_uid)))
+            for section_uid in space.get_content(article_uid))
+        return text(loader.title_uid), text(loader.origin_uid), sections
+
+    def test_load(self):
+        loader, articles = self._load(1)
+        self.assertEqual(len(articles), len(DOCUMENTS))
+        self.assertEqual(loader.articles, articles)
+        self.assertEqual(self._read(loader, articles[0]), (
+            'The cat', DOCUMENTS[0], (
+                'Preamble about a cat.',
+                'The cat\nThe cat sat on the mat.',
+                'Dogs\na dog\nanother dog\nThe dog sat.')))
+        self.assertEqual(self._read(loader, articles[1]), (
+            'Second', DOCUMENTS[1], ('Second\nNo sections below.',)))
+        self.assertEqual(self._read(loader, articles[2])[0],
+                         'Just a line of text')
+        space = loader.space
+        # Sections are compressed against the namespace.
+        section_uid = space.get_content(articles[0])[1]
+        self.assertIn(loader.namespace.get_name('cat'),
+                      space.get_content(section_uid))
+        self.assertLess(loader.uids, loader.characters)
+        self.assertEqual(space.cross(section_uid, loader.namespace.TYPE),
+                         loader.section_uid)
+        lexicon_atom = space.cross(articles[0], loader.lexicon_uid)
+        self.assertEqual(space.get_content(lexicon_atom),
+                         (loader.namespace.root,))
+        self.assertEqual(space.cross(articles[2], loader.lexicon_uid),
+                         lexicon_atom)
+        self.assertTrue(basis.vec_to_str(space.get_content(
+            space.cross(articles[0], loader.date_uid))).endswith('+00:00'))
+        # No pooled UIDs are left allocated.
+        self.assertFalse(any(space.is_valid_many(loader.uid_pool)))
+
+    def test_parallel_load(self):
+        serial_loader, serial = self._load(1)
+        parallel_loader, parallel = self._load(2)
+        self.assertEqual(
+            [self._read(serial_loader, uid) for uid in serial],
+            [self._read(parallel_loader, uid) for uid in parallel])
+
+    def test_iter_markdown(self):
+        with tempfile.TemporaryDirectory() as path:
+            os.mkdir(os.path.join(path, 'sub'))
+            for name, document in zip(
+                    ('b.md', 'sub/a.markdown', 'a.md'), DOCUMENTS):
+                with open(os.path.join(path, name), 'w') as file:
+                    file.write(document)
+            with open(os.path.join(path, 'notes.txt'), 'w') as file:
+                file.write('not markdown')
+            self.assertEqual(
+                list(loaders.iter_markdown(path)),
+                [DOCUMENTS[2], DOCUMENTS[0], DOCUMENTS[1]])
+            self.assertEqual(
+                list(loaders.iter_markdown(os.path.join(path, 'a.md'))),
+                [DOCUMENTS[2]])
@@ -0,0 +1,185 @@
+import unittest
+from unittest import mock
+
+from .. import basis, wordnet
+
+
+# A tiny corpus in place of NLTK's WordNet: synset name -> (definition,
+# lemma names, hypernym names, hyponym names).  It names each of the
+# properties the loader looks up.
+CORPUS = {
+    'word.n.01': ('a unit of language', ('word',), (),
+        ('lemma.n.01', 'hypernym.n.01', 'hyponym.n.01', 'antonym.n.01')),
+    'lemma.n.01': ('the word under which a set of forms is listed',
+        ('lemma',), ('word.n.01',), ()),
+    'synset.n.01': ('a set of one or more synonyms', ('synset',), (), ()),
+    'definition.n.01': ('a statement of the meaning of a word',
+        ('definition', 'gloss'), (), ()),
+    'antonym.n.01': ('a word that means the opposite of another word',
+        ('antonym', 'opposite_word'), ('word.n.01',), ()),
+    'synonym.n.01': ('a word that means the same as another word',
+        ('synonym',), (), ()),
+    'hypernym.n.01': ('a word that is more general than another word',
+        ('hypernym', 'superordinate'), ('word.n.01',), ()),
+    'hyponym.n.01': ('a word that is more specific than another word',
+        ('hyponym',), ('word.n.01',), ()),
+    'gloss.n.02': ('an explanatory note in the margin of a text',
+        ('Gloss',), (), ()),
+}
+ANTONYMS = {'antonym': 'synonym', 'synonym': 'antonym'}
+
+
+class FakeLemma:
+    def __init__(self, corpus: 'FakeWordNet', synset: 'FakeSynset',
+                 name: str):
+        self.corpus = corpus
+        self._synset = synset
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def synset(self):
+        return self._synset
+
+    def key(self):
+        return f'{self._name}%{self._synset.name()}'
+
+    def antonyms(self):
+        if self._name not in ANTONYMS:
+            return []
+        antonym = ANTONYMS[self._name]
+        return [self.corpus.synset(f'{antonym}.n.01').lemmas()[0]]
+
+
+class FakeSynset:
+    def __init__(self, corpus: 'FakeWordNet', name: str):
+        self.corpus = corpus
+        self._name = name
+        self._lemmas = [FakeLemma(corpus, self, lemma_name)
+            for lemma_name in CORPUS[name][1]]
+
+    def name(self):
+        return self._name
+
+    def definition(self):
+        return CORPUS[self._name][0]
+
+    def lemmas(self):
+        return self._lemmas
+
+    def hypernyms(self):
+        return [self.corpus.synset(name) for name in CORPUS[self._name][2]]
+
+    def hyponyms(self):
+        return [self.corpus.synset(name) for name in CORPUS[self._name][3]]
+
+
+class FakeWordNet:
+    def __init__(self):
+        self.synset_map = {name: FakeSynset(self, name) for name in CORPUS}
+
+    def all_synsets(self):
+        return iter(self.synset_map.values())
+
+    def synset(self, name: str):
+        return self.synset_map[name]
+
+    def lemmas(self, name: str):
+        '''Lemmas matching name, ignoring case, or else its singular (a
+        stand-in for morphy).'''
+        for form in (name.lower(), name.lower()[:-1]):
+            result = [lemma for synset in self.synset_map.values()
+                for lemma in synset.lemmas() if lemma.name().lower() == form]
+            if len(result) > 0:
+                return result
+        return []
+
+    def synsets(self, name: str):
+        return list(dict.fromkeys(
+            lemma.synset() for lemma in self.lemmas(name)))
+
+
+class TestANOIWordNetLoader(unittest.TestCase):
+    def _load(self, processes: int):
+        space = basis.ANOIInMemorySpace()
+        namespace = basis.ANOINamespace(space, 'wordnet')
+        loader = wordnet.ANOIWordNetLoader(namespace, batch_size=4)
+        # Worker processes are forked with the stub in place.
+        with mock.patch.object(wordnet, 'wn', FakeWordNet()):
+            loader.load(processes)
+        return loader
+
+    def _read(self, loader, synset_name):
+        space = loader.space
+        synset_uid = next(uid for synset, uid in loader.synset_map.items()
+            if synset.name() == synset_name)
+        def vec(prop_uid):
+            vec_uid = space.cross(synset_uid, prop_uid)
+            return () if vec_uid == basis.ANOIReserved.NIL.value else (
+                space.get_content(vec_uid))
+        definition = basis.vec_to_str(basis.decompress(
+            loader.namespace, vec(loader.definition_uid)))
+        return synset_uid, definition, vec(loader.hypernym_uid), vec(
+            loader.hyponym_uid)
+
+    def test_load(self):
+        loader = self._load(1)
+        self.assertTrue(loader.loaded)
+        space = loader.space
+        namespace = loader.namespace
+        self.assertEqual(len(loader.synset_map), len(CORPUS))
+        self.assertEqual(
+            set(loader.term_map),
+            {name.replace('_', ' ') for _, names, _, _ in CORPUS.values()
+                for name in names})
+        word_uid, definition, hypernyms, hyponyms = self._read(
+            loader, 'word.n.01')
+        self.assertEqual(definition, CORPUS['word.n.01'][0])
+        self.assertEqual(hypernyms, ())
+        self.assertEqual(hyponyms, tuple(self._read(loader, name)[0]
+            for name in CORPUS['word.n.01'][3]))
+        lemma_uid, definition, hypernyms, _ = self._read(loader, 'lemma.n.01')
+        self.assertEqual(definition, CORPUS['lemma.n.01'][0])
+        self.assertEqual(hypernyms, (word_uid,))
+        # Definitions are compressed against the namespace.
+        definition_uid = space.cross(lemma_uid, loader.definition_uid)
+        self.assertIn(namespace.get_name('word'),
+                      space.get_content(definition_uid))
+        self.assertEqual(space.cross(definition_uid, namespace.TYPE),
+                         loader.definition_uid)
+        # Terms link to their lemmas and synsets, and lemmas to antonyms.
+        # Like WordNet's own lookups, these ignore case.
+        definition_synset = self._read(loader, 'definition.n.01')[0]
+        note_synset = self._read(loader, 'gloss.n.02')[0]
+        for term in ('gloss', 'Gloss'):
+            term_uid = namespace.get_name(term)
+            self.assertEqual(space.get_content(space.cross(
+                term_uid, loader.synset_uid)),
+                (definition_synset, note_synset))
+            gloss_lemmas = space.get_content(space.cross(
+                term_uid, loader.lemma_uid))
+            self.assertEqual(
+                tuple(space.cross(lemma_uid, loader.synset_uid)
+                    for lemma_uid in gloss_lemmas),
+                (definition_synset, note_synset))
+        antonym_lemma, synonym_lemma = (uid
+            for lemma, uid in loader.lemma_map.items()
+            if lemma.name() in ('antonym', 'synonym'))
+        self.assertEqual(space.get_content(space.cross(
+            antonym_lemma, loader.antonym_uid)), (synonym_lemma,))
+        self.assertEqual(space.get_content(space.cross(
+            namespace.get_name('opposite word'), loader.synset_uid)),
+            (space.cross(antonym_lemma, loader.synset_uid),))
+        # No pooled UIDs are left allocated.
+        self.assertEqual(loader.uid_pool, [])
+
+    def test_parallel_load(self):
+        serial = self._load(1)
+        parallel = self._load(2)
+        self.assertEqual(serial.space.uid_map, parallel.space.uid_map)
+        self.assertEqual(serial.space.uid_content,
+                         parallel.space.uid_content)
+        self.assertEqual(
+            [self._read(serial, name) for name in CORPUS],
+            [self._read(parallel, name) for name in CORPUS])
@@ -1,16 +1,68 @@
-from typing import Dict, Iterable
+import argparse
+import multiprocessing
+from typing import (
+    Any, Callable, Dict, Iterator, List, Optional, Tuple)
 
 from nltk.corpus import wordnet as wn
 from nltk.corpus.reader.wordnet import Lemma, Synset
 import tqdm
 
-from . import basis
+from . import basis, mapped
+from .loaders.batch import ANOIBatchLoader
 
 
 NIL = basis.ANOIReserved.NIL.value
+# Version of the loader maps stored in snapshot metadata.
+SNAPSHOT_VERSION = 1
 
+# Per-process state for parallel loads, set by _init_worker().
+_worker_func: Optional[Callable[[Any, str], Any]] = None
+_worker_state: Any = None
 
-class ANOIWordNetLoader:
+
+def _init_worker(func: Callable[[Any, str], Any], state: Any) -> None:
+    global _worker_func, _worker_state
+    _worker_func = func
+    _worker_state = state
+
+
+def _run_chunk(chunk: List[str]) -> List[Any]:
+    return [_worker_func(_worker_state, item) for item in chunk]
+
+
+def _term_vecs(
+    state: Tuple[Dict[str, int], Dict[str, int]],
+    term: str
+) -> Tuple[Tuple[int], Tuple[int]]:
+    '''Returns the lemma and synset UID vectors for a term, as WordNet's
+    lemmas() and synsets() look it up (through morphy, ignoring case).
+    Lemmas are keyed by sense key and synsets by name, since WordNet objects
+    hash by those.'''
+    lemma_uids, synset_uids = state
+    lemma_name = term.replace(' ', '_')
+    return (
+        tuple(lemma_uids[lemma.key()] for lemma in wn.lemmas(lemma_name)),
+        tuple(synset_uids[synset.name()]
+            for synset in wn.synsets(lemma_name)))
+
+
+def _synset_vecs(
+    state: Tuple[Dict[str, int], basis.ANOIAutomaton],
+    synset_name: str
+) -> Tuple[Tuple[int], Tuple[int], Tuple[int]]:
+    '''Returns the hypernym, hyponym and compressed definition vectors for a
+    synset.  Synsets are keyed by name, since that is how WordNet objects
+    hash.'''
+    synset_uids, automaton = state
+    synset = wn.synset(synset_name)
+    return (
+        tuple(synset_uids[hypernym.name()]
+            for hypernym in synset.hypernyms()),
+        tuple(synset_uids[hyponym.name()] for hyponym in synset.hyponyms()),
+        automaton.compress(basis.str_to_vec(synset.definition())))
+
+
+class ANOIWordNetLoader(ANOIBatchLoader):
     lemma_uid: int = NIL
     synset_uid: int = NIL
     definition_uid: int = NIL
@@ -18,14 +70,17 @@ class ANOIWordNetLoader:
     hypernym_uid: int = NIL
     hyponym_uid: int = NIL
 
-    def __init__(self, namespace: basis.ANOINamespace, verbose: bool = False):
-        self.space = namespace.space
-        self.namespace = namespace
+    def __init__(
+        self,
+        namespace: basis.ANOINamespace,
+        verbose: bool = False,
+        batch_size: int = 4096
+    ):
+        super().__init__(namespace, verbose, batch_size)
         self.ns_proxy = basis.ANOITrieProxy(namespace)
         self.term_map: Dict[str, int] = {}
         self.lemma_map: Dict[Lemma, int] = {}
         self.synset_map: Dict[Synset, int] = {}
-        self.verbose: bool = verbose
         self.loaded = self.init_wordnet_props()
 
     def init_wordnet_props(self):
@@ -39,36 +94,29 @@ class ANOIWordNetLoader:
             setattr(self, uid_prop, prop_uid)
         return loaded
 
-    def build_vec(self, vec_uids: Iterable[int]) -> int:
-        result = self.space.get_uid()
-        self.space.set_content(result, tuple(vec_uids))
-        return result
-
     def define_everything(self):
+        '''Define every synset, lemma and term in a single pass over
+        WordNet.'''
         synset_iter = wn.all_synsets()
         if self.verbose:
-            synset_iter = tqdm.tqdm(list(synset_iter), 'define_synsets')
+            synset_iter = tqdm.tqdm(synset_iter, 'define_everything')
         for synset in synset_iter:
+            if synset in self.synset_map:
+                continue
             self.define_synset(synset)
-        all_lemma_names = set.union(
-            *(set(ss.lemma_names()) for ss in wn.all_synsets()))
-        all_lemmas = set.union(*(set(ss.lemmas()) for ss in wn.all_synsets()))
-        assert len(all_lemma_names) == len(all_lemmas)
-        for lemma_name in (
-                tqdm.tqdm(all_lemma_names, 'define_terms')
-                if self.verbose else all_lemma_names):
-            self.define_term(lemma_name.replace('_', ' '))
+            for lemma in synset.lemmas():
+                self.define_lemma(lemma)
+                term = lemma.name().replace('_', ' ')
+                if term not in self.term_map:
+                    self.define_term(term)
         self.definition_uid = self.term_map['definition']
-        for lemma in (
-                tqdm.tqdm(all_lemmas, 'define_lemmas')
-                if self.verbose else all_lemmas):
-            self.define_lemma(lemma)
+        self.release_uids()
 
     def define_lemma(self, lemma: Lemma) -> int:
         lemma_uid = self.lemma_map.get(lemma)
         if lemma_uid is None:
             # TODO: Could we check for a lemma's definition somehow?
-            lemma_uid = self.space.get_uid()
+            lemma_uid = self.new_uid()
             self.lemma_map[lemma] = lemma_uid
         return lemma_uid
 
@@ -77,7 +125,7 @@ class ANOIWordNetLoader:
         if synset_uid is None:
             # TODO: Is there some means to check for a synset's existence in a
             # space?  Could there be?
-            synset_uid = self.space.get_uid()
+            synset_uid = self.new_uid()
             self.synset_map[synset] = synset_uid
         return synset_uid
 
@@ -87,22 +135,49 @@ class ANOIWordNetLoader:
             assert self.namespace.get_name(term) == term_uid
         else:
             if term not in self.ns_proxy:
-                term_uid = self.space.get_uid()
+                term_uid = self.new_uid()
                 self.term_map[term] = term_uid
                 self.namespace.set_name(term, term_uid)
             else:
                 self.term_map[term] = term_uid = self.ns_proxy[term]
         return term_uid
 
-    def load(self):
+    def map_chunks(
+        self,
+        func: Callable[[Any, str], Any],
+        state: Any,
+        items: List[str],
+        processes: int = 1
+    ) -> Iterator[Any]:
+        '''Yield func(state, item) for each item, in order.  With more than
+        one process, items are sent to a process pool in chunks of
+        batch_size.
+        '''
+        if processes <= 1:
+            for item in items:
+                yield func(state, item)
+            return
+        chunks = [items[start:start + self.batch_size]
+            for start in range(0, len(items), self.batch_size)]
+        with multiprocessing.Pool(
+                processes, _init_worker, (func, state)) as pool:
+            for results in pool.imap(_run_chunk, chunks):
+                yield from results
+
+    def load(self, processes: int = 1):
+        '''Load WordNet into the space.  With more than one process, the
+        per-term and per-synset WordNet queries and definition compression
+        run in a process pool, while UID allocation and writes stay in this
+        process, so the resulting space is the same as a serial load's.
+        '''
         self.define_everything()
         if not self.init_wordnet_props():
             raise RuntimeError(
                 'failed to initialize common properties after defining all '
                 'terms in WordNet')
-        self.load_terms()
+        self.load_terms(processes)
         self.load_lemmas()
-        self.load_synsets()
+        self.load_synsets(processes)
         if self.verbose:
             self.report()
         self.loaded = True
@@ -112,77 +187,121 @@ class ANOIWordNetLoader:
         if self.verbose:
             map_iter = tqdm.tqdm(map_iter, desc='load_lemmas()')
         lemma_prop = self.term_map['lemma']
+        NAME = self.namespace.NAME
+        TYPE = self.namespace.TYPE
+        edges = []
+        contents = []
         for lemma, lemma_uid in map_iter:
             lemma_name = lemma.name()
             term_candidate = lemma_name.replace('_', ' ')
             if term_candidate in self.term_map:
                 name_uid = self.space.cross(
-                    self.term_map[term_candidate], self.namespace.NAME)
+                    self.term_map[term_candidate], NAME)
                 assert name_uid != NIL
-                self.space.cross_equals(
-                    lemma_uid, self.namespace.NAME, name_uid)
+                edges.append((lemma_uid, NAME, name_uid))
             else:
                 self.namespace.name_atom(lemma_uid, term_candidate)
-            self.space.cross_equals(
-                lemma_uid, self.synset_uid, self.synset_map[lemma.synset()])
+            edges.append(
+                (lemma_uid, self.synset_uid, self.synset_map[lemma.synset()]))
             antonyms = lemma.antonyms()
             if len(antonyms) > 0:
-                self.space.cross_equals(
-                    lemma_uid, self.antonym_uid, self.build_vec(
-                        self.lemma_map[antonym] for antonym in antonyms))
-            self.space.cross_equals(lemma_uid, self.namespace.TYPE, lemma_prop)
+                edges.append((lemma_uid, self.antonym_uid, self.build_vec(
+                    (self.lemma_map[antonym] for antonym in antonyms),
+                    contents)))
+            edges.append((lemma_uid, TYPE, lemma_prop))
+            self.flush(edges, contents)
+        self.flush(edges, contents, True)
 
-    def load_synsets(self):
-        map_iter = self.synset_map.items()
+    def load_synsets(self, processes: int = 1):
+        synset_uids = {synset.name(): synset_uid
+            for synset, synset_uid in self.synset_map.items()}
+        vecs_iter = self.map_chunks(
+            _synset_vecs, (synset_uids, basis.compile_trie(self.namespace)),
+            list(synset_uids.keys()), processes)
+        map_iter = zip(synset_uids.values(), vecs_iter)
         if self.verbose:
-            map_iter = tqdm.tqdm(map_iter, desc='load_synsets()')
+            map_iter = tqdm.tqdm(
+                map_iter, desc='load_synsets()', total=len(synset_uids))
         synset_prop = self.term_map['synset']
-        for synset, synset_uid in map_iter:
-            hypernyms = synset.hypernyms()
+        TYPE = self.namespace.TYPE
+        edges = []
+        contents = []
+        for synset_uid, (hypernyms, hyponyms, definition) in map_iter:
             if len(hypernyms) > 0:
-                self.space.cross_equals(
-                    synset_uid, self.hypernym_uid, self.build_vec(
-                        self.synset_map[hypernym] for hypernym in hypernyms
-                    )
-                )
-            hyponyms = synset.hyponyms()
+                edges.append((synset_uid, self.hypernym_uid, self.build_vec(
+                    hypernyms, contents)))
             if len(hyponyms) > 0:
-                self.space.cross_equals(
-                    synset_uid, self.hyponym_uid, self.build_vec(
-                        self.synset_map[hyponym] for hyponym in hyponyms))
-            definition_atom = self.build_vec(
-                basis.compress_iter(
-                    self.namespace, basis.str_to_vec(synset.definition())))
-            self.space.cross_equals(
-                synset_uid, self.definition_uid, definition_atom)
-            self.space.cross_equals(
-                definition_atom, self.namespace.TYPE, self.definition_uid)
-            self.space.cross_equals(
-                synset_uid, self.namespace.TYPE, synset_prop)
-
-    def load_terms(self):
-        map_iter = self.term_map.items()
-        if self.verbose:
-            map_iter = tqdm.tqdm(map_iter, desc='load_terms()')
+                edges.append((synset_uid, self.hyponym_uid, self.build_vec(
+                    hyponyms, contents)))
+            definition_atom = self.build_vec(definition, contents)
+            edges.append((synset_uid, self.definition_uid, definition_atom))
+            edges.append((definition_atom, TYPE, self.definition_uid))
+            edges.append((synset_uid, TYPE, synset_prop))
+            self.flush(edges, contents)
+        self.flush(edges, contents, True)
 
-        for term, term_uid in map_iter:
-            lemma_name = term.replace(' ', '_')
+    def load_terms(self, processes: int = 1):
+        state = (
+            {lemma.key(): lemma_uid
+                for lemma, lemma_uid in self.lemma_map.items()},
+            {synset.name(): synset_uid
+                for synset, synset_uid in self.synset_map.items()})
+        vecs_iter = self.map_chunks(
+            _term_vecs, state, list(self.term_map.keys()), processes)
+        map_iter = zip(self.term_map.values(), vecs_iter)
+        if self.verbose:
+            map_iter = tqdm.tqdm(
+                map_iter, desc='load_terms()', total=len(self.term_map))
+        edges = []
+        contents = []
+        for term_uid, (lemma_vec, synset_vec) in map_iter:
             # Link lemmas
-            lemmas_uid = self.build_vec(
-                self.lemma_map[lemma] for lemma in wn.lemmas(lemma_name))
-            self.space.cross_equals(term_uid, self.lemma_uid, lemmas_uid)
+            lemmas_uid = self.build_vec(lemma_vec, contents)
+            edges.append((term_uid, self.lemma_uid, lemmas_uid))
             # Link synsets
-            synsets_uid = self.build_vec(
-                self.synset_map[synset] for synset in wn.synsets(lemma_name))
-            self.space.cross_equals(term_uid, self.synset_uid, synsets_uid)
+            synsets_uid = self.build_vec(synset_vec, contents)
+            edges.append((term_uid, self.synset_uid, synsets_uid))
+            self.flush(edges, contents)
+        self.flush(edges, contents, True)
+
+    def save_snapshot(self, path: str, content_encoding: str = 'uint32'):
+        '''Write the space and the loader's maps to a snapshot: a space file
+        (see anoi.mapped) that stores the maps in its metadata, with lemmas
+        keyed by sense key and synsets by name.
+        '''
+        mapped.dump_space(self.space, path, self.batch_size, content_encoding,
+            {
+                'wordnet_snapshot': SNAPSHOT_VERSION,
+                'term_map': self.term_map,
+                'lemma_map': {lemma.key(): lemma_uid
+                    for lemma, lemma_uid in self.lemma_map.items()},
+                'synset_map': {synset.name(): synset_uid
+                    for synset, synset_uid in self.synset_map.items()},
+            })
+
+    def restore_maps(self, space: mapped.ANOIMappedSpace):
+        '''Restore the maps stored by save_snapshot().  This looks up every
+        lemma and synset in WordNet, so it is only needed to keep loading
+        into a restored space, not to browse one.
+        '''
+        metadata = space.metadata
+        version = metadata.get('wordnet_snapshot')
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(
+                f'{space.path} has unsupported snapshot version {version}')
+        self.term_map.update(metadata['term_map'])
+        self.lemma_map.update((wn.lemma_from_key(key), lemma_uid)
+            for key, lemma_uid in metadata['lemma_map'].items())
+        self.synset_map.update((wn.synset(name), synset_uid)
+            for name, synset_uid in metadata['synset_map'].items())
 
     def report(self):
-        characters = 0
-        uids = 0
-        for synset, synset_uid in self.synset_map.items():
-            characters += len(synset.definition())
-            uids += len(self.space.get_content(
-                self.space.cross(synset_uid, self.definition_uid)))
+        characters = sum(
+            len(synset.definition()) for synset in self.synset_map.keys())
+        definition_uids = self.space.cross_many(
+            (synset_uid, self.definition_uid)
+            for synset_uid in self.synset_map.values())
+        uids = sum(map(len, self.space.get_content_many(definition_uids)))
         print(f'Total definitions in code points: {characters}')
         print(f'Total definitions in UIDs: {uids}')
         print(f'Compression ratio: 1:{characters/uids}')
@@ -190,13 +309,24 @@ class ANOIWordNetLoader:
             print(f'Allocated atom count: {len(self.space.uid_map)}')
 
 
-def main(verbose: bool = False):
+def main(
+    verbose: bool = False,
+    processes: int = 1,
+    snapshot: Optional[str] = None
+):
     space = basis.ANOIInMemorySpace()
     namespace = basis.ANOINamespace(space, 'wordnet')
     loader = ANOIWordNetLoader(namespace, verbose=verbose)
-    loader.load()
+    loader.load(processes)
+    if snapshot is not None:
+        loader.save_snapshot(snapshot)
     return namespace
 
 
 if __name__ == '__main__':
-    main(True)
+    parser = argparse.ArgumentParser(
+        description='Load WordNet into an in-memory space.')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--snapshot', help='write a snapshot to this path')
+    parsed = parser.parse_args()
+    main(True, parsed.processes, parsed.snapshot)
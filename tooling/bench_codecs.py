@@ -0,0 +1,93 @@
+'''Micro-benchmarks of the content codecs on WordNet-sized definitions,
+comparing the buffer based conversions against the per-character ones they
+replaced.
+
+Uses the WordNet definitions if NLTK has them, otherwise synthetic ones of
+similar length:
+
+$ python -m tooling.bench_codecs --definitions 20000
+'''
+
+import argparse
+import random
+import string
+import struct
+import time
+
+from anoi import basis, compact
+
+
+def old_str_to_vec(in_str):
+    return tuple(ord(ch) for ch in in_str)
+
+
+def old_vec_to_str(in_vec):
+    return ''.join(map(chr, in_vec))
+
+
+def old_istob(uid_vec):
+    return struct.pack(f'<{len(uid_vec)}I', *uid_vec)
+
+
+def load_definitions(count: int, seed: int = 0):
+    try:
+        from nltk.corpus import wordnet as wn
+        definitions = [synset.definition() for synset in wn.all_synsets()]
+    except LookupError:
+        rng = random.Random(seed)
+        words = [''.join(rng.choice(string.ascii_lowercase)
+            for _ in range(rng.randint(2, 10))) for _ in range(5000)]
+        # WordNet definitions average about ten words.
+        definitions = [' '.join(rng.choice(words)
+            for _ in range(rng.randint(3, 20))) for _ in range(count)]
+    return definitions[:count]
+
+
+def timed(name: str, func, items, baseline=None):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    elapsed = time.perf_counter() - start
+    speedup = f', {baseline / elapsed:.1f}x' if baseline else ''
+    print(f'{name}: {1e9 * elapsed / len(items):.0f} ns/definition'
+        f'{speedup}')
+    return elapsed
+
+
+def main(*args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--definitions', type=int, default=20000)
+    parsed = parser.parse_args(*args)
+    definitions = load_definitions(parsed.definitions)
+    vecs = [basis.str_to_vec(definition) for definition in definitions]
+    arrays = [basis.str_to_array(definition) for definition in definitions]
+    packed = [basis.ANOIRedis32Space.istob(vec) for vec in vecs]
+    print(f'{len(definitions)} definitions, '
+        f'{sum(map(len, definitions)) / len(definitions):.0f} characters '
+        'on average')
+    Redis32 = basis.ANOIRedis32Space
+    baseline = timed('str_to_vec, per character', old_str_to_vec,
+        definitions)
+    timed('str_to_vec', basis.str_to_vec, definitions, baseline)
+    timed('str_to_array', basis.str_to_array, definitions, baseline)
+    baseline = timed('vec_to_str, per character', old_vec_to_str, vecs)
+    timed('vec_to_str', basis.vec_to_str, vecs, baseline)
+    timed('vec_to_str of an array', basis.vec_to_str, arrays, baseline)
+    baseline = timed('istob, struct', old_istob, vecs)
+    timed('istob', Redis32.istob, vecs, baseline)
+    timed('istob of an array', Redis32.istob, arrays, baseline)
+    baseline = timed('btois', Redis32.btois, packed)
+    timed('btoa', Redis32.btoa, packed, baseline)
+    # Reading contents back as text from a compact space.
+    space = compact.ANOICompactSpace()
+    uids = space.get_uids(len(vecs))
+    space.set_content_many(zip(uids, vecs))
+    baseline = timed('get_content + vec_to_str, per character',
+        lambda uid: old_vec_to_str(space.get_content(uid)), uids)
+    timed('get_content_view + vec_to_str',
+        lambda uid: basis.vec_to_str(space.get_content_view(uid)), uids,
+        baseline)
+
+
+if __name__ == '__main__':
+    main()
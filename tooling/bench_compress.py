@@ -0,0 +1,64 @@
+'''Benchmark client-side versus server-side (Lua) compression against a local
+Redis server.
+
+$ python -m tooling.bench_compress --host localhost --port 6379
+'''
+
+import argparse
+import random
+import time
+
+import redis
+
+from anoi import basis
+
+
+def make_lexicon(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz'
+    return sorted(set(
+        ''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 10)))
+        for _ in range(count)))
+
+
+def make_documents(lexicon, count: int, words: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(lexicon) for _ in range(words))
+        for _ in range(count)]
+
+
+def main(*args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--namespace', default='XXX_bench_compress')
+    parser.add_argument('--terms', type=int, default=5000)
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--words', type=int, default=20)
+    parsed = parser.parse_args(*args)
+    db = redis.Redis(parsed.host, parsed.port)
+    for key in db.scan_iter(parsed.namespace.encode() + b'_*'):
+        db.delete(key)
+    space = basis.ANOIRedis32Space(db, parsed.namespace)
+    namespace = basis.ANOINamespace(space, 'bench')
+    lexicon = make_lexicon(parsed.terms)
+    for term in lexicon:
+        namespace.set_name(term, space.get_uid())
+    documents = [basis.str_to_vec(document) for document in make_documents(
+        lexicon, parsed.documents, parsed.words)]
+    code_points = sum(map(len, documents))
+    results = {}
+    for server_side in (False, True):
+        space.server_side_tries = server_side
+        start = time.perf_counter()
+        results[server_side] = [
+            basis.compress(namespace, document) for document in documents]
+        elapsed = time.perf_counter() - start
+        label = 'server-side' if server_side else 'client-side'
+        print(f'{label}: {elapsed:.3f}s, '
+            f'{code_points / elapsed:.0f} code points/s')
+    assert results[False] == results[True], 'compression results differ'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''Compare Redis memory use of the 32-bit and bucketed 64-bit spaces on a
+WordNet-sized synthetic load.  Best run against an otherwise idle Redis
+server, since memory is measured with INFO:
+
+$ python -m tooling.bench_redis_memory --atoms 500000
+'''
+
+import argparse
+import random
+
+import redis
+
+from anoi import basis, redis64
+
+
+def populate(space: basis.ANOISpace, atoms: int, seed: int = 0,
+        batch_size: int = 4096) -> int:
+    '''Add atoms with short contents and a few edges each, returning the
+    number of edges written.'''
+    rng = random.Random(seed)
+    uids = list(space.get_uids(atoms))
+    edges = []
+    contents = []
+    edge_count = 0
+    for uid in uids:
+        contents.append((uid, tuple(
+            rng.randrange(0x20, 0x7f) for _ in range(rng.randint(0, 40)))))
+        for _ in range(rng.randint(1, 4)):
+            edges.append((uid, rng.choice(uids), rng.choice(uids)))
+        if len(edges) >= batch_size:
+            edge_count += len(edges)
+            space.set_content_many(contents)
+            space.cross_equals_many(edges)
+            edges.clear()
+            contents.clear()
+    edge_count += len(edges)
+    space.set_content_many(contents)
+    space.cross_equals_many(edges)
+    return edge_count
+
+
+def clear(db: redis.Redis, prefix: bytes) -> None:
+    for key in db.scan_iter(prefix + b'*'):
+        db.delete(key)
+
+
+def main(*args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--atoms', type=int, default=500000)
+    parser.add_argument('--bucket-bits', type=int, default=5)
+    parsed = parser.parse_args(*args)
+    db = redis.Redis(parsed.host, parsed.port)
+    spaces = {
+        'ANOIRedis32Space': lambda namespace: basis.ANOIRedis32Space(
+            db, namespace),
+        'ANOIRedis64Space': lambda namespace: redis64.ANOIRedis64Space(
+            db, namespace, parsed.bucket_bits),
+    }
+    for name, make_space in spaces.items():
+        # Cleared before the space is made, since the 64-bit space keeps the
+        # bucket size of an earlier run.
+        namespace = f'XXX_bench_{name}'
+        clear(db, namespace.encode() + b'_')
+        space = make_space(namespace)
+        before = db.info('memory')['used_memory']
+        keys_before = db.dbsize()
+        edges = populate(space, parsed.atoms)
+        used = db.info('memory')['used_memory'] - before
+        print(f'{name}: {used / parsed.atoms:.1f} bytes/atom, '
+            f'{used / edges:.1f} bytes/edge (including contents), '
+            f'{db.dbsize() - keys_before} keys')
+        clear(db, space.namespace)
+
+
+if __name__ == '__main__':
+    main()
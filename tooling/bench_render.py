@@ -0,0 +1,154 @@
+'''Measure ANOIFacade.render_uid() throughput on synset pages, comparing the
+batched render path against the previous one that made several space calls
+per UID on the page.
+
+Uses a WordNet snapshot if one is given, otherwise a synthetic WordNet-like
+namespace:
+
+$ python -m tooling.bench_render --snapshot wordnet.anoi --pages 2000
+$ python -m tooling.bench_render --synsets 5000 --latency-ms 0.2
+'''
+
+import argparse
+import functools
+import random
+import string
+import time
+
+from anoi import basis, facade
+
+
+SPACE_METHODS = (
+    'cross', 'cross_equals', 'free_uid', 'get_content', 'get_keys',
+    'get_uid', 'get_uids', 'is_valid', 'iter_uids', 'set_content',
+    'validate', 'cross_many', 'cross_equals_many', 'get_content_many',
+    'get_keys_many', 'get_edges_many', 'is_valid_many', 'set_content_many',
+    'get_version')
+
+
+class CountingSpace(basis.ANOISpace):
+    '''Forwards to another space, counting calls (round trips, for a remote
+    space).'''
+    def __init__(self, space: basis.ANOISpace, latency: float = 0.):
+        self.space = space
+        self.latency = latency
+        self.calls = 0
+
+
+def _forward(name):
+    def forward(self, *args):
+        self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return getattr(self.space, name)(*args)
+    forward.__name__ = name
+    return forward
+
+
+for _name in SPACE_METHODS:
+    setattr(CountingSpace, _name, _forward(_name))
+
+
+class PerUIDFacade(facade.ANOIFacade):
+    '''The render path as it was before render_fragments().'''
+    def __init__(self, *args, **kws):
+        super().__init__(*args, **kws)
+        self.uid_to_html = functools.lru_cache(maxsize=65536)(
+            self._uid_to_html)
+
+    def _uid_to_html(self, uid):
+        valid = self.space.is_valid(uid)
+        if uid < 0x110000 and (char := chr(uid)).isprintable():
+            uid_str = f'{char}'
+        elif uid in basis.ANOIReservedSet:
+            uid_str = basis.ANOIReserved(uid).name
+        elif valid and (
+            (name := self.space.cross(uid, self.name_uid)) !=
+            basis.ANOIReserved.NIL.value
+        ):
+            uid_str = basis.vec_to_str(self.space.get_content(name))
+        else:
+            uid_str = hex(uid)
+        return f'<a href="{hex(uid)}">{uid_str}</a>' if valid else uid_str
+
+    def render_uid(self, uid: int) -> str:
+        uid_to_html = self.uid_to_html
+        space = self.space
+        if not space.is_valid(uid):
+            raise ValueError()
+        keys = sorted(space.get_keys(uid))
+        values = space.cross_many((uid, key) for key in keys)
+        navbar = ''.join(
+            f'<li>{uid_to_html(key)} : {uid_to_html(value)}</li>'
+            for key, value in zip(keys, values))
+        contents = ''.join(
+            uid_to_html(child) for child in space.get_content(uid))
+        return f'<ul>{navbar}</ul><p>{contents}</p>'
+
+
+def build_synthetic(synsets: int, seed: int = 0):
+    '''Returns an in-memory space with a WordNet-like namespace, and the
+    UIDs of its synsets.'''
+    rng = random.Random(seed)
+    space = basis.ANOIInMemorySpace()
+    namespace = basis.ANOINamespace(space, 'wordnet')
+    props = ('lemma', 'synset', 'definition', 'antonym', 'hypernym',
+        'hyponym')
+    words = list(props) + [''.join(rng.choice(string.ascii_lowercase)
+        for _ in range(rng.randint(3, 10))) for _ in range(2000)]
+    for word in words:
+        if word not in basis.ANOITrieProxy(namespace):
+            namespace.set_name(word, space.get_uid())
+    terms = {word: namespace.get_name(word) for word in words}
+    automaton = basis.compile_trie(namespace)
+    synset_uids = space.get_uids(synsets)
+    for index, synset_uid in enumerate(synset_uids):
+        namespace.name_atom(synset_uid, f'{rng.choice(words)}.n.{index}')
+        definition = space.get_uid()
+        space.set_content(definition, automaton.compress(basis.str_to_vec(
+            ' '.join(rng.choice(words) for _ in range(rng.randint(5, 25))))))
+        hypernyms = space.get_uid()
+        space.set_content(hypernyms, tuple(
+            rng.choice(synset_uids) for _ in range(rng.randint(1, 3))))
+        space.cross_equals_many((
+            (synset_uid, terms['definition'], definition),
+            (synset_uid, terms['hypernym'], hypernyms),
+            (synset_uid, namespace.TYPE, terms['synset']),
+        ))
+    return space, synset_uids
+
+
+def main(*args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--snapshot')
+    parser.add_argument('--synsets', type=int, default=5000)
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--latency-ms', type=float, default=0.,
+        help='simulated round trip time per space call')
+    parsed = parser.parse_args(*args)
+    if parsed.snapshot is not None:
+        source = facade.ANOIFacade(parsed.snapshot)
+        space = source.space
+        synset_uids = tuple(space.metadata['synset_map'].values())
+    else:
+        space, synset_uids = build_synthetic(parsed.synsets)
+    pages = random.Random(1).sample(
+        synset_uids, min(parsed.pages, len(synset_uids)))
+    for name, facade_cls in (('per-UID', PerUIDFacade),
+            ('batched', facade.ANOIFacade)):
+        counting = CountingSpace(space, parsed.latency_ms / 1000)
+        page_facade = facade_cls(counting)
+        # Each page renders its synset and its definition atom.
+        definition_uid = page_facade.loader.definition_uid
+        counting.calls = 0
+        start = time.perf_counter()
+        for uid in pages:
+            page_facade.render_uid(uid)
+            page_facade.render_uid(space.cross(uid, definition_uid))
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {2 * len(pages) / elapsed:.0f} pages/s, '
+            f'{counting.calls / (2 * len(pages)):.1f} space calls/page')
+
+
+if __name__ == '__main__':
+    main()
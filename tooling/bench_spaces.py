@@ -0,0 +1,53 @@
+'''Compare the memory footprint of in-memory space implementations.
+
+$ python -m tooling.bench_spaces --atoms 200000
+'''
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from anoi import basis, compact
+
+
+SPACES = {
+    'ANOIInMemorySpace': basis.ANOIInMemorySpace,
+    'ANOICompactSpace': compact.ANOICompactSpace,
+}
+
+
+def populate(space: basis.ANOISpace, atoms: int, seed: int = 0) -> None:
+    '''Build a WordNet-like load: short contents, a few edges per atom.'''
+    rng = random.Random(seed)
+    uids = list(space.get_uids(atoms))
+    for uid in uids:
+        space.set_content(uid, tuple(
+            rng.randrange(0x20, 0x7f) for _ in range(rng.randint(0, 40))))
+        for _ in range(rng.randint(1, 4)):
+            space.cross_equals(uid, rng.choice(uids), rng.choice(uids))
+
+
+def main(*args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--atoms', type=int, default=200000)
+    parsed = parser.parse_args(*args)
+    for name, space_cls in SPACES.items():
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        space = space_cls()
+        populate(space, parsed.atoms)
+        if hasattr(space, 'compact'):
+            space.compact()
+        elapsed = time.perf_counter() - start
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name}: {current / parsed.atoms:.1f} bytes/atom, '
+            f'{elapsed:.2f}s to populate')
+        del space
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''Compare wall time and peak RSS of the single-pass WordNet loader against
+the previous multi-pass one.  Each loader runs in a fresh process:
+
+$ python -m tooling.bench_wordnet_load --processes 4
+'''
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+from nltk.corpus import wordnet as wn
+import tqdm
+
+from anoi import basis, wordnet
+
+
+class MultiPassLoader(wordnet.ANOIWordNetLoader):
+    '''The loader as it was before define_everything() became a single
+    pass: three traversals of all synsets, and per-term WordNet queries in
+    load_terms().'''
+    def define_everything(self):
+        synset_iter = wn.all_synsets()
+        if self.verbose:
+            synset_iter = tqdm.tqdm(list(synset_iter), 'define_synsets')
+        for synset in synset_iter:
+            self.define_synset(synset)
+        all_lemma_names = set.union(
+            *(set(ss.lemma_names()) for ss in wn.all_synsets()))
+        all_lemmas = set.union(*(set(ss.lemmas()) for ss in wn.all_synsets()))
+        for lemma_name in all_lemma_names:
+            self.define_term(lemma_name.replace('_', ' '))
+        self.definition_uid = self.term_map['definition']
+        for lemma in all_lemmas:
+            self.define_lemma(lemma)
+        self.release_uids()
+
+    def load_terms(self):
+        edges = []
+        contents = []
+        for term, term_uid in self.term_map.items():
+            lemma_name = term.replace(' ', '_')
+            edges.append((term_uid, self.lemma_uid, self.build_vec(
+                (self.lemma_map[lemma] for lemma in wn.lemmas(lemma_name)),
+                contents)))
+            edges.append((term_uid, self.synset_uid, self.build_vec(
+                (self.synset_map[synset]
+                    for synset in wn.synsets(lemma_name)),
+                contents)))
+            self.flush(edges, contents)
+        self.flush(edges, contents, True)
+
+
+LOADERS = {
+    'multi-pass': MultiPassLoader,
+    'single-pass': wordnet.ANOIWordNetLoader,
+}
+
+
+def run(name: str, processes: int, results: multiprocessing.Queue) -> None:
+    wn.ensure_loaded()
+    namespace = basis.ANOINamespace(basis.ANOIInMemorySpace(), 'wordnet')
+    loader = LOADERS[name](namespace)
+    define_everything = loader.define_everything
+    define_time = 0.
+    def timed_define_everything():
+        nonlocal define_time
+        define_start = time.perf_counter()
+        define_everything()
+        define_time = time.perf_counter() - define_start
+    loader.define_everything = timed_define_everything
+    start = time.perf_counter()
+    loader.load(processes)
+    load_time = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((define_time, load_time, peak))
+
+
+def main(*args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=1)
+    parsed = parser.parse_args(*args)
+    context = multiprocessing.get_context('spawn')
+    for name in LOADERS:
+        results = context.Queue()
+        process = context.Process(
+            target=run, args=(name, parsed.processes, results))
+        process.start()
+        define_time, load_time, peak = results.get()
+        process.join()
+        print(f'{name}: define_everything() {define_time:.1f}s, '
+            f'load() {load_time:.1f}s, '
+            f'peak RSS {peak / 1024:.0f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 '''Web application for A Network of Ideas.
 '''
 
-from flask import Flask, redirect, url_for
+import os
+
+from flask import Flask, Response, jsonify, redirect, request, url_for
 from werkzeug.exceptions import NotFound
 from markupsafe import escape
 
@@ -10,6 +12,10 @@ from anoi.facade import get_facade
 
 
 NIL = basis.ANOIReserved.NIL.value
+# Serve a snapshot written by "python -m anoi.wordnet --snapshot PATH" if
+# one is given, rather than loading WordNet on the first request.
+FACADE_ARGS = (
+    (os.environ['ANOI_SNAPSHOT'],) if 'ANOI_SNAPSHOT' in os.environ else ())
 
 
 app = Flask(__name__)
@@ -36,15 +42,37 @@ def viewer(title):
 
 @app.route('/nav/<uid>')
 def nav(uid: str):
-    my_facade = get_facade()
+    my_facade = get_facade(*FACADE_ARGS)
     try:
         if uid.startswith('0x'):
             uid = int(uid[2:], 16)
         else:
             uid = int(uid)
-        return my_facade.render_uid(uid)
     except ValueError:
         raise NotFound()
+    if not my_facade.space.is_valid(uid):
+        raise NotFound()
+    # Pages only change along with the space, so a client holding the
+    # current tag gets a 304 without the page being rendered.
+    etag = my_facade.etag(uid)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        try:
+            response = Response(my_facade.render_uid(uid))
+        except ValueError:
+            raise NotFound()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/complete/<prefix>')
+def complete(prefix: str):
+    my_facade = get_facade(*FACADE_ARGS)
+    return jsonify([
+        {'name': name, 'uid': hex(uid), 'href': url_for('nav', uid=hex(uid))}
+        for name, uid in my_facade.complete(prefix)])
 
 
 if __name__ == "__main__":